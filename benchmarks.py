@@ -0,0 +1,443 @@
+import argparse, contextlib, json, os, platform, socket, statistics, sys, tempfile, threading, time
+
+from block import calculate_merkle_root, mine_block, load_block
+from broadcast import Broadcaster
+from blockchain import BlockChain
+from fork_store import ForkStore
+from mempool_journal import MempoolJournal
+from peer import CODECS, Peer, read_line
+from prune_report import synthetic_chain
+from transactions import Transaction
+
+
+def make_transactions(n):
+    """
+    Build n signed MINT transactions for distinct artworks.
+
+    Args:
+        n (int): number of transactions
+
+    Returns:
+        list: Transaction objects
+    """
+    txs = []
+    for i in range(n):
+        tx = Transaction("MINT", f"artist{i % 97}", f"BENCH{i}", "")
+        tx.sign("MINT")
+        txs.append(tx)
+    return txs
+
+
+def timed(fn, repeat, number=1):
+    """
+    Time fn: repeat samples of number calls each.
+
+    Args:
+        fn (callable): function to time, called with no arguments
+        repeat (int): number of samples
+        number (int): calls per sample
+
+    Returns:
+        tuple: (median seconds per call, fastest seconds per call)
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return statistics.median(samples), min(samples)
+
+
+class Suite:
+    """
+    Collects benchmark results and prints them as they come in.
+    """
+    def __init__(self, repeat):
+        """
+        Initialize the suite.
+
+        Args:
+            repeat (int): samples taken for each measurement
+        """
+        self.repeat = repeat
+        self.results = []
+
+
+    def record(self, name, param, fn, number=1, repeat=None):
+        """
+        Time one case and remember the result.
+
+        Args:
+            name (str): benchmark name, e.g. "merkle_root"
+            param (str): what this point of the scaling curve is, e.g. "txs=100"
+            fn (callable): the operation to time
+            number (int): calls per sample (raise for very fast operations)
+            repeat (int): samples, defaults to the suite's
+        """
+        median, fastest = timed(fn, repeat or self.repeat, number)
+        self.add(name, param, median, fastest)
+
+
+    def add(self, name, param, median, fastest):
+        """
+        Remember and print a result measured some other way than record().
+        """
+        self.results.append({"name": name, "param": param, "median_s": median, "min_s": fastest})
+        print(f"{name:<22} {param:<28} median {format_seconds(median):>10}  min {format_seconds(fastest):>10}", flush=True)
+
+
+def format_seconds(seconds):
+    """
+    Format a duration with a unit that keeps it readable.
+    """
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.2f}s"
+
+
+def bench_block_ops(suite, sizes):
+    """
+    Merkle roots, validation, header hashing and dict round-trips across
+    transaction counts.
+    """
+    for n in sizes:
+        txs = make_transactions(n)
+        suite.record("merkle_root", f"txs={n}", lambda: calculate_merkle_root(txs))
+
+        block = mine_block(1, "00" * 32, txs, 1, None, 0, 0)
+
+        suite.record("block_validate", f"txs={n}", block.validate)
+
+        data = block.to_dict()
+        suite.record("block_to_dict", f"txs={n}", block.to_dict)
+        suite.record("load_block", f"txs={n}", lambda: load_block(data))
+        suite.record("dict_roundtrip_json", f"txs={n}", lambda: load_block(json.loads(json.dumps(block.to_dict()))))
+
+    header = mine_block(1, "00" * 32, make_transactions(1), 1, None, 0, 0).header
+    suite.record("header_to_bytes", "", header.to_bytes, number=10000)
+    suite.record("hash_header", "", header.hash_header, number=10000)
+
+
+def bench_mining(suite, difficulties):
+    """
+    mine_block at fixed difficulties (the mean over the samples is what
+    matters, since the work per block is random).
+    """
+    txs = make_transactions(10)
+    counter = [0]
+
+    def mine(difficulty):
+        counter[0] += 1
+        mine_block(counter[0], "00" * 32, txs, difficulty, None, 0, 0)
+
+    for difficulty in difficulties:
+        suite.record("mine_block", f"difficulty={difficulty}", lambda: mine(difficulty),
+                     repeat=max(suite.repeat, 20))
+
+
+def bench_chain_io(suite, chain_sizes, workdir):
+    """
+    BlockChain.save and load, and already_minted, across chain lengths.
+    """
+    for n in chain_sizes:
+        path = os.path.join(workdir, f"chain_{n}.json")
+        chain = synthetic_chain(path, n, 1)
+        suite.record("chain_save", f"blocks={n}", lambda: chain.save(path), repeat=3)
+
+        def load():
+            BlockChain().load(path)
+
+        suite.record("chain_load", f"blocks={n}", load, repeat=3)
+        suite.record("already_minted", f"blocks={n} hit", lambda: chain.already_minted("ART1-0"), number=10000)
+        suite.record("already_minted", f"blocks={n} miss", lambda: chain.already_minted("NOPE"), number=10000)
+
+
+def forked_peer(main_length, forks, depth):
+    """
+    Build a peer whose block set holds a main chain plus side branches.
+
+    Args:
+        main_length (int): blocks in the main chain
+        forks (int): number of side branches, spread over the last 50 blocks
+        depth (int): blocks in each side branch
+
+    Returns:
+        Peer: peer with blockchain and all_blocks filled in, not connected
+    """
+    peer = Peer("127.0.0.1", 0, "127.0.0.1", 0)
+    peer.blockchain = synthetic_chain(os.devnull, main_length - 1, 1)
+    peer.all_blocks = ForkStore()
+    for blk in peer.blockchain.blocks:
+        peer.all_blocks[blk.get_id()] = blk
+    for f in range(forks):
+        parent = peer.blockchain.blocks[max(0, main_length - 1 - (f % 50) - 1)]
+        for d in range(depth):
+            tx = Transaction("MINT", "forker", f"FORK{f}-{d}", "") # keeps sibling branches distinct
+            tx.sign("MINT")
+            blk = mine_block(parent.header.block_num + 1, parent.get_id(), [tx], 1, None, 0, 0)
+            peer.all_blocks[blk.get_id()] = blk
+            parent = blk
+    return peer
+
+
+def bench_fork_choice(suite, cases):
+    """
+    Peer.find_longest_chain over forked block sets.
+    """
+    for (main_length, forks, depth) in cases:
+        peer = forked_peer(main_length, forks, depth)
+        suite.record("find_longest_chain", f"main={main_length} forks={forks}x{depth}",
+                     peer.find_longest_chain, repeat=5)
+
+
+def bench_snapshots(suite, reader_counts, seconds):
+    """
+    Block acceptance while reader threads query ownership and provenance,
+    with the readers either taking the chain lock for each batch of
+    queries (how the UI used to read) or reading a ChainView snapshot.
+
+    Reports the median add_to_chain time and the time per query.
+    """
+    chain = synthetic_chain(os.devnull, 2000, 10)
+    chain.publish(rebuild=True)
+    artworks = [f"ART{height}-{i}" for height in range(1, 2000, 2) for i in range(10)][:200]
+    lock = threading.Lock()
+    counter = [0]
+
+    def next_block():
+        counter[0] += 1
+        tx = Transaction("MINT", "bench", f"SNAP{counter[0]}", "")
+        tx.sign("MINT")
+        return mine_block(len(chain.blocks), chain.blocks[-1].get_id(), [tx], 1, None, 0, 0)
+
+    for readers in reader_counts:
+        for mode in ("lock", "snapshot"):
+            stop = threading.Event()
+            queries = [0]
+
+            def reader():
+                while not stop.is_set():
+                    if mode == "lock":
+                        with lock:
+                            for artwork in artworks:
+                                chain.owner_of(artwork), chain.history_of(artwork)
+                    else:
+                        view = chain.snapshot()
+                        for artwork in artworks:
+                            view.owner_of(artwork), view.history_of(artwork)
+                    queries[0] += len(artworks)
+
+            threads = [threading.Thread(target=reader, daemon=True) for _ in range(readers)]
+            for t in threads:
+                t.start()
+            accept_times = []
+            started = time.perf_counter()
+            with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+                while time.perf_counter() - started < seconds:
+                    block = next_block()
+                    t0 = time.perf_counter()
+                    with lock:
+                        chain.add_to_chain(block)
+                    accept_times.append(time.perf_counter() - t0)
+            elapsed = time.perf_counter() - started
+            stop.set()
+            for t in threads:
+                t.join()
+            suite.add("block_accept", f"readers={readers} {mode}", statistics.median(accept_times), min(accept_times))
+            if readers:
+                per_query = elapsed / max(1, queries[0])
+                suite.add("read_query", f"readers={readers} {mode}", per_query, per_query)
+
+
+def listening_socket():
+    """
+    A socket listening on a free local port.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    s.listen(128)
+    return s
+
+
+def bench_broadcast(suite, peer_counts, silent, timeout=0.5):
+    """
+    Peer.broadcast of one block to local peers, some of them silent
+    (connections are queued but never answered, like a hung peer): one
+    send after the other as add_block used to, all at once, and all at
+    once after the silent peers were marked dead.
+    """
+    def serve(listener):
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            with connection:
+                read_line(connection)
+
+    peer = Peer("127.0.0.1", 0, "127.0.0.1", 0)
+    message = {"message_type": "NEW_BLOCK", "data": mine_block(1, "00" * 32, make_transactions(10), 1, None, 0, 0).to_dict()}
+    for n in peer_counts:
+        sockets = [listening_socket() for _ in range(n)]
+        for s in sockets[silent:]:
+            threading.Thread(target=serve, args=(s,), daemon=True).start()
+        targets = [s.getsockname() for s in sockets]
+        label = f"peers={n} silent={silent}"
+
+        suite.record("broadcast", f"{label} sequential",
+                     lambda: Broadcaster(peer.send_to, workers=0, timeout=timeout).broadcast(targets, message), repeat=3)
+        suite.record("broadcast", f"{label} concurrent",
+                     lambda: Broadcaster(peer.send_to, timeout=timeout).broadcast(targets, message), repeat=3)
+        warm = Broadcaster(peer.send_to, timeout=timeout, max_failures=1)
+        warm.broadcast(targets, message)
+        suite.record("broadcast", f"{label} dead skipped", lambda: warm.broadcast(targets, message), repeat=3)
+        for s in sockets:
+            s.close()
+
+
+def bench_mempool(suite, sizes, workdir):
+    """
+    The mempool journal: appending a transaction, confirming a block's
+    worth of transactions out of a full mempool, and recovering the whole
+    mempool when the peer restarts.
+    """
+    for n in sizes:
+        path = os.path.join(workdir, f"mempool_{n}.journal")
+        journal = MempoolJournal(path)
+        journal.load()
+        txs = make_transactions(n)
+        start = time.perf_counter()
+        for tx in txs:
+            journal.append(tx)
+        per_tx = (time.perf_counter() - start) / n
+        suite.add("mempool_append", f"txs={n}", per_tx, per_tx)
+        journal.close()
+
+        peer = Peer("127.0.0.1", 0, "127.0.0.1", 0, mempool_path=path)
+        suite.record("mempool_recover", f"txs={n}", peer.recover_mempool, repeat=3)
+
+        def confirm():
+            confirmed = {tx.hash() for tx in peer.pending_transactions[:512]}
+            peer.remove_pending(lambda tx: tx.hash() not in confirmed)
+
+        suite.record("mempool_confirm", f"txs={n} block=512", confirm, repeat=3)
+        peer.mempool.close()
+
+
+def bench_sync(suite, chain_sizes):
+    """
+    Catch-up sync over local sockets: time from a peer at genesis
+    greeting one that is n blocks ahead until it has every block, with
+    each block codec.
+    """
+    def free_port():
+        with contextlib.closing(listening_socket()) as s:
+            return s.getsockname()[1]
+
+    def start(peer, chain):
+        peer.blockchain = chain
+        peer.all_blocks = ForkStore()
+        for blk in chain.blocks:
+            peer.all_blocks[blk.get_id()] = blk
+        peer.handshakes = True
+        threading.Thread(target=peer.receive_message, daemon=True).start()
+
+    for n in chain_sizes:
+        chain = synthetic_chain(os.devnull, n, 1)
+        chain.publish(rebuild=True)
+        ahead = Peer("127.0.0.1", free_port(), "127.0.0.1", 0)
+        start(ahead, chain)
+        for codec in CODECS:
+            genesis = BlockChain()
+            genesis.switch_to(chain.blocks[:1])
+            behind = Peer("127.0.0.1", free_port(), "127.0.0.1", 0)
+            behind.codecs = (codec,)
+            start(behind, genesis)
+            time.sleep(0.2)
+            with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+                started = time.perf_counter()
+                behind.greet([(ahead.ip, ahead.port)])
+                while ((len(behind.blockchain.blocks) < len(chain.blocks) or behind.sync_after is not None)
+                       and time.perf_counter() - started < 120):
+                    time.sleep(0.01)
+                elapsed = time.perf_counter() - started
+            suite.add("sync", f"blocks={n} codec={codec}", elapsed, elapsed)
+            behind.stop_event.set()
+        ahead.stop_event.set()
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Print how each result moved against a saved run.
+
+    Args:
+        results (list): this run's results
+        baseline_path (str): JSON file from an earlier run (--json)
+        threshold (float): slowdown ratio reported as a regression
+
+    Returns:
+        int: number of regressions
+    """
+    with open(baseline_path) as f:
+        baseline = {(r["name"], r["param"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"\nCompared with {baseline_path}:")
+    for r in results:
+        old = baseline.get((r["name"], r["param"]))
+        if old is None or not old["median_s"]:
+            continue
+        ratio = r["median_s"] / old["median_s"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"{r['name']:<22} {r['param']:<28} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    """
+    Run the benchmark suite.
+    """
+    ap = argparse.ArgumentParser(description="Benchmark the core chain operations.")
+    ap.add_argument("--quick", action="store_true", help="smaller sizes, for a fast check")
+    ap.add_argument("--repeat", type=int, default=7, help="samples per measurement")
+    ap.add_argument("--only", help="comma-separated groups: block,mining,chain,forks,snapshots,broadcast,mempool,sync")
+    ap.add_argument("--json", help="write the results to this file")
+    ap.add_argument("--compare", help="earlier --json file to compare against")
+    ap.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    args = ap.parse_args()
+
+    groups = set(args.only.split(",")) if args.only else {"block", "mining", "chain", "forks", "snapshots", "broadcast", "mempool", "sync"}
+    suite = Suite(args.repeat)
+    workdir = tempfile.mkdtemp()
+
+    if "block" in groups:
+        bench_block_ops(suite, [1, 10, 100, 1000] if args.quick else [1, 10, 100, 1000, 10000])
+    if "mining" in groups:
+        bench_mining(suite, [4, 8] if args.quick else [4, 8, 12, 16])
+    if "chain" in groups:
+        bench_chain_io(suite, [1000, 10000] if args.quick else [10000, 100000], workdir)
+    if "forks" in groups:
+        bench_fork_choice(suite, [(1000, 10, 5)] if args.quick else
+                          [(1000, 10, 5), (10000, 10, 5), (10000, 100, 10)])
+    if "snapshots" in groups:
+        bench_snapshots(suite, [0, 1, 4], 1 if args.quick else 3)
+    if "broadcast" in groups:
+        bench_broadcast(suite, [10] if args.quick else [10, 50], 2)
+    if "mempool" in groups:
+        bench_mempool(suite, [10000] if args.quick else [10000, 100000], workdir)
+    if "sync" in groups:
+        bench_sync(suite, [1000] if args.quick else [1000, 10000])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "quick": args.quick, "repeat": args.repeat, "results": suite.results}, f, indent=2)
+    if args.compare and compare(suite.results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
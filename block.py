@@ -4,6 +4,13 @@ import hashlib
 import math
 from typing import List
 from transactions import Transaction
+from metrics import Counter, Gauge, Histogram
+
+VALIDATE_SECONDS = Histogram("block_validate_seconds", "Time spent in Block.validate, by stage",
+                             (0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1), labels=("stage",))
+MINING_HASHES = Counter("mining_hashes_total", "Header hashes tried while mining")
+MINING_SECONDS = Counter("mining_seconds_total", "Time spent mining blocks")
+MINING_HASHRATE = Gauge("mining_hashrate", "Hashes per second while mining the last block")
 
 
 def hash_data(data):
@@ -110,16 +117,34 @@ class Block:
         """
         self.header = header
         self.transactions = transactions
+        self.pruned = False # True once the transaction bodies were dropped (pruned chain mode)
+        self.id_cache = (None, None) # (header fields, hash) of the last get_id()
+
+
+    def prune(self):
+        """
+        Drop the transaction bodies, keeping only the header.
+        """
+        self.transactions = []
+        self.pruned = True
 
 
     def get_id(self):
         """
         Get the block's unique ID (its header hash).
 
+        The hash is remembered together with the header fields it was
+        computed from, so fork choice can ask again and again without
+        rehashing, while a header changed afterwards still gets a fresh hash.
+
         Returns:
             str: hex hash string
         """
-        return self.header.hash_header()
+        h = self.header
+        fields = (h.block_num, h.prev_block_hash, h.merkle_root_hash, h.timestamp_ms, h.difficulty, h.nonce)
+        if self.id_cache[0] != fields:
+            self.id_cache = (fields, h.hash_header())
+        return self.id_cache[1]
 
 
     def to_dict(self):
@@ -127,9 +152,10 @@ class Block:
         Convert block to dictionary for JSON serialization.
 
         Returns:
-            dict: with 'header' and 'transactions'
+            dict: with 'header' and 'transactions' (and 'pruned' for a
+            block whose transactions were dropped)
         """
-        return {
+        data = {
             "header": {
                 "block_num": self.header.block_num,
                 "prev_block_hash": self.header.prev_block_hash,
@@ -140,6 +166,9 @@ class Block:
             },
             "transactions": [tx.to_dict() for tx in self.transactions]
         }
+        if self.pruned:
+            data["pruned"] = True
+        return data
 
 
     def validate(self):
@@ -150,19 +179,26 @@ class Block:
             bool: True if valid, False otherwise
         """
         # Merkle check
-        if self.header.merkle_root_hash != calculate_merkle_root(self.transactions):
+        start = time.perf_counter()
+        merkle_ok = self.header.merkle_root_hash == calculate_merkle_root(self.transactions)
+        checked = time.perf_counter()
+        VALIDATE_SECONDS.observe(checked - start, stage="merkle")
+        if not merkle_ok:
             return False
 
         # Proof-of-work check
-        if int(self.get_id(), 16) > (1 << (256 - self.header.difficulty)) - 1:
+        start = checked
+        pow_ok = int(self.get_id(), 16) <= (1 << (256 - self.header.difficulty)) - 1
+        checked = time.perf_counter()
+        VALIDATE_SECONDS.observe(checked - start, stage="pow")
+        if not pow_ok:
             return False
 
         # Transaction signature check
-        for tx in self.transactions:
-            if not tx.verify_signature():
-                return False
-
-        return True
+        start = checked
+        signatures_ok = all(tx.verify_signature() for tx in self.transactions)
+        VALIDATE_SECONDS.observe(time.perf_counter() - start, stage="signatures")
+        return signatures_ok
 
 
 
@@ -220,8 +256,14 @@ def mine_block(block_number, prev_hash, transactions, difficulty, chain_headers,
     timestamp_ms = int(time.time() * 1000)
     header = BlockHeader(block_number, prev_hash, merkle_root, timestamp_ms, difficulty, nonce=0)
 
+    start = time.perf_counter()
     while int(header.hash_header(), 16) > (1 << (256 - difficulty)) - 1:
         header.nonce += 1
+    elapsed = time.perf_counter() - start
+    MINING_HASHES.inc(header.nonce + 1)
+    MINING_SECONDS.inc(elapsed)
+    if elapsed > 0:
+        MINING_HASHRATE.set(round((header.nonce + 1) / elapsed, 1))
 
     return Block(header, transactions)
 
@@ -244,4 +286,6 @@ def load_block(data):
     for transaction in data.get("transactions", []):
         transactions.append(Transaction.from_dict(transaction))
 
-    return Block(header, transactions)
+    block = Block(header, transactions)
+    block.pruned = data.get("pruned", False)
+    return block
@@ -0,0 +1,78 @@
+from collections import deque
+
+
+def build_block_template(chain, pending, max_txs=512):
+    """
+    Choose which pending transactions go into the next block, and in what order.
+
+    Transactions are grouped by artwork. For each artwork we start from its
+    current owner on the chain and follow the transfers out of whoever holds
+    it next (earliest arrival first), so a chain of transfers for one
+    artwork ends up in order inside the block even if it arrived out of
+    order. What is left over is sorted into:
+      - conflicts: bad signatures, second mints, and transfers from someone
+        who held the artwork but lost it to another transfer (a double spend);
+        these can never be mined and should be dropped.
+      - deferred: transfers from someone who does not hold the artwork yet
+        (their parent may still arrive), and anything that did not fit under
+        max_txs; these should stay pending.
+    Artworks are taken in order of their earliest pending transaction, and
+    an artwork's transfers are only cut at the end, so the block stays valid.
+    Runs in O(n log n) for n pending transactions.
+
+    Args:
+        chain (BlockChain): chain whose tip the block will build on
+        pending (list): pending Transaction objects in arrival order
+        max_txs (int): most transactions to put in the block
+
+    Returns:
+        tuple: (transactions, conflicts, deferred) where conflicts is a list
+        of (Transaction, reason) pairs
+    """
+    by_artwork = {} # artwork_id -> [(arrival index, tx)]
+    conflicts = []
+    for index, tx in enumerate(pending):
+        if not tx.verify_signature():
+            conflicts.append((tx, "bad signature"))
+            continue
+        by_artwork.setdefault(tx.artwork_id, []).append((index, tx))
+
+    paths = [] # (first arrival index, [tx, ...]) per artwork
+    deferred = []
+    for artwork_id, entries in by_artwork.items():
+        out_of = {} # sender -> deque of (index, tx), earliest first
+        for (index, tx) in entries:
+            out_of.setdefault(tx.sender, deque()).append((index, tx))
+
+        holder = chain.owner_of(artwork_id)
+        minted = holder is not None or artwork_id in chain.minted_artworks
+        if not minted:
+            holder = "MINT"
+        holders = {holder}
+        path = []
+        while out_of.get(holder):
+            index, tx = out_of[holder].popleft()
+            path.append((index, tx))
+            holder = tx.recipient
+            holders.add(holder)
+            if holder == "MINT":
+                break
+
+        for sender, left in out_of.items():
+            for (index, tx) in left:
+                if sender == "MINT":
+                    conflicts.append((tx, f'artwork "{artwork_id}" already exists'))
+                elif sender in holders:
+                    conflicts.append((tx, "artwork was already transferred by another transaction"))
+                else:
+                    deferred.append(tx)
+        if path:
+            paths.append((min(index for (index, _) in path), [tx for (_, tx) in path]))
+
+    paths.sort(key=lambda item: item[0])
+    transactions = []
+    for (_, path) in paths:
+        room = max_txs - len(transactions)
+        transactions.extend(path[:room])
+        deferred.extend(path[room:])
+    return transactions, conflicts, deferred
@@ -1,17 +1,489 @@
 import json
+import math
+import os
 from typing import List
 
-from block import Block, mine_block 
+from block import Block, mine_block, load_block
 from transactions import Transaction
+from metrics import Histogram
+
+REORG_DEPTH = Histogram("chain_reorg_depth", "Blocks disconnected by each reorg", (1, 2, 3, 5, 10, 25, 100))
+SNAPSHOT_COMPACT_MIN = 64 # changed keys a snapshot index may always carry before they are folded into a new base
+SNAPSHOT_INDEXES = ("owners", "minted_artworks", "provenance", "holdings", "tx_index") # state copied into each ChainView
+
+
+def mine_after(blocks, tx_list):
+    """
+    Mine a block holding tx_list on top of the last of blocks.
+
+    Args:
+        blocks (list): a main chain, genesis first (a BlockChain's or a ChainView's)
+        tx_list (list): transactions to include
+
+    Returns:
+        Block: freshly mined block
+    """
+    if not blocks:
+        raise RuntimeError("Make the first block before mining more.")
+
+    parent_hash = blocks[-1].get_id()
+
+    header_list = []
+    for block in blocks:
+        header_list.append(block.header)
+
+    return mine_block(len(blocks), parent_hash, tx_list, None, header_list, 10, 20000)
+
+
+class SnapshotMap:
+    """
+    A read-only dict built from a shared base dict plus the keys changed
+    since; None in the changes means the key was removed. Neither dict is
+    ever modified once the map exists, so one snapshot's map can be read
+    from any thread while the chain moves on.
+    """
+    def __init__(self, base, changes):
+        self.base = base
+        self.changes = changes
+
+
+    def get(self, key, default=None):
+        value = self.changes[key] if key in self.changes else self.base.get(key)
+        return default if value is None else value
+
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+    def keys(self):
+        for key in self.base:
+            if key not in self.changes:
+                yield key
+        for key, value in self.changes.items():
+            if value is not None:
+                yield key
+
+
+    def updated(self, changes):
+        """
+        Return a new map with more changes on top, folding everything into
+        a fresh base once more than sqrt(len(base)) keys have changed (at
+        least SNAPSHOT_COMPACT_MIN). That balances copying the changes on
+        every publish against copying the base now and then: both cost
+        about sqrt(n) per changed key.
+
+        Args:
+            changes (dict): key -> new value, or None if the key is gone
+
+        Returns:
+            SnapshotMap: the new map; self is unchanged
+        """
+        merged = dict(self.changes)
+        merged.update(changes)
+        if len(merged) <= max(SNAPSHOT_COMPACT_MIN, math.isqrt(len(self.base))):
+            return SnapshotMap(self.base, merged)
+        base = dict(self.base)
+        for key, value in merged.items():
+            if value is None:
+                base.pop(key, None)
+            else:
+                base[key] = value
+        return SnapshotMap(base, {})
+
+
+class BlockSlice:
+    """
+    Read-only view of the first length blocks of a main-chain list. The
+    chain only ever appends to that list (a reorg starts a new list), so
+    the view stays the same while the chain grows.
+    """
+    def __init__(self, blocks, length):
+        self.list = blocks
+        self.length = length
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.list[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("block index out of range")
+        return self.list[index]
+
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self.list[i]
+
+
+class ChainView:
+    """
+    An immutable snapshot of the main chain and its state, as of one
+    version of a BlockChain.
+
+    BlockChain publishes a new view after every change and readers get the
+    latest one from BlockChain.snapshot() without taking a lock. Everything
+    read through one view (blocks, owners, indexes) belongs to the same
+    tip, however many blocks are connected meanwhile. It answers the same
+    queries as BlockChain, so it can be handed to build_block_template.
+    Only pruned mode reaches into it: blocks pruned after the view was
+    taken lose their transactions in it too.
+    """
+    def __init__(self, version, blocks, pruned_height, indexes):
+        """
+        Initialize the view.
+
+        Args:
+            version (int): the chain version it shows
+            blocks (BlockSlice): the main chain
+            pruned_height (int): blocks below this height are headers only
+            indexes (dict): name in SNAPSHOT_INDEXES -> SnapshotMap
+        """
+        self.version = version
+        self.blocks = blocks
+        self.pruned_height = pruned_height
+        self.indexes = indexes
+        self.owners = indexes["owners"]
+        self.minted_artworks = indexes["minted_artworks"]
+        self.total_work = None # worked out by work() on first use
+
+
+    def work(self):
+        """
+        Cumulative proof-of-work of this view's chain: the number of hashes
+        it is expected to have taken, 2**difficulty per block. Pruned blocks
+        still count, since their headers stay.
+
+        Returns:
+            int: total work
+        """
+        if self.total_work is None:
+            self.total_work = sum(1 << blk.header.difficulty for blk in self.blocks)
+        return self.total_work
+
+
+    def owner_of(self, artwork_id):
+        """
+        Look up who owned an artwork at this view's tip (see BlockChain.owner_of).
+        """
+        return self.owners.get(artwork_id)
+
+
+    def already_minted(self, artwork_id):
+        """
+        Check whether an artwork was minted by this view's tip.
+        """
+        return artwork_id in self.minted_artworks
+
+
+    def history_of(self, artwork_id):
+        """
+        (height, Transaction) pairs of an artwork, oldest first (see BlockChain.history_of).
+        """
+        return list(self.indexes["provenance"].get(artwork_id, ()))
+
+
+    def holdings_of(self, owner):
+        """
+        Artwork ids someone held at this view's tip (see BlockChain.holdings_of).
+        """
+        artworks = self.indexes["holdings"].get(owner)
+        return list(artworks.keys()) if artworks is not None else []
+
+
+    def find_transaction(self, tx_hash):
+        """
+        (height, position) of a transaction in this view's chain, or None
+        (see BlockChain.find_transaction).
+        """
+        location = self.indexes["tx_index"].get(tx_hash)
+        if location is None or location[0] < self.pruned_height:
+            return None
+        return location
+
+
+    def mine_next_block(self, tx_list):
+        """
+        Return a freshly mined block that builds on this view's tip.
+        """
+        return mine_after(self.blocks, tx_list)
 
 
 class BlockChain:
-    def __init__(self):
+    def __init__(self, keep_blocks=None):
         """
         Initialize the blockchain.
+
+        Args:
+            keep_blocks (int): pruned mode; keep the transactions of only the
+                last keep_blocks blocks (None keeps every block in full)
         """
         self.blocks: List[Block] = []    
+        self.keep_blocks = keep_blocks
+        self.pruned_height = 0 # blocks below this height only have their header left
         self.minted_artworks: set[str] = set()  
+        self.owners: dict[str, str] = {} # artwork_id -> current owner (recipient of its latest transaction)
+        self.owner_undo = [] # per main-chain block: [(artwork_id, previous owner or None, tx hash, previous tx location)] to revert it
+        self.provenance: dict[str, list] = {} # artwork_id -> [(height, Transaction), ...] oldest first
+        self.holdings: dict[str, set] = {} # owner -> set of artwork_ids they currently hold
+        self.tx_index: dict[str, tuple] = {} # tx hash -> (height, position in block) of its latest occurrence
+        self.listeners = [] # callbacks told about every connected/disconnected block
+        self.version = 0 # bumped by every publish()
+        self.touched = {name: set() for name in SNAPSHOT_INDEXES} # keys changed since the last publish(); (owner, artwork) pairs for holdings
+        self.view = ChainView(0, BlockSlice(self.blocks, 0), 0,
+                              {name: SnapshotMap({}, {}) for name in SNAPSHOT_INDEXES})
+
+
+    def add_listener(self, callback):
+        """
+        Subscribe to chain events.
+
+        The callback is called as callback(event, block, height) with event
+        "connected" when a block becomes part of the main chain and
+        "disconnected" when a reorg takes it off again (tip first).
+
+        Args:
+            callback (callable): function to call on every event
+        """
+        self.listeners.append(callback)
+
+
+    def notify(self, event, block, height):
+        """
+        Tell every listener about a chain event.
+
+        Args:
+            event (str): "connected" or "disconnected"
+            block (Block): the block concerned
+            height (int): its height in the main chain
+        """
+        for callback in self.listeners:
+            callback(event, block, height)
+
+
+    def snapshot(self):
+        """
+        Return the latest published view of the chain.
+
+        This is a single attribute read, so readers on any thread never wait
+        for block acceptance, and everything they read through the view is
+        consistent with one tip.
+
+        Returns:
+            ChainView: the view
+        """
+        return self.view
+
+
+    def frozen(self, name, key):
+        """
+        The current value of one index entry in the immutable form a
+        ChainView holds, or None if the entry is gone.
+        """
+        if name == "minted_artworks":
+            return True if key in self.minted_artworks else None
+        value = getattr(self, name).get(key)
+        if value is None:
+            return None
+        if name == "provenance":
+            return tuple(value)
+        return value
+
+
+    def frozen_holdings(self, pairs):
+        """
+        The changed holdings entries for a ChainView. Each owner's artworks
+        are a SnapshotMap of their own, updated with only the artworks that
+        came or went, so an owner holding thousands of artworks does not
+        cost thousands of copies per block.
+
+        Args:
+            pairs (set): (owner, artwork_id) pairs touched since the last publish
+
+        Returns:
+            dict: owner -> SnapshotMap of artwork_id -> True, or None if they hold nothing
+        """
+        by_owner = {}
+        for (owner, artwork_id) in pairs:
+            by_owner.setdefault(owner, []).append(artwork_id)
+        previous = self.view.indexes["holdings"]
+        changes = {}
+        for owner, artwork_ids in by_owner.items():
+            held = self.holdings.get(owner)
+            if not held:
+                changes[owner] = None
+                continue
+            artworks = previous.get(owner) or SnapshotMap({}, {})
+            changes[owner] = artworks.updated({a: (True if a in held else None) for a in artwork_ids})
+        return changes
+
+
+    def publish(self, rebuild=False):
+        """
+        Publish a new ChainView for the current tip.
+
+        Only the index entries touched since the last publish are copied
+        into the new view, on top of the previous one; the old view is left
+        as it was for readers still holding it.
+
+        Args:
+            rebuild (bool): copy every entry instead (after load)
+        """
+        indexes = {}
+        for name in SNAPSHOT_INDEXES:
+            keys = self.touched[name]
+            if rebuild and name == "holdings":
+                indexes[name] = SnapshotMap({owner: SnapshotMap(dict.fromkeys(held, True), {})
+                                             for owner, held in self.holdings.items()}, {})
+            elif rebuild:
+                indexes[name] = SnapshotMap({key: self.frozen(name, key) for key in getattr(self, name)}, {})
+            elif name == "holdings":
+                indexes[name] = self.view.indexes[name].updated(self.frozen_holdings(keys))
+            else:
+                indexes[name] = self.view.indexes[name].updated({key: self.frozen(name, key) for key in keys})
+            keys.clear()
+        self.version += 1
+        self.view = ChainView(self.version, BlockSlice(self.blocks, len(self.blocks)), self.pruned_height, indexes)
+
+
+    def apply_state(self, block):
+        """
+        Update minted_artworks, owners and the query indexes (provenance,
+        holdings, tx_index) for a block joining the main chain, remembering
+        what to restore if it is disconnected later.
+
+        Args:
+            block (Block): the block being connected
+        """
+        height = block.header.block_num
+        undo = []
+        for position, tx in enumerate(block.transactions):
+            # the genesis transaction counts as a mint whoever signed it
+            if tx.sender == "MINT" or height == 0:
+                self.minted_artworks.add(tx.artwork_id)
+            previous = self.owners.get(tx.artwork_id)
+            tx_hash = tx.hash()
+            self.touch(tx.artwork_id, tx_hash)
+            undo.append((tx.artwork_id, previous, tx_hash, self.tx_index.get(tx_hash)))
+            self.owners[tx.artwork_id] = tx.recipient
+            self.move_holding(tx.artwork_id, previous, tx.recipient)
+            self.provenance.setdefault(tx.artwork_id, []).append((height, tx))
+            self.tx_index[tx_hash] = (height, position)
+        self.owner_undo.append(undo)
+
+
+    def revert_state(self, block):
+        """
+        Undo apply_state for the block leaving the tip of the main chain.
+
+        Args:
+            block (Block): the block being disconnected
+        """
+        for tx in block.transactions:
+            if tx.sender == "MINT":
+                self.minted_artworks.discard(tx.artwork_id)
+        for (artwork_id, previous, tx_hash, location) in reversed(self.owner_undo.pop()):
+            self.touch(artwork_id, tx_hash)
+            self.move_holding(artwork_id, self.owners.get(artwork_id), previous)
+            if previous is None:
+                self.owners.pop(artwork_id, None)
+            else:
+                self.owners[artwork_id] = previous
+
+            history = self.provenance[artwork_id]
+            history.pop()
+            if not history:
+                del self.provenance[artwork_id]
+            if location is None:
+                self.tx_index.pop(tx_hash, None)
+            else:
+                self.tx_index[tx_hash] = location
+
+
+    def touch(self, artwork_id, tx_hash):
+        """
+        Note that an artwork's entries and a transaction's location changed,
+        for the next publish().
+        """
+        touched = self.touched
+        touched["owners"].add(artwork_id)
+        touched["minted_artworks"].add(artwork_id)
+        touched["provenance"].add(artwork_id)
+        touched["tx_index"].add(tx_hash)
+
+
+    def move_holding(self, artwork_id, old_owner, new_owner):
+        """
+        Move an artwork between two owners' entries in holdings.
+
+        Args:
+            artwork_id (str): the artwork changing hands
+            old_owner (str or None): who held it, None if nobody did
+            new_owner (str or None): who holds it now, None if nobody does
+        """
+        if old_owner is not None:
+            self.touched["holdings"].add((old_owner, artwork_id))
+            held = self.holdings.get(old_owner)
+            if held is not None:
+                held.discard(artwork_id)
+                if not held:
+                    del self.holdings[old_owner]
+        if new_owner is not None:
+            self.touched["holdings"].add((new_owner, artwork_id))
+            self.holdings.setdefault(new_owner, set()).add(artwork_id)
+
+
+    def owner_of(self, artwork_id):
+        """
+        Look up who currently owns an artwork.
+
+        Returns:
+            str or None: the owner, or None if the artwork was never minted
+        """
+        return self.owners.get(artwork_id)
+
+
+    def history_of(self, artwork_id):
+        """
+        Look up every main-chain transaction of an artwork.
+
+        Returns:
+            list: (height, Transaction) pairs, oldest first
+        """
+        return list(self.provenance.get(artwork_id, ()))
+
+
+    def holdings_of(self, owner):
+        """
+        Look up the artworks someone currently owns.
+
+        Returns:
+            list: artwork ids, in no particular order
+        """
+        return list(self.holdings.get(owner, ()))
+
+
+    def find_transaction(self, tx_hash):
+        """
+        Look up where a transaction sits in the main chain.
+
+        Args:
+            tx_hash (str): Transaction.hash() of the transaction
+
+        Returns:
+            tuple or None: (height, position in block), or None if it is not
+            in the main chain (or its block was pruned)
+        """
+        location = self.tx_index.get(tx_hash)
+        if location is None or location[0] < self.pruned_height:
+            return None
+        return location
 
 
     def make_first_block(self, creator, recipient, artwork_id):
@@ -31,7 +503,9 @@ class BlockChain:
 
         first = mine_block(0, "00" * 32, [add_transaction], 1, None, 0, 0)
         self.blocks.append(first)
-        self.minted_artworks.add(artwork_id)
+        self.apply_state(first)
+        self.publish()
+        self.notify("connected", first, 0)
 
 
     def mine_next_block(self, tx_list):
@@ -44,51 +518,156 @@ class BlockChain:
         Returns:
             Block: freshly mined block
         """
-        if not self.blocks:
-            raise RuntimeError("Make the first block before mining more.")
+        return mine_after(self.blocks, tx_list)
 
-        parent_hash = self.blocks[-1].get_id()
 
-        header_list = []
-        for block in self.blocks:
-            header_list.append(block.header)
+    def check_block(self, block, validated=False):
+        """
+        Check whether a block can extend the current tip.
 
-        new_block = mine_block(len(self.blocks), parent_hash, tx_list, None, header_list, 10, 20000)
-        return new_block
+        Args:
+            block (Block): candidate block
+            validated (bool): the caller has just run block.validate() on
+                this very object and it passed, so only the checks that
+                depend on the tip are left
+
+        Returns:
+            str or None: why the block is rejected, or None if it is fine
+        """
+        tip_hash = self.blocks[-1].get_id() if self.blocks else "00" * 32
+        if block.header.prev_block_hash != tip_hash:
+            return "previous-hash mismatch"
+        if not validated and not block.validate():
+            return "block.validate() failed"
+        
+        for tx in block.transactions:
+            if tx.sender == "MINT":
+                if tx.artwork_id in self.minted_artworks:
+                    return f'duplicate MINT for "{tx.artwork_id}"'
+        return None
 
 
-    def add_to_chain(self, block):
+    def add_to_chain(self, block, validated=False):
         """
         Validate basics then append to the chain if okay.
         
         Args:
             block (Block): block to add to the chain
+            validated (bool): see check_block()
 
         Returns:
             bool: True if the block was added, False otherwise
         """
-        if block.header.prev_block_hash != self.blocks[-1].get_id():
-            print("previous-hash mismatch — block rejected")
-            return False
-        if not block.validate():
-            print("block.validate() failed — block rejected")
+        reason = self.check_block(block, validated)
+        if reason:
+            print(f"{reason} — block rejected")
             return False
-        
-        for tx in block.transactions:
-            if tx.sender == "MINT":
-                if tx.artwork_id in self.minted_artworks:
-                    print(f'duplicate MINT for "{tx.artwork_id}" — block rejected')
-                    return False
-
-        for tx in block.transactions:
-            if tx.sender == "MINT":
-                self.minted_artworks.add(tx.artwork_id)
 
         self.blocks.append(block)
+        self.apply_state(block)
+        self.prune_old_blocks()
+        self.publish()
         print("block added, height now", len(self.blocks) - 1)
+        self.notify("connected", block, len(self.blocks) - 1)
         return True
 
 
+    def switch_to(self, new_blocks):
+        """
+        Replace the main chain with another branch (a reorg).
+
+        Blocks after the fork point are disconnected tip first, then the new
+        branch is connected in order, so listeners only see what changed.
+
+        Args:
+            new_blocks (list): the full new main chain, genesis first
+
+        Returns:
+            bool: False if the fork point is below the pruned height, where
+            blocks can no longer be disconnected; True otherwise
+        """
+        fork = 0
+        while (fork < len(self.blocks) and fork < len(new_blocks)
+               and (self.blocks[fork] is new_blocks[fork] or self.blocks[fork].get_id() == new_blocks[fork].get_id())):
+            fork += 1
+        if fork < self.pruned_height:
+            print(f"reorg to height {fork} is below the pruned height {self.pruned_height} — refused")
+            return False
+        if len(self.blocks) > fork:
+            REORG_DEPTH.observe(len(self.blocks) - fork)
+            # published views share the old list, so disconnect on a copy
+            self.blocks = self.blocks[:]
+
+        while len(self.blocks) > fork:
+            block = self.blocks.pop()
+            self.revert_state(block)
+            self.notify("disconnected", block, len(self.blocks))
+
+        for block in new_blocks[fork:]:
+            self.blocks.append(block)
+            self.apply_state(block)
+            self.notify("connected", block, len(self.blocks) - 1)
+        self.prune_old_blocks()
+        self.publish()
+        return True
+
+
+    def prune_old_blocks(self):
+        """
+        In pruned mode, drop the transactions of blocks more than keep_blocks
+        below the tip, with their undo records and index entries. Headers
+        and the ownership state stay, so new blocks are still checked in
+        full and owner_of() still answers; a reorg deeper than keep_blocks
+        is no longer possible.
+
+        Returns:
+            int: number of blocks pruned by this call
+        """
+        if self.keep_blocks is None:
+            return 0
+        pruned = 0
+        while self.pruned_height < len(self.blocks) - self.keep_blocks:
+            height = self.pruned_height
+            block = self.blocks[height]
+            for position, tx in enumerate(block.transactions):
+                tx_hash = tx.hash()
+                self.touch(tx.artwork_id, tx_hash)
+                history = self.provenance.get(tx.artwork_id)
+                if history and history[0][0] == height:
+                    history.pop(0)
+                    if not history:
+                        del self.provenance[tx.artwork_id]
+                if self.tx_index.get(tx_hash) == (height, position):
+                    del self.tx_index[tx_hash]
+            block.prune()
+            self.owner_undo[height] = None
+            self.pruned_height += 1
+            pruned += 1
+        return pruned
+
+
+    def state_at_pruned_height(self):
+        """
+        Work out minted_artworks and owners as they were just before the
+        oldest full block, by undoing the full blocks on copies.
+
+        Returns:
+            tuple: (owners dict, minted_artworks set)
+        """
+        owners = dict(self.owners)
+        minted = set(self.minted_artworks)
+        for height in range(len(self.blocks) - 1, self.pruned_height - 1, -1):
+            for tx in self.blocks[height].transactions:
+                if tx.sender == "MINT":
+                    minted.discard(tx.artwork_id)
+            for (artwork_id, previous, _, _) in reversed(self.owner_undo[height]):
+                if previous is None:
+                    owners.pop(artwork_id, None)
+                else:
+                    owners[artwork_id] = previous
+        return owners, minted
+
+
     def show(self):
         """
         Print the blockchain.
@@ -117,28 +696,224 @@ class BlockChain:
         Returns:
             True if we find a mint TX for this artwork, False otherwise.
         """
-        for blk in self.blocks:
-            for tx in blk.transactions:
-                if tx.sender == "MINT" and tx.artwork_id == artwork_id:
-                    return True
-        return False
+        return artwork_id in self.minted_artworks
     
         
     def save(self, path: str):
         """
-        Save the blockchain to a file.
+        Save the blockchain to a file, one block at a time, so only one
+        block's JSON is built in memory at once.
+
+        A pruned chain is saved as an object instead of a list: the
+        ownership state at the pruned height, then every block (headers
+        only below that height).
         """
         with open(path, "w") as f:
-            json.dump([b.to_dict() for b in self.blocks], f, indent=2)
+            if self.pruned_height:
+                owners, minted = self.state_at_pruned_height()
+                # leave the object open so the blocks can be streamed into it
+                f.write(json.dumps({"pruned_height": self.pruned_height,
+                                    "minted_artworks": sorted(minted),
+                                    "owners": owners})[:-1])
+                f.write(', "blocks": [')
+            else:
+                f.write("[")
+            for index, blk in enumerate(self.blocks):
+                f.write(",\n" if index else "\n")
+                f.write(json.dumps(blk.to_dict()))
+            f.write("\n]}\n" if self.pruned_height else "\n]\n")
 
 
     def load(self, path: str):
         """
-        Load the blockchain from a file.
+        Load the blockchain from a file and rebuild the mint and ownership
+        state and the query indexes. Listeners are not notified. A file
+        saved by a pruned chain starts from its saved state.
         """
-        from block import load_block
         with open(path) as f:
-            self.blocks = [load_block(obj) for obj in json.load(f)]
+            data = json.load(f)
+        self.minted_artworks = set()
+        self.owners = {}
+        self.owner_undo = []
+        self.provenance = {}
+        self.holdings = {}
+        self.tx_index = {}
+        self.pruned_height = 0
+        if isinstance(data, dict):
+            # pruned chain: start from the saved state instead of genesis
+            self.pruned_height = data["pruned_height"]
+            self.minted_artworks = set(data["minted_artworks"])
+            self.owners = dict(data["owners"])
+            for artwork_id, owner in self.owners.items():
+                self.move_holding(artwork_id, None, owner)
+            self.owner_undo = [None] * self.pruned_height
+            data = data["blocks"]
+        self.blocks = [load_block(obj) for obj in data]
+        for blk in self.blocks[self.pruned_height:]:
+            self.apply_state(blk)
+        self.prune_old_blocks()
+        self.publish(rebuild=True)
+
+
+    def export_ndjson(self, path, from_height=None):
+        """
+        Write main-chain blocks to an NDJSON file, one block per line.
+
+        With from_height=None the export resumes after the newest block in
+        the file that is still on our main chain: lines from a branch a
+        reorg has since abandoned, and a last line cut short by a crash, are
+        cut off first (a file that shares nothing with the chain is
+        rewritten from genesis). Otherwise the file is rewritten starting at
+        from_height.
+
+        Args:
+            path (str): file to write
+            from_height (int): first height to export
+
+        Returns:
+            int: number of blocks written
+        """
+        mode = "w"
+        if from_height is None:
+            keep, from_height = 0, 0
+            if os.path.exists(path):
+                for start, line in ndjson_lines_reversed(path):
+                    try:
+                        block = load_block(json.loads(line))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        continue
+                    height = block.header.block_num
+                    if height < len(self.blocks) and block.get_id() == self.blocks[height].get_id():
+                        keep, from_height = start + len(line), height + 1
+                        break
+                os.truncate(path, keep) # back to the fork point
+            mode = "a"
+
+        written = 0
+        with open(path, mode) as f:
+            if mode == "a" and from_height > 0:
+                f.write("\n") # the truncation dropped the kept line's newline
+            for height in range(from_height, len(self.blocks)):
+                f.write(json.dumps(self.blocks[height].to_dict()) + "\n")
+                written += 1
+        return written
+
+
+    def import_ndjson(self, path):
+        """
+        Extend the chain from an NDJSON file, resuming at the current height.
+
+        Lines for heights we already have are skipped, every other block is
+        checked like add_to_chain and connected (listeners are notified).
+        Blocks are read one line at a time, so memory use does not grow with
+        the file.
+
+        Args:
+            path (str): file written by export_ndjson
+
+        Returns:
+            int: number of blocks added
+
+        Raises:
+            ValueError: if a block does not fit on the chain
+        """
+        added = 0
+        try:
+            for block in read_ndjson(path, from_height=len(self.blocks)):
+                if block.header.block_num != len(self.blocks):
+                    raise ValueError(f"expected height {len(self.blocks)}, got {block.header.block_num}")
+                reason = self.check_block(block)
+                if reason:
+                    raise ValueError(f"block {block.header.block_num}: {reason}")
+                self.blocks.append(block)
+                self.apply_state(block)
+                self.notify("connected", block, len(self.blocks) - 1)
+                self.prune_old_blocks()
+                added += 1
+        finally:
+            # one view for the whole import rather than one per block
+            self.publish()
+        return added
+
+
+def read_ndjson(path, from_height=0):
+    """
+    Yield blocks from an NDJSON chain file, one line at a time.
+
+    Lines are consecutive heights, so lines before from_height are skipped
+    without being parsed.
+
+    Args:
+        path (str): file written by BlockChain.export_ndjson
+        from_height (int): first height to yield
+
+    Yields:
+        Block: each block at or above from_height, in order
+    """
+    with open(path) as f:
+        height = None
+        for line in f:
+            if not line.strip():
+                continue
+            if height is None:
+                height = json.loads(line)["header"]["block_num"]
+            if height >= from_height:
+                yield load_block(json.loads(line))
+            height += 1
+
+
+def ndjson_lines_reversed(path, chunk_size=65536):
+    """
+    Yield the lines of a file from the last to the first, reading it
+    backwards a chunk at a time so only its tail is read when the caller
+    stops early.
+
+    Args:
+        path (str): file to read
+        chunk_size (int): bytes read at a time
+
+    Yields:
+        (int, bytes): offset of the line's first byte and the line, without
+        its newline (blank lines are skipped)
+    """
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        rest = b"" # the start of a line whose beginning we have not read yet
+        while pos > 0:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + rest).split(b"\n")
+            rest = lines[0]
+            end = pos + len(rest) + 1
+            offsets = []
+            for line in lines[1:]:
+                offsets.append(end)
+                end += len(line) + 1
+            for start, line in reversed(list(zip(offsets, lines[1:]))):
+                if line.strip():
+                    yield start, line
+        if rest.strip():
+            yield 0, rest
+
+
+def last_ndjson_height(path):
+    """
+    Find the height of the last block in an NDJSON chain file by reading
+    only its tail. A last line cut short by a crash is skipped.
+
+    Returns:
+        int or None: that height, or None if the file is missing or holds
+        no complete block
+    """
+    if not os.path.exists(path):
+        return None
+    for _, line in ndjson_lines_reversed(path):
+        try:
+            return json.loads(line)["header"]["block_num"]
+        except (ValueError, KeyError, TypeError):
+            continue
+    return None
 
 
 
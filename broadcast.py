@@ -0,0 +1,166 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from metrics import Counter, Histogram
+
+BROADCAST_WORKERS = 32 # sends in flight at once
+SEND_TIMEOUT = 2 # seconds each peer gets to take a message (its deadline)
+MAX_FAILURES = 3 # consecutive failures before a peer counts as dead
+DEAD_COOLDOWN = 30 # seconds a dead peer is skipped before it gets one more try
+MAX_DEAD_COOLDOWN = 600 # the cooldown doubles on every failed retry up to this
+
+BROADCAST_SECONDS = Histogram("broadcast_seconds", "Time to hand one message to every live peer",
+                              (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+BROADCAST_SENDS = Counter("broadcast_sends_total", "Messages handed to peers by broadcasts, by outcome",
+                          labels=("outcome",))
+
+
+class Broadcaster:
+    """
+    Sends one message to many peers at once.
+
+    Every peer gets its own absolute deadline, timeout seconds after the
+    broadcast starts, and its send is given only what is left of it (a send
+    still waiting for a free worker when it passes is not made), so a
+    broadcast takes about as long as the slowest live peer instead of the
+    sum over all of them, and an unreachable peer costs one timeout in
+    parallel with the others.
+    Consecutive failures are counted per peer; after MAX_FAILURES the peer
+    is skipped until a cooldown passes, then gets a single retry, and any
+    success makes it live again.
+    """
+    def __init__(self, send, workers=BROADCAST_WORKERS, timeout=SEND_TIMEOUT,
+                 max_failures=MAX_FAILURES, cooldown=DEAD_COOLDOWN, observer=None):
+        """
+        Initialize the broadcaster.
+
+        Args:
+            send (callable): send(target, message, timeout) -> bool
+            workers (int): sends in flight at once; 0 sends one after the
+                other on the calling thread (for the simulator, which must
+                stay deterministic)
+            timeout (float): per-peer deadline in seconds
+            max_failures (int): consecutive failures before a peer is skipped
+            cooldown (float): seconds a dead peer is skipped at first
+            observer (callable): observer(target, ok, seconds) after every send,
+                e.g. PeerScores.sent
+        """
+        self.send = send
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.observer = observer
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="broadcast") if workers else None
+        self.lock = threading.Lock()
+        self.failures = {} # target -> consecutive failed sends
+        self.dead_until = {} # target -> time before which it is skipped
+
+
+    def live(self, targets):
+        """
+        The targets that are not being skipped as dead right now.
+
+        Args:
+            targets (list): candidate peers
+
+        Returns:
+            list: the targets worth sending to
+        """
+        now = time.time()
+        with self.lock:
+            return [t for t in targets if self.dead_until.get(t, 0) <= now]
+
+
+    def record(self, target, ok):
+        """
+        Count one send's outcome against its peer.
+
+        Args:
+            target: the peer
+            ok (bool): whether the send succeeded
+        """
+        BROADCAST_SENDS.inc(outcome="sent" if ok else "failed")
+        with self.lock:
+            if ok:
+                self.failures.pop(target, None)
+                self.dead_until.pop(target, None)
+                return
+            failures = self.failures.get(target, 0) + 1
+            self.failures[target] = failures
+            if failures >= self.max_failures:
+                cooldown = min(self.cooldown * 2 ** (failures - self.max_failures), MAX_DEAD_COOLDOWN)
+                self.dead_until[target] = time.time() + cooldown
+
+
+    def attempt(self, target, message, deadline=None):
+        """
+        One send that never raises, for the worker threads.
+
+        Args:
+            deadline (float): time.time() by which the peer must have taken
+                the message; None gives it the full timeout from now
+        """
+        remaining = self.timeout if deadline is None else deadline - time.time()
+        if remaining <= 0:
+            # it never got a worker in time: not the peer's fault, so not counted against it
+            BROADCAST_SENDS.inc(outcome="expired")
+            return False
+        started = time.perf_counter()
+        try:
+            ok = bool(self.send(target, message, remaining))
+        except Exception:
+            ok = False
+        self.record(target, ok)
+        if self.observer is not None:
+            self.observer(target, ok, time.perf_counter() - started)
+        return ok
+
+
+    def broadcast(self, targets, message, wait_for=True):
+        """
+        Send a message to every live target and wait until each one has
+        taken it or run out of time.
+
+        Args:
+            targets (list): peers to send to; dead ones are skipped
+            message: whatever send() takes
+            wait_for (bool): False returns as soon as the sends are started
+                (relaying must not hold up the thread that received the
+                message); the outcomes are still recorded
+
+        Returns:
+            tuple: (delivered, failed, skipped) lists of targets; with
+            wait_for=False every live target is reported as delivered
+        """
+        started = time.perf_counter()
+        live = self.live(targets)
+        skipped = [t for t in targets if t not in live]
+        if skipped:
+            BROADCAST_SENDS.inc(len(skipped), outcome="skipped")
+        if self.pool is None:
+            results = {t: self.attempt(t, message) for t in live}
+        else:
+            deadline = time.time() + self.timeout
+            futures = {self.pool.submit(self.attempt, t, message, deadline): t for t in live}
+            if not wait_for:
+                return live, [], skipped
+            done, _ = wait(futures, timeout=self.timeout + 1)
+            results = {t: (f in done and f.result()) for (f, t) in futures.items()}
+        delivered = [t for t in live if results[t]]
+        failed = [t for t in live if not results[t]]
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+        return delivered, failed, skipped
+
+
+    def stats(self):
+        """
+        Report the peers currently failing.
+
+        Returns:
+            dict: number of peers with recent failures and of peers skipped as dead
+        """
+        now = time.time()
+        with self.lock:
+            return {"failing": len(self.failures),
+                    "dead": sum(1 for until in self.dead_until.values() if until > now)}
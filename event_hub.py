@@ -0,0 +1,81 @@
+import json
+import threading
+
+
+class EventHub:
+    """
+    Broadcast hub for server-sent events.
+
+    Every event gets the next sequence number and is stored once, already
+    JSON-encoded, in a shared ring buffer. Each client only keeps its own
+    cursor (the last id it has seen), so publishing never waits on a slow
+    reader, and a client that reconnects with Last-Event-ID gets exactly the
+    events it missed. A client that fell so far behind that its events were
+    overwritten is told to resync from a fresh snapshot instead.
+    """
+    def __init__(self, capacity=1024):
+        """
+        Initialize the hub.
+
+        Args:
+            capacity (int): number of recent events kept for resuming clients
+        """
+        self.capacity = capacity
+        self.ring = [None] * capacity # slot id % capacity holds (id, data)
+        self.last_id = 0
+        self.cond = threading.Condition()
+
+
+    def publish(self, payload):
+        """
+        Add an event and wake every waiting client.
+
+        Args:
+            payload (dict): event body, JSON-encoded once here
+
+        Returns:
+            int: the event's id
+        """
+        data = json.dumps(payload)
+        with self.cond:
+            self.last_id += 1
+            self.ring[self.last_id % self.capacity] = (self.last_id, data)
+            self.cond.notify_all()
+            return self.last_id
+
+
+    def can_resume(self, last_seen):
+        """
+        Check whether every event after last_seen is still in the ring.
+
+        Args:
+            last_seen (int): last event id the client has
+
+        Returns:
+            bool: True if the client can catch up from the ring alone
+        """
+        with self.cond:
+            return 0 <= last_seen <= self.last_id and self.last_id - last_seen <= self.capacity
+
+
+    def read_after(self, last_seen, timeout=None):
+        """
+        Wait for events newer than last_seen and return them.
+
+        Args:
+            last_seen (int): last event id the client has
+            timeout (float): longest time to wait for something new
+
+        Returns:
+            tuple: (events, lost) where events is a list of (id, data) in
+            order and lost is True if some of the wanted events were already
+            overwritten (the client must resync)
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.last_id > last_seen, timeout)
+            if self.last_id - last_seen > self.capacity:
+                return [], True
+            events = []
+            for event_id in range(last_seen + 1, self.last_id + 1):
+                events.append(self.ring[event_id % self.capacity])
+            return events, False
@@ -0,0 +1,256 @@
+import json
+import os
+import tempfile
+
+from block import load_block
+from metrics import Counter
+
+FORK_DEPTH = 12 # side-branch blocks this far below the tip can no longer win and are evicted
+FINALITY_DEPTH = 100 # main-chain blocks this far below the tip are left to the BlockChain
+MAX_MEMORY_BLOCKS = 2000 # hard cap on blocks kept in memory
+SPILL_COMPACT_MIN = 1 << 20 # dead bytes tolerated in the spill file before it is rewritten, however small
+
+FORK_STORE_CAP = Counter("fork_store_cap_total", "Blocks moved out of the fork store's memory early to honour its cap",
+                         labels=("action",))
+
+
+class ForkStore:
+    """
+    Every block a peer has seen, kept in bounded memory.
+
+    It behaves like the dict of block id -> Block it replaces, with a
+    bound on what stays in memory:
+      - side-branch blocks (including orphans and spam) more than
+        fork_depth below the tip are evicted, since a branch that far
+        behind can no longer become the longest chain;
+      - main-chain blocks more than finality_depth below the tip are
+        released: the store keeps only their height and reads them back
+        from the main chain, which holds them anyway, so they are not kept
+        twice;
+      - if memory still holds more than max_memory_blocks, the oldest side
+        blocks are written to a spill file (still readable by id) first,
+        then the oldest main-chain blocks are released early.
+    values() only yields the blocks in memory: released blocks are final
+    and spilled ones too old to be the tip of a competing branch.
+    """
+    def __init__(self, spill_path=None, fork_depth=FORK_DEPTH, finality_depth=FINALITY_DEPTH,
+                 max_memory_blocks=MAX_MEMORY_BLOCKS):
+        """
+        Initialize the store.
+
+        Args:
+            spill_path (str): file for spilled blocks, or None for an
+                anonymous temporary file that disappears with the process
+            fork_depth (int): how far below the tip side branches are kept
+            finality_depth (int): how far below the tip main-chain blocks stay in memory
+            max_memory_blocks (int): most blocks kept in memory
+        """
+        self.fork_depth = fork_depth
+        self.finality_depth = finality_depth
+        self.max_memory_blocks = max_memory_blocks
+        self.memory = {} # block id -> Block, oldest first
+        self.final = {} # block id -> height of main-chain blocks released to the main chain
+        self.main_chain = [] # the main chain of the last prune(), where released blocks are read from
+        self.spilled = {} # block id -> (offset, length, height) of side blocks in the spill file
+        self.spill_path = spill_path
+        self.spill_file = None
+        self.spill_bytes = 0 # size of the spill file
+        self.dead_bytes = 0 # bytes of the spill file held by evicted blocks
+        self.compactions = 0 # spill file rewrites to reclaim dead bytes
+        self.evicted = 0 # side blocks dropped for being too deep
+        self.cap_spilled = 0 # side blocks spilled to honour max_memory_blocks
+        self.cap_released = 0 # main-chain blocks released early to honour max_memory_blocks
+
+
+    def __setitem__(self, block_id, block):
+        if block_id not in self.spilled and self.final_block(block_id) is None:
+            self.memory[block_id] = block
+
+
+    def __getitem__(self, block_id):
+        block = self.memory.get(block_id)
+        if block is not None:
+            return block
+        block = self.final_block(block_id)
+        if block is not None:
+            return block
+        offset, length, _ = self.spilled[block_id]
+        self.spill_file.seek(offset)
+        return load_block(json.loads(self.spill_file.read(length)))
+
+
+    def __contains__(self, block_id):
+        return block_id in self.memory or block_id in self.spilled or self.final_block(block_id) is not None
+
+
+    def __len__(self):
+        return len(self.memory) + len(self.final) + len(self.spilled)
+
+
+    def get(self, block_id, default=None):
+        return self[block_id] if block_id in self else default
+
+
+    def values(self):
+        return self.memory.values()
+
+
+    def clear(self):
+        self.memory.clear()
+        self.final.clear()
+        self.spilled.clear()
+        self.spill_bytes = 0
+        self.dead_bytes = 0
+        if self.spill_file is not None:
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+
+
+    def final_block(self, block_id):
+        """
+        A released main-chain block, read from the main chain.
+
+        Args:
+            block_id (str): id of the block
+
+        Returns:
+            Block or None: the block, or None if it was not released or a
+            reorg deeper than the finality depth has replaced it since
+        """
+        height = self.final.get(block_id)
+        if height is None or height >= len(self.main_chain):
+            return None
+        block = self.main_chain[height]
+        return block if block.get_id() == block_id else None
+
+
+    def release(self, block_id, height):
+        """
+        Drop a main-chain block from memory, keeping only its height.
+
+        Args:
+            block_id (str): id of a block in memory
+            height (int): its height on the main chain
+        """
+        del self.memory[block_id]
+        self.final[block_id] = height
+
+
+    def spill(self, block_id):
+        """
+        Move one block from memory to the end of the spill file.
+
+        Args:
+            block_id (str): id of a block in memory
+        """
+        if self.spill_file is None:
+            self.spill_file = open(self.spill_path, "w+b") if self.spill_path else tempfile.TemporaryFile()
+        block = self.memory.pop(block_id)
+        data = (json.dumps(block.to_dict()) + "\n").encode()
+        offset = self.spill_file.seek(0, 2)
+        self.spill_file.write(data)
+        self.spilled[block_id] = (offset, len(data), block.header.block_num)
+        self.spill_bytes += len(data)
+
+
+    def compact_spill(self):
+        """
+        Rewrite the spill file with only the records still in use, so the
+        bytes of dropped blocks do not pile up on a long-running node. It
+        runs once the dead bytes outnumber the live ones, so each spilled
+        byte is copied O(1) times on average.
+        """
+        if self.spill_path:
+            new_file = open(self.spill_path + ".tmp", "w+b")
+        else:
+            new_file = tempfile.TemporaryFile()
+        spilled = {}
+        for block_id, (offset, length, height) in self.spilled.items():
+            self.spill_file.seek(offset)
+            spilled[block_id] = (new_file.tell(), length, height)
+            new_file.write(self.spill_file.read(length))
+        new_file.flush()
+        self.spill_file.close()
+        if self.spill_path:
+            os.replace(self.spill_path + ".tmp", self.spill_path)
+        self.spill_file = new_file
+        self.spilled = spilled
+        self.spill_bytes = new_file.tell()
+        self.dead_bytes = 0
+        self.compactions += 1
+
+
+    def prune(self, main_chain):
+        """
+        Evict deep side branches and release final main-chain blocks, then
+        enforce the memory cap.
+
+        Args:
+            main_chain (list): the current main chain, genesis first
+
+        Returns:
+            dict: stats() after pruning
+        """
+        self.main_chain = main_chain
+        tip = len(main_chain) - 1
+        main, side = [], []
+        for block_id, block in self.memory.items():
+            height = block.header.block_num
+            if height <= tip and (main_chain[height] is block or main_chain[height].get_id() == block_id):
+                main.append((height, block_id))
+            else:
+                side.append((height, block_id))
+
+        for (height, block_id) in side:
+            if height < tip - self.fork_depth:
+                del self.memory[block_id]
+                self.evicted += 1
+        for block_id in [block_id for (block_id, (_, _, height)) in self.spilled.items() if height < tip - self.fork_depth]:
+            self.dead_bytes += self.spilled.pop(block_id)[1]
+            self.evicted += 1
+        if self.dead_bytes > max(SPILL_COMPACT_MIN, self.spill_bytes - self.dead_bytes):
+            self.compact_spill()
+        main.sort()
+        for (height, block_id) in main:
+            if height < tip - self.finality_depth:
+                self.release(block_id, height)
+
+        excess = len(self.memory) - self.max_memory_blocks
+        if excess > 0:
+            main_ids = {block_id for (_, block_id) in main}
+            for block_id in [block_id for block_id in self.memory if block_id not in main_ids][:excess]:
+                self.spill(block_id)
+                self.cap_spilled += 1
+                FORK_STORE_CAP.inc(action="spilled")
+                excess -= 1
+            for (height, block_id) in main:
+                if excess <= 0:
+                    break
+                if block_id in self.memory:
+                    self.release(block_id, height)
+                    self.cap_released += 1
+                    FORK_STORE_CAP.inc(action="released")
+                    excess -= 1
+        return self.stats()
+
+
+    def stats(self):
+        """
+        Report what the store holds.
+
+        Returns:
+            dict: block counts in memory, released to the main chain and on
+            disk, spill file size and eviction counters
+        """
+        return {
+            "memory_blocks": len(self.memory),
+            "max_memory_blocks": self.max_memory_blocks,
+            "final_blocks": len(self.final),
+            "spilled_blocks": len(self.spilled),
+            "spill_bytes": self.spill_bytes,
+            "dead_bytes": self.dead_bytes,
+            "compactions": self.compactions,
+            "evicted": self.evicted,
+            "cap_spilled": self.cap_spilled,
+            "cap_released": self.cap_released,
+        }
@@ -0,0 +1,157 @@
+import math
+import random
+import threading
+import time
+
+MIN_FANOUT = 4 # fewest peers a message is forwarded to (small networks are simply flooded)
+LATENCY_SCALE = 1.0 # seconds of average send time that cost as much as never delivering first
+LATENCY_WEIGHT = 0.2 # weight of each new send time in the moving average
+INVALID_PENALTY = 1.0 # score lost for every invalid block or transaction relayed to us
+MAX_INVALID = 3 # invalid messages after which a peer is dropped
+BAN_SECONDS = 600 # how long a dropped peer is ignored
+
+
+def gossip_fanout(n, fanout=None):
+    """
+    How many of n peers to forward a message to.
+
+    Forwarding to about sqrt(n) random peers, each of which forwards it
+    again the first time it sees it, reaches the whole network in a few
+    hops while each node sends sqrt(n) copies instead of n.
+
+    Args:
+        n (int): peers available
+        fanout (int): fixed fanout, or None for max(MIN_FANOUT, ceil(sqrt(n)))
+
+    Returns:
+        int: number of peers, at most n
+    """
+    if fanout is None:
+        fanout = max(MIN_FANOUT, math.ceil(math.sqrt(n)))
+    return min(n, fanout)
+
+
+class PeerScores:
+    """
+    What we know about how useful each peer is.
+
+    A peer's score is the share of the messages it sent us that were new
+    to us (smoothed, so a peer we know nothing about starts at 0.5), minus
+    its average send time over LATENCY_SCALE, minus INVALID_PENALTY for
+    every invalid block or transaction it relayed. After MAX_INVALID
+    invalid messages it is dropped: never chosen, and its messages are
+    ignored, for BAN_SECONDS.
+    """
+    def __init__(self, rng=None):
+        """
+        Initialize the scores.
+
+        Args:
+            rng (random.Random): randomness for choose(); the simulator
+                passes its seeded one
+        """
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.latency = {} # peer id -> moving average of send seconds
+        self.received = {} # peer id -> messages it delivered to us
+        self.first = {} # peer id -> of those, how many we had not seen yet
+        self.invalid_count = {} # peer id -> invalid messages it relayed
+        self.banned_until = {} # peer id -> time its messages count again
+
+
+    def sent(self, peer_id, ok, seconds):
+        """
+        Record how long a send to a peer took (the Broadcaster observer).
+        """
+        if not ok:
+            return
+        with self.lock:
+            previous = self.latency.get(peer_id)
+            self.latency[peer_id] = seconds if previous is None else previous + LATENCY_WEIGHT * (seconds - previous)
+
+
+    def delivered(self, peer_id, first):
+        """
+        Record a block or transaction a peer sent us.
+
+        Args:
+            peer_id (tuple): the sender
+            first (bool): True if nobody had sent it to us before
+        """
+        with self.lock:
+            self.received[peer_id] = self.received.get(peer_id, 0) + 1
+            if first:
+                self.first[peer_id] = self.first.get(peer_id, 0) + 1
+
+
+    def invalid(self, peer_id):
+        """
+        Record an invalid block or transaction from a peer, dropping the
+        peer once it has sent MAX_INVALID of them.
+        """
+        with self.lock:
+            count = self.invalid_count.get(peer_id, 0) + 1
+            self.invalid_count[peer_id] = count
+            if count >= MAX_INVALID:
+                self.banned_until[peer_id] = time.time() + BAN_SECONDS
+
+
+    def banned(self, peer_id):
+        """
+        Whether a peer is currently dropped for relaying invalid data.
+        """
+        return self.banned_until.get(peer_id, 0) > time.time()
+
+
+    def score(self, peer_id):
+        """
+        The peer's score (see the class docstring); higher is better.
+        """
+        first_share = (self.first.get(peer_id, 0) + 1) / (self.received.get(peer_id, 0) + 2)
+        return (first_share - self.latency.get(peer_id, 0) / LATENCY_SCALE
+                - INVALID_PENALTY * self.invalid_count.get(peer_id, 0))
+
+
+    def choose(self, peers, k):
+        """
+        Pick k peers to forward a message to: half of them the best scored,
+        the rest at random from the others, so new peers get the chance to
+        earn a score. Dropped peers are never picked.
+
+        Args:
+            peers (list): candidate peer ids
+            k (int): how many to pick
+
+        Returns:
+            list: the chosen peer ids
+        """
+        with self.lock:
+            candidates = [p for p in peers if not self.banned(p)]
+            if k >= len(candidates):
+                return candidates
+            self.rng.shuffle(candidates) # equal scores in random order, or every node favours the same peers
+            ranked = sorted(candidates, key=lambda p: -self.score(p))
+        best = ranked[:(k + 1) // 2]
+        rest = ranked[len(best):]
+        return best + self.rng.sample(rest, k - len(best))
+
+
+    def stats(self):
+        """
+        Report the scores.
+
+        Returns:
+            dict: peer ("ip:port" or its URL) -> {"score", "latency_s", "first", "received", "invalid", "banned"}
+        """
+        with self.lock:
+            peers = set(self.latency) | set(self.received) | set(self.invalid_count)
+            report = {}
+            for p in sorted(peers):
+                name = p if isinstance(p, str) else f"{p[0]}:{p[1]}"
+                report[name] = {"score": round(self.score(p), 3),
+                                "latency_s": round(self.latency.get(p, 0), 4),
+                                "first": self.first.get(p, 0),
+                                "received": self.received.get(p, 0),
+                                "invalid": self.invalid_count.get(p, 0),
+                                "banned": self.banned(p)}
+            return report
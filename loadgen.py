@@ -0,0 +1,367 @@
+import argparse, json, socket, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from block import load_block
+from tracker_loadtest import percentile
+from transactions import Transaction
+
+POLL_INTERVAL = 0.2 # seconds between chain polls; also the resolution of the latencies
+REORG_WINDOW = 12 # recent blocks re-read on every poll so a reorg is noticed
+TX_TIMEOUT = 60 # a transfer not included after this long is given up on
+PAGE = 5000 # blocks per /api/blocks request (the UI's MAX_PAGE)
+
+
+def send_to_ui(url, tx):
+    """
+    Queue a transfer on a UI node through POST /api/block.
+
+    Args:
+        url (str): base URL of the UI, e.g. "http://localhost:7201"
+        tx (Transaction): the transfer (the UI signs it again itself)
+
+    Returns:
+        bool: True if the node accepted it
+    """
+    try:
+        r = requests.post(f"{url}/api/block", json={"sender": tx.sender, "recipient": tx.recipient,
+                                                    "artwork_id": tx.artwork_id}, timeout=10)
+        return r.status_code == 202
+    except requests.RequestException:
+        return False
+
+
+def send_to_peer(address, tx):
+    """
+    Send a signed transfer to a peer as a NEW_TRANSACTION message.
+
+    Args:
+        address (tuple): (ip, port) of the peer
+        tx (Transaction): the signed transfer
+
+    Returns:
+        bool: True if the message was sent
+    """
+    try:
+        with socket.create_connection(address, timeout=10) as s:
+            s.sendall((json.dumps({"message_type": "NEW_TRANSACTION", "data": tx.to_dict()}) + "\n").encode())
+        return True
+    except OSError:
+        return False
+
+
+class ChainFollower:
+    """
+    Follows one node's main chain through GET /api/blocks and notes when
+    each tracked transaction is included and when it has k confirmations.
+
+    The last REORG_WINDOW blocks are re-read on every poll: if a block
+    there changed, the chain is rolled back to it and the transactions of
+    the dropped blocks count as not included again (a transaction keeps
+    the time it was first included, but must reach k confirmations on the
+    chain that wins).
+    """
+    def __init__(self, url, confirmations):
+        """
+        Initialize the follower at the node's current tip.
+
+        Args:
+            url (str): base URL of the UI to read the chain from
+            confirmations (int): k, blocks on top of (and including) a
+                transaction's block for it to count as confirmed
+        """
+        self.url = url
+        self.confirmations = confirmations
+        self.lock = threading.Lock()
+        self.tracked = {} # tx hash -> record dict (see LoadGenerator.submit)
+        self.block_ids = {} # height -> block id, from start_height on
+        self.block_txs = {} # height -> tx hashes of tracked transactions in that block
+        self.unconfirmed = {} # tx hash -> height, included but short of k confirmations
+        self.start_height = self.chain_height()
+        self.next_height = self.start_height
+        self.stop_event = threading.Event()
+
+
+    def chain_height(self):
+        """
+        Ask the node how many blocks its main chain has.
+        """
+        r = requests.get(f"{self.url}/api/blocks", params={"order": "tip", "limit": 1}, timeout=10)
+        return int(r.headers["X-Chain-Height"])
+
+
+    def track(self, tx_hash, record):
+        """
+        Start watching for a transaction.
+        """
+        with self.lock:
+            self.tracked[tx_hash] = record
+
+
+    def poll(self):
+        """
+        Read the new blocks (and the reorg window) and update the records.
+        """
+        start = max(self.start_height, self.next_height - REORG_WINDOW)
+        r = requests.get(f"{self.url}/api/blocks", params={"from_height": start, "limit": PAGE}, timeout=30)
+        now = time.time()
+        with self.lock:
+            for data in r.json():
+                height = data["header"]["block_num"]
+                block_id = load_block(data).get_id()
+                if self.block_ids.get(height) == block_id:
+                    continue
+                self.roll_back(height)
+                self.block_ids[height] = block_id
+                self.block_txs[height] = []
+                for tx in data["transactions"]:
+                    tx_hash = Transaction.from_dict(tx).hash()
+                    record = self.tracked.get(tx_hash)
+                    if record is None:
+                        continue
+                    record["height"] = height
+                    record.setdefault("included", now)
+                    self.block_txs[height].append(tx_hash)
+                    self.unconfirmed[tx_hash] = height
+                self.next_height = height + 1
+
+            tip = self.next_height - 1
+            for tx_hash, height in list(self.unconfirmed.items()):
+                if tip - height + 1 >= self.confirmations:
+                    self.tracked[tx_hash]["confirmed"] = now
+                    del self.unconfirmed[tx_hash]
+
+
+    def roll_back(self, height):
+        """
+        Forget the blocks from height up, after a reorg replaced them.
+        """
+        for h in range(height, self.next_height):
+            self.block_ids.pop(h, None)
+            for tx_hash in self.block_txs.pop(h, []):
+                self.tracked[tx_hash].pop("height", None)
+                self.unconfirmed.pop(tx_hash, None)
+        self.next_height = min(self.next_height, height)
+
+
+    def run(self):
+        """
+        Background thread: poll until stopped.
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except (requests.RequestException, ValueError):
+                pass
+            self.stop_event.wait(POLL_INTERVAL)
+
+
+class LoadGenerator:
+    """
+    Mints a set of artworks, then keeps transferring them along chains of
+    owners (each transfer goes to a brand-new owner, so no two transfers
+    share a hash).
+
+    An artwork has at most one transfer in flight: the next one is only
+    sent once the previous one is on the chain, so every transfer is valid
+    when it arrives. Run enough artworks for the rate you ask for.
+    """
+    def __init__(self, send, targets, follower, artworks, prefix, workers):
+        """
+        Initialize the generator.
+
+        Args:
+            send (callable): send(target, tx) -> bool, send_to_ui or send_to_peer
+            targets (list): UI URLs or (ip, port) peers; each artwork always
+                goes to the same target so its transfers stay in order
+            follower (ChainFollower): watches the chain for inclusion
+            artworks (int): number of artworks kept in circulation
+            prefix (str): prefix of artwork and owner names, unique per run
+            workers (int): threads sending requests
+        """
+        self.send = send
+        self.targets = targets
+        self.follower = follower
+        self.prefix = prefix
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.owners = {f"{prefix}-ART{i}": "MINT" for i in range(artworks)} # artwork -> owner once minted
+        self.in_flight = {} # artwork -> record of its transfer not yet included
+        self.records = [] # every measured record
+        self.sequence = 0
+        self.send_errors = 0
+        self.timed_out = 0
+
+
+    def submit(self, artwork, measured):
+        """
+        Send the next transfer of an artwork (its mint if it has none yet).
+
+        Args:
+            artwork (str): an artwork with no transfer in flight
+            measured (bool): count this transfer in the report
+        """
+        self.sequence += 1
+        sender = self.owners[artwork]
+        tx = Transaction(sender, f"{self.prefix}-owner{self.sequence}", artwork, "")
+        tx.sign(sender)
+        record = {"artwork": artwork, "recipient": tx.recipient, "submitted": time.time()}
+        self.in_flight[artwork] = record
+        self.follower.track(tx.hash(), record)
+        if measured:
+            self.records.append(record)
+        target = self.targets[hash(artwork) % len(self.targets)]
+        self.pool.submit(self.send_one, target, tx, record)
+
+
+    def send_one(self, target, tx, record):
+        """
+        Worker: send one transfer and note if that failed.
+        """
+        if not self.send(target, tx):
+            record["error"] = True
+
+
+    def free_artworks(self):
+        """
+        Settle finished transfers and list the artworks that can move again.
+
+        Returns:
+            list: artworks with nothing in flight
+        """
+        now = time.time()
+        with self.follower.lock:
+            for artwork, record in list(self.in_flight.items()):
+                if "height" in record:
+                    self.owners[artwork] = record["recipient"]
+                    del self.in_flight[artwork]
+                elif record.get("error") or now - record["submitted"] > TX_TIMEOUT:
+                    # the node refused or lost it: the artwork's owner is unknown, retire it
+                    self.send_errors += bool(record.get("error"))
+                    self.timed_out += not record.get("error")
+                    del self.in_flight[artwork]
+                    del self.owners[artwork]
+        return [artwork for artwork in self.owners if artwork not in self.in_flight]
+
+
+    def mint(self, timeout):
+        """
+        Mint every artwork and wait until the mints are on the chain.
+
+        Returns:
+            int: artworks minted
+        """
+        for artwork in list(self.owners):
+            self.submit(artwork, measured=False)
+        deadline = time.time() + timeout
+        while self.in_flight and time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+            self.free_artworks()
+        return len(self.owners)
+
+
+    def run(self, duration, rate=None, concurrency=None, measured=True):
+        """
+        Send transfers for duration seconds, either at a fixed rate (open
+        loop) or keeping a fixed number in flight (closed loop).
+
+        Args:
+            duration (float): seconds to run
+            rate (float): transfers per second
+            concurrency (int): transfers in flight, if rate is None
+            measured (bool): count the transfers in the report
+
+        Returns:
+            int: at a fixed rate, transfers skipped because every artwork was busy
+        """
+        skipped = 0
+        start = time.time()
+        due_so_far = 0
+        while time.time() - start < duration:
+            free = self.free_artworks()
+            if rate:
+                due = int((time.time() - start) * rate) - due_so_far
+                due_so_far += due
+                skipped += max(0, due - len(free))
+            else:
+                due = concurrency - len(self.in_flight)
+            for artwork in free[:max(0, due)]:
+                self.submit(artwork, measured)
+            time.sleep(min(POLL_INTERVAL, 1 / rate) if rate else 0.01)
+        return skipped
+
+
+def main():
+    """
+    Put transfer load on a running network and report confirmation latency.
+    """
+    ap = argparse.ArgumentParser(description="Send transfers to a running network and measure how fast they confirm.")
+    ap.add_argument("--ui", action="append", default=[], help="UI URL to send to (repeatable)")
+    ap.add_argument("--peer", action="append", default=[], help="peer ip:port to send NEW_TRANSACTION to (repeatable)")
+    ap.add_argument("--observe", help="UI URL whose chain is watched (default: the first --ui)")
+    ap.add_argument("--rate", type=float, help="transfers per second (open loop)")
+    ap.add_argument("--concurrency", type=int, default=50, help="transfers in flight, when --rate is not set")
+    ap.add_argument("--artworks", type=int, default=200, help="artworks kept in circulation")
+    ap.add_argument("--duration", type=float, default=60, help="seconds of measured load")
+    ap.add_argument("--drain", type=float, default=30, help="seconds of unmeasured load afterwards, so the last transfers get buried")
+    ap.add_argument("-k", "--confirmations", type=int, default=3)
+    ap.add_argument("--workers", type=int, default=32, help="threads sending requests")
+    ap.add_argument("--prefix", default=f"LOAD{int(time.time())}", help="name prefix for artworks and owners")
+    ap.add_argument("--json", help="also write the report to this file")
+    args = ap.parse_args()
+
+    if args.ui:
+        send, targets = send_to_ui, [url.rstrip("/") for url in args.ui]
+    elif args.peer:
+        send, targets = send_to_peer, [(p.rsplit(":", 1)[0], int(p.rsplit(":", 1)[1])) for p in args.peer]
+    else:
+        ap.error("give at least one --ui or --peer")
+    observe = (args.observe or (args.ui[0] if args.ui else None))
+    if observe is None:
+        ap.error("--peer needs --observe, a UI whose chain shows what got mined")
+
+    follower = ChainFollower(observe.rstrip("/"), args.confirmations)
+    threading.Thread(target=follower.run, daemon=True).start()
+    gen = LoadGenerator(send, targets, follower, args.artworks, args.prefix, args.workers)
+
+    print(f"minting {args.artworks} artworks...", flush=True)
+    minted = gen.mint(TX_TIMEOUT)
+    print(f"{minted} minted; measuring for {args.duration}s "
+          f"({f'{args.rate}/s' if args.rate else f'{args.concurrency} in flight'})", flush=True)
+    started = time.time()
+    skipped = gen.run(args.duration, args.rate, args.concurrency)
+    measured_for = time.time() - started
+    gen.run(args.drain, args.rate, args.concurrency, measured=False)
+    follower.stop_event.set()
+    gen.pool.shutdown()
+
+    with follower.lock:
+        records = [dict(r) for r in gen.records]
+    included = [r["included"] - r["submitted"] for r in records if "included" in r]
+    confirmed = [r["confirmed"] - r["submitted"] for r in records if "confirmed" in r]
+    report = {
+        "submitted": len(records),
+        "send_errors": sum(1 for r in records if r.get("error")),
+        "included": len(included),
+        "confirmed": len(confirmed),
+        "confirmations": args.confirmations,
+        "skipped": skipped,
+        "seconds": round(measured_for, 2),
+        "submitted_per_s": round(len(records) / measured_for, 2),
+        "included_per_s": round(len(included) / measured_for, 2),
+        "confirmed_per_s": round(len(confirmed) / measured_for, 2),
+    }
+    for (name, samples) in (("inclusion", included), ("confirmation", confirmed)):
+        for pct in (50, 99, 99.9):
+            report[f"{name}_p{str(pct).replace('.', '')}_s"] = round(percentile(samples, pct), 3)
+    for key, value in report.items():
+        print(f"{key:<22} {value}")
+    if skipped:
+        print(f"({skipped} transfers skipped because every artwork was busy: raise --artworks for this rate)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import json
+import os
+
+from transactions import Transaction
+
+COMPACT_MIN = 1000 # dead lines tolerated before a compaction, however small the mempool
+
+
+class MempoolJournal:
+    """
+    The mempool on disk, as an append-only NDJSON journal.
+
+    Every transaction that enters the mempool is appended as an
+    {"add": tx} line and every batch that leaves it (mined, confirmed by a
+    peer's block or dropped as a conflict) as one {"drop": [hashes]} line,
+    flushed to the OS each time, so a restart loses nothing. Replaying the
+    file gives the mempool back in arrival order. Once the dead lines
+    outnumber the live transactions (and COMPACT_MIN), the file is
+    rewritten with just the live ones, so it stays within about twice the
+    mempool and each change costs O(1) amortized.
+    """
+    def __init__(self, path, compact_min=COMPACT_MIN):
+        """
+        Initialize the journal (load() opens it).
+
+        Args:
+            path (str): journal file
+            compact_min (int): fewest dead lines that trigger a compaction
+        """
+        self.path = path
+        self.compact_min = compact_min
+        self.file = None
+        self.live = 0 # transactions in the mempool
+        self.dead = 0 # lines that no longer describe it
+        self.compactions = 0
+        self.skipped = 0 # malformed lines ignored by the last load(), e.g. a write cut short by a crash
+
+
+    def load(self):
+        """
+        Replay the journal and open it for appending.
+
+        Returns:
+            dict: hash -> Transaction for those still in the mempool, in
+            arrival order
+        """
+        entries = {}
+        lines = 0
+        line = b"\n"
+        self.skipped = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                        if "add" in record:
+                            tx = Transaction.from_dict(record["add"])
+                            entries.setdefault(tx.hash(), tx)
+                        else:
+                            for tx_hash in record["drop"]:
+                                entries.pop(tx_hash, None)
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        self.skipped += 1
+        self.live = len(entries)
+        self.dead = lines - self.live
+        self.file = open(self.path, "a")
+        if not line.endswith(b"\n"):
+            self.file.write("\n") # so the next record does not run into a half-written one
+        return entries
+
+
+    def write(self, record):
+        """
+        Append one record and hand it to the OS.
+        """
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+
+    def append(self, tx):
+        """
+        Record a transaction entering the mempool.
+        """
+        self.write({"add": tx.to_dict()})
+        self.live += 1
+
+
+    def drop(self, tx_hashes, pending):
+        """
+        Record transactions leaving the mempool, compacting if it is time.
+
+        Args:
+            tx_hashes (list): hashes of the transactions that left
+            pending (list): the mempool after they left
+        """
+        self.write({"drop": list(tx_hashes)})
+        self.live = len(pending)
+        self.dead += len(tx_hashes) + 1
+        if self.dead > max(self.compact_min, self.live):
+            self.compact(pending)
+
+
+    def compact(self, pending):
+        """
+        Rewrite the journal with only the given transactions. The new file
+        is written next to the old one and swapped in, so a crash leaves
+        one or the other.
+
+        Args:
+            pending (list): the mempool, in arrival order
+        """
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for tx in pending:
+                f.write(json.dumps({"add": tx.to_dict()}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self.file is not None:
+            self.file.close()
+        os.replace(tmp, self.path)
+        self.file = open(self.path, "a")
+        self.live = len(pending)
+        self.dead = 0
+        self.compactions += 1
+
+
+    def close(self):
+        """
+        Close the file.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,256 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REGISTRY = [] # every metric created in this process, in creation order
+
+
+def format_labels(names, values, extra=()):
+    """
+    Format a label set the way the Prometheus text format wants it.
+    Values are escaped, but callers should still only pass values from a
+    small fixed set: every distinct value is a new series kept forever.
+
+    Args:
+        names (tuple): label names
+        values (tuple): label values, same order
+        extra (tuple): more (name, value) pairs to append, e.g. ("le", "0.5")
+
+    Returns:
+        str: '{a="1",b="2"}', or "" if there are no labels
+    """
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for (name, value) in pairs) + "}"
+
+
+def escape_label(value):
+    """
+    Escape a label value as the text format requires (backslash, double
+    quote and newline), so no value can end its line early or add lines.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    """
+    Base class: a named metric with optional labels, registered on creation.
+
+    Updates take one small lock and do a dict lookup, so they are cheap
+    enough to leave on in hot paths; all formatting happens in render().
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        """
+        Initialize the metric.
+
+        Args:
+            name (str): metric name, e.g. "peer_socket_errors_total"
+            help_text (str): one-line description for # HELP
+            labels (tuple): label names; values are passed as keyword arguments
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {} # label values tuple -> value
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+
+    def key(self, labels):
+        """
+        Turn keyword label values into the tuple the values are stored under.
+        """
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+
+    def samples(self):
+        """
+        Lines of this metric in the text format, without HELP/TYPE.
+        """
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {value}" for (key, value) in items]
+
+
+class Counter(Metric):
+    """
+    A value that only goes up.
+    """
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Add amount to the counter for the given label values.
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, either set directly or read from a
+    function at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        """
+        Initialize the gauge (see Metric).
+        """
+        super().__init__(name, help_text, labels)
+        self.functions = {} # label values tuple -> function read at scrape time
+
+
+    def set(self, value, **labels):
+        """
+        Set the gauge for the given label values.
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+    def set_function(self, function, **labels):
+        """
+        Read the value for the given label values from function() whenever
+        metrics are rendered, so the hot path does not have to keep it up
+        to date.
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.functions[key] = function
+
+
+    def remove(self, **labels):
+        """
+        Drop the value or function for the given label values, e.g. when
+        the object a function reads from goes away, so the gauge no longer
+        keeps it alive.
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values.pop(key, None)
+            self.functions.pop(key, None)
+
+
+    def samples(self):
+        """
+        Lines of this gauge, calling the functions it has.
+        """
+        lines = super().samples()
+        with self.lock:
+            functions = list(self.functions.items())
+        for (key, function) in functions:
+            try:
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {function()}")
+            except Exception:
+                pass
+        return lines
+
+
+class Histogram(Metric):
+    """
+    Counts of observations in cumulative buckets, plus their sum.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        """
+        Initialize the histogram.
+
+        Args:
+            buckets (tuple): upper bounds of the buckets, increasing
+        """
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+
+    def observe(self, value, **labels):
+        """
+        Record one observation for the given label values.
+        """
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+
+    def samples(self):
+        """
+        Bucket, sum and count lines for every label set.
+        """
+        with self.lock:
+            items = [(key, list(counts), total) for (key, (counts, total)) in self.values.items()]
+        lines = []
+        for (key, counts, total) in items:
+            running = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                running += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', bound)])} {running}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {running}")
+        return lines
+
+
+def render():
+    """
+    Render every registered metric in the Prometheus text format.
+
+    Returns:
+        str: the exposition, ready to serve as text/plain; version=0.0.4
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET /metrics with render(); anything else is a 404.
+    """
+    def do_GET(self):
+        """
+        Serve one scrape.
+        """
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass # scrapes every few seconds would drown the node's own output
+
+
+def serve(port, host=""):
+    """
+    Serve GET /metrics on its own port from a background thread, for
+    processes (like a peer) that have no HTTP server of their own.
+
+    Args:
+        port (int): port to listen on
+        host (str): address to bind, all interfaces by default
+
+    Returns:
+        ThreadingHTTPServer: the server; shutdown() stops it
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
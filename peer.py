@@ -1,19 +1,207 @@
+import argparse
+import base64
+import heapq
+import selectors
 import socket
+import zlib
 from blockchain import BlockChain
 import json
 from transactions import Transaction
 from block import load_block
+from block_template import build_block_template
+from broadcast import Broadcaster
+from gossip import PeerScores, gossip_fanout
+from fork_store import ForkStore
+from mempool_journal import MempoolJournal
+from metrics import Counter, Gauge, Histogram, serve as serve_metrics
 import time
 import threading
+import random
 import os
+import queue
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+PEX_INTERVAL = 10 # seconds between peer-exchange rounds
+PEX_FANOUT = 3 # peers we swap samples with each round
+PEX_SAMPLE_SIZE = 20 # freshest known peers included in each sample
+PEER_STALE_AFTER = 60 # forget peers nobody has heard from for this long
+MIN_PEX_PEERS = 8 # below this many live peers we keep registering with the tracker
+INGEST_QUEUE_SIZE = 1000 # received messages waiting for a validation worker before senders get BUSY
+APPLY_QUEUE_SIZE = 256 # validated messages waiting for the ordered apply stage
+INGEST_WORKERS = 2 # threads that decode and validate messages
+READ_TIMEOUT = 2 # seconds a sender has to deliver its message line
+BUSY_RETRY_AFTER = 0.2 # seconds we ask a sender to wait before trying again
+BUSY_RETRIES = 2 # times send_to retries a peer that answered BUSY
+SEEN_LIMIT = 100000 # block ids and transaction hashes remembered, so each is handled and relayed once
+PROTOCOL_VERSION = 1 # version of the peer-to-peer messages, announced in HELLO
+MIN_PROTOCOL_VERSION = 1 # oldest version we still sync with
+CODECS = ("zlib", "json") # encodings of BLOCKS batches we can read, preferred first
+MESSAGE_TYPES = frozenset({"NEW_TRANSACTION", "NEW_BLOCK", "PEER_LIST", "PEER_DELTA", "PEX", "HELLO",
+                           "GET_BLOCKS", "BLOCKS"}) # what a peer handles; anything else is counted as "other"
+SYNC_BATCH = 500 # most blocks in one BLOCKS reply
+SYNC_TIMEOUT = 10 # seconds to wait for a BLOCKS reply before asking another peer
+
+SOCKET_ERRORS = Counter("peer_socket_errors_total", "Failed connections to peers or the tracker", labels=("target",))
+MESSAGES_RECEIVED = Counter("peer_messages_total", "Messages received from other peers", labels=("type",))
+BLOCK_PROPAGATION = Histogram("block_propagation_seconds", "Delay from a block being mined to it reaching this node",
+                              (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+INGEST_REJECTED = Counter("peer_ingest_rejected_total", "Messages refused with BUSY because the ingest queue was full")
+INGEST_INVALID = Counter("peer_ingest_invalid_total", "Messages dropped as malformed or invalid before reaching the chain",
+                         labels=("type",))
+SPOOFED = Counter("peer_spoofed_total", "Messages dropped because the ip they claim is not where their connection came from",
+                  labels=("type",))
+BUSY_REPLIES = Counter("peer_busy_replies_total", "BUSY answers received from peers we sent to")
+INGEST_QUEUE_DEPTH = Gauge("peer_ingest_queue_depth", "Received messages waiting for a validation worker", labels=("peer",))
+APPLY_QUEUE_DEPTH = Gauge("peer_apply_queue_depth", "Validated messages waiting for the ordered apply stage", labels=("peer",))
+MEMPOOL_SIZE = Gauge("mempool_transactions", "Transactions waiting to be mined", labels=("peer",))
+PEERS_KNOWN = Gauge("peers_known", "Peers this node currently knows about", labels=("peer",))
+PEER_GAUGES = (INGEST_QUEUE_DEPTH, APPLY_QUEUE_DEPTH, MEMPOOL_SIZE, PEERS_KNOWN) # read from each Peer, labelled ip:port
+HANDSHAKES = Counter("peer_handshakes_total", "HELLO messages received, by where the sender's chain stood against ours",
+                     labels=("outcome",))
+SYNC_BLOCKS = Counter("peer_sync_blocks_total", "Blocks received through catch-up sync")
+
+
+def message_label(message):
+    """
+    The metric label for a message's type: the type itself if it is one we
+    handle, otherwise "other", so a sender cannot add series of its own.
+
+    Args:
+        message: the decoded message (possibly not even a dict)
+
+    Returns:
+        str: the label value
+    """
+    message_type = message.get("message_type") if isinstance(message, dict) else None
+    return message_type if isinstance(message_type, str) and message_type in MESSAGE_TYPES else "other"
+
+
+def read_line(sock):
+    """
+    Read one newline-terminated message from a socket.
+
+    Args:
+        sock (socket.socket): connected socket
+
+    Returns:
+        str: the message without the trailing newline
+    """
+    chunks = []
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        if b"\n" in chunk:
+            chunks.append(chunk[:chunk.index(b"\n")])
+            break
+        chunks.append(chunk)
+    return b"".join(chunks).decode().strip()
+
+
+def encode_blocks(blocks, codec):
+    """
+    Encode blocks for the "data" field of a BLOCKS message.
+
+    Args:
+        blocks (list): Block objects
+        codec (str): "json" for a list of block dicts, "zlib" for that list
+            as zlib-compressed JSON in base64
+
+    Returns:
+        list or str: the encoded blocks
+    """
+    dicts = [blk.to_dict() for blk in blocks]
+    if codec == "zlib":
+        return base64.b64encode(zlib.compress(json.dumps(dicts).encode())).decode()
+    return dicts
+
+
+def decode_blocks(data, codec):
+    """
+    Decode the "data" field of a BLOCKS message (see encode_blocks).
+
+    Returns:
+        list: Block objects
+
+    Raises:
+        ValueError: if the data is not valid for the codec
+    """
+    if codec == "zlib":
+        try:
+            data = json.loads(zlib.decompress(base64.b64decode(data)))
+        except zlib.error as e:
+            raise ValueError(f"bad zlib data: {e}") from e
+    return [load_block(d) for d in data]
+
+
+@lru_cache(maxsize=1024)
+def resolve_host(host):
+    """
+    The IPv4 address a host name resolves to, or None if it does not.
+    Cached, since every message from a peer names the same host.
+    """
+    try:
+        return socket.gethostbyname(host)
+    except (OSError, UnicodeError, TypeError):
+        return None
+
+
+def claims_origin(claimed, origin):
+    """
+    Whether the ip a message claims to come from is the address its
+    connection really came from (any loopback address matches any other).
+
+    Args:
+        claimed (str): the message's "ip" field
+        origin (str): the remote address of the connection
+
+    Returns:
+        bool: True if they are the same host
+    """
+    resolved = resolve_host(claimed)
+    if resolved is None:
+        return False
+    if resolved == origin:
+        return True
+    return resolved.startswith("127.") and origin.startswith("127.")
+
+
+def block_locator(blocks):
+    """
+    Heights and ids of some of our main-chain blocks, for a peer to find
+    the last block our chains share: the 10 newest one by one, then
+    stepping back twice as far each time, down to genesis.
+
+    Args:
+        blocks (list): the main chain
+
+    Returns:
+        list: [height, block id] pairs, newest first
+    """
+    locator = []
+    height = len(blocks) - 1
+    step = 1
+    while height > 0:
+        locator.append([height, blocks[height].get_id()])
+        if len(locator) >= 10:
+            step *= 2
+        height -= step
+    locator.append([0, blocks[0].get_id()])
+    return locator
+
 
 class Peer:
-    def __init__(self, ip, port, tracker_ip, tracker_port):
+    def __init__(self, ip, port, tracker_ip, tracker_port, pex=True, keep_blocks=None, fanout=None, relay=True,
+                 mempool_path=None):
         self.ip = ip
         self.port = port
         self.tracker_ip = tracker_ip
         self.tracker_port = tracker_port
         self.lock = threading.Lock()
+        self.chain_lock = threading.Lock() # one writer at a time for blockchain and all_blocks; readers use blockchain.snapshot()
+        self.pending_lock = threading.Lock() # one writer at a time for pending_transactions
         self.stop_event = threading.Event()
         self.alive_bool = False
         
@@ -22,18 +210,60 @@ class Peer:
         
         # self.stop_event = threading.Event()
 
-        self.blockchain = BlockChain() # our private ledger
+        self.blockchain = BlockChain(keep_blocks) # our private ledger (pruned to the last keep_blocks blocks if set)
         
-        self.pending_transactions = [] # unconfirmed Transaction objects
+        self.pending_transactions = [] # unconfirmed Transaction objects; only appended to or replaced, so a [:] copy is a consistent snapshot
         self.unseen_blocks = {} # blocks whose parent we havent seen befor
         self.peers = [] # [(ip, port), …] addresses of other peers
+        self.peer_list_version = 0 # last tracker membership version applied to self.peers
+        self.peer_list_lock = threading.Lock() # the apply stage and keep_alive both apply tracker lists to self.peers
+        self.peers_behind = threading.Event() # a PEER_DELTA skipped changes; keep_alive asks the tracker for them
+        self.pex = pex # find peers through peer exchange, using the tracker only to bootstrap
+        self.known_peers = {} # (ip, port) -> last time anyone heard from that peer (PEX mode)
+        self.departed = {} # (ip, port) -> when it left or stopped answering
         
-        self.all_blocks = {} # keeping every block we have seen
+        self.all_blocks = ForkStore() # every block we have seen, bounded by fork and finality depth
+
+        self.fanout = fanout # peers each block or transaction is gossiped to; None for about sqrt(number of peers)
+        self.relay = relay # forward blocks and transactions the first time we see them
+        self.scores = PeerScores() # latency, first deliveries and invalid data per peer
+        self.seen_txs = OrderedDict() # hashes of the transactions seen lately, oldest first (under pending_lock)
+        self.seen_blocks = OrderedDict() # ids of the blocks seen lately, oldest first (under chain_lock); all_blocks evicts stale ones
+        self.broadcaster = Broadcaster(self.send_to, observer=self.scores.sent) # concurrent sends with per-peer deadlines and failure tracking
+
+        self.handshakes = False # send HELLO to peers as we meet them; set once we listen, so their replies reach us
+        self.sync_lock = threading.Lock() # guards peer_tips and the catch-up state below
+        self.peer_tips = {} # (ip, port) -> chain tip, protocol and codecs from its last HELLO
+        self.sync_from = None # peer we are catching up from, if any
+        self.sync_deadline = 0 # time after which we stop waiting for its BLOCKS
+        self.sync_after = None # [height, id] of the last block it sent, where the next batch starts
+        self.sync_batch = SYNC_BATCH # most blocks we send per BLOCKS reply
+        self.codecs = CODECS # BLOCKS encodings we ask for, preferred first
+        self.clock = time.time # what catch_up() measures its timeout with (the simulator's is virtual)
+
+        self.ingest_queue = queue.Queue(INGEST_QUEUE_SIZE) # (sequence, raw line) from the acceptor
+        self.apply_queue = queue.Queue(APPLY_QUEUE_SIZE) # (sequence, message, payload) from the workers
         
         self.chain_file = "chain.json" # where we'll save/load the chain
+        self.mempool = MempoolJournal(mempool_path) if mempool_path else None # pending_transactions on disk, or None to keep them only in memory
         
         self.load_create_chain() # load or create the genesis chain
+        self.recover_mempool() # reload the transactions pending when we last stopped
+        self.register_metrics()
         
+    def register_metrics(self):
+        """
+        Point the peer gauges, labelled with our ip:port, at this peer.
+        close() removes them again, so a closed peer is not kept alive by
+        the gauges and several peers in one process each get their own.
+        """
+        label = f"{self.ip}:{self.port}"
+        MEMPOOL_SIZE.set_function(lambda: len(self.pending_transactions), peer=label)
+        PEERS_KNOWN.set_function(lambda: len(self.peers), peer=label)
+        INGEST_QUEUE_DEPTH.set_function(self.ingest_queue.qsize, peer=label)
+        APPLY_QUEUE_DEPTH.set_function(self.apply_queue.qsize, peer=label)
+
+
     def load_create_chain(self):
         """
         Load the chain from disk if it exists, otherwise make the genesis block.
@@ -48,35 +278,65 @@ class Peer:
                                              artwork_id="GENESIS_ART")
         for blk in self.blockchain.blocks:
             self.all_blocks[blk.get_id()] = blk
-                
+
+
+    def recover_mempool(self):
+        """
+        Reload pending_transactions from the mempool journal.
+
+        Each journalled transaction is checked against the chain as it is
+        now: bad signatures, transactions already in the chain and ones
+        that can no longer be mined (double spends, second mints) are
+        dropped, and the rest come back in their original order. The
+        journal is then compacted to just those.
+
+        Returns:
+            int: transactions recovered
+        """
+        if self.mempool is None:
+            return 0
+        started = time.perf_counter()
+        journalled = self.mempool.load()
+        view = self.blockchain.snapshot()
+        fresh = [(tx_hash, tx) for (tx_hash, tx) in journalled.items() if view.find_transaction(tx_hash) is None]
+        _, conflicts, _ = build_block_template(view, [tx for (_, tx) in fresh], len(fresh))
+        rejected = {id(tx) for (tx, _) in conflicts}
+        recovered = [(tx_hash, tx) for (tx_hash, tx) in fresh if id(tx) not in rejected]
+        with self.pending_lock:
+            for (tx_hash, _) in recovered:
+                self.first_sighting(self.seen_txs, tx_hash)
+            self.pending_transactions = [tx for (_, tx) in recovered]
+            if self.mempool.dead or len(recovered) < len(journalled):
+                self.mempool.compact(self.pending_transactions)
+        if journalled:
+            print(f"[peer] recovered {len(recovered)} of {len(journalled)} journalled transactions "
+                  f"in {time.perf_counter() - started:.2f}s", flush=True)
+        return len(recovered)
+
         
     def connect_to_tracker(self):
+        """
+        Join the network through the tracker and start the background threads.
 
-        message = {
-            "message_type": "JOIN",
-            "ip": self.ip,
-            "port": self.port
-        }
-        
-        # open, send, recv, then close     
-        with socket.create_connection((self.tracker_ip, self.tracker_port), timeout=5) as s:
-            #print("[DEBUG][peer] Connected to tracker", flush=True)
-            s.sendall((json.dumps(message) + "\n").encode())
-            #print("[DEBUG][peer] JOIN sent", flush=True)
-            time.sleep(0.05)
-            raw = s.recv(2048).decode().strip()
-            #print(f"[DEBUG][peer] raw reply: {raw}", flush=True)
+        In PEX mode the tracker only hands out a bootstrap sample; if it is
+        unreachable we carry on with whatever peers we already know.
+        """
+        try:
+            self.bootstrap()
+        except OSError:
+            SOCKET_ERRORS.inc(target="tracker")
+            if not (self.pex and self.peers):
+                raise
+            print("[peer] tracker unreachable, continuing with known peers", flush=True)
 
-            message = json.loads(raw)
-            if message.get("message_type") == "PEER_LIST":
-                for peer in message.get("peers", []):
-                    if ((peer["ip"], peer["port"]) != (self.ip, self.port)) and ((peer["ip"], peer["port"]) not in self.peers):
-                        self.peers.append((peer["ip"], peer["port"]))
-            else:
-                print(f"[ERROR][peer] unexpected reply: {message}", flush=True)
-        
         self.listen_thread = threading.Thread(target=self.receive_message, daemon=True)
         self.listen_thread.start()
+        self.handshakes = True
+        self.greet(self.peers)
+
+        if self.pex:
+            # introduce ourselves to the bootstrap sample right away
+            self.exchange_peers(self.peers)
         
         if not self.alive_bool:
             # keep-alive thread
@@ -91,34 +351,516 @@ class Peer:
         #     self.mining_bool = True
         
 
+    def bootstrap(self):
+        """
+        Send JOIN to the tracker and apply the PEER_LIST it answers with.
+        """
+        message = {
+            "message_type": "JOIN",
+            "ip": self.ip,
+            "port": self.port,
+            "subscribe": not self.pex
+        }
+        
+        # open, send, recv, then close     
+        with socket.create_connection((self.tracker_ip, self.tracker_port), timeout=5) as s:
+            #print("[DEBUG][peer] Connected to tracker", flush=True)
+            s.sendall((json.dumps(message) + "\n").encode())
+            #print("[DEBUG][peer] JOIN sent", flush=True)
+            raw = read_line(s)
+            #print(f"[DEBUG][peer] raw reply: {raw}", flush=True)
+
+        message = json.loads(raw)
+        if message.get("message_type") == "PEER_LIST":
+            self.apply_peer_list(message)
+        else:
+            print(f"[ERROR][peer] unexpected reply: {message}", flush=True)
+
+
+    def apply_peer_list(self, message):
+        """
+        Take in a PEER_LIST from the tracker.
+
+        A full list replaces self.peers; a bootstrap sample (PEX mode) is
+        merged into the known peers as freshly seen.
+
+        Args:
+            message (dict): PEER_LIST message with "version" and "peers"
+        """
+        if self.pex:
+            now = time.time()
+            self.merge_known_peers([dict(peer, seen=now) for peer in message.get("peers", [])])
+            return
+
+        peers = []
+        for peer in message.get("peers", []):
+            if (peer["ip"], peer["port"]) != (self.ip, self.port):
+                peers.append((peer["ip"], peer["port"]))
+        with self.peer_list_lock:
+            joined = [peer_id for peer_id in peers if peer_id not in self.peers]
+            self.peers = peers
+            self.peer_list_version = message.get("version", 0)
+        self.greet(joined)
+
+
+    def apply_peer_delta(self, message):
+        """
+        Apply a PEER_DELTA from the tracker on top of self.peers.
+
+        Changes we already have are skipped. If the delta starts after our
+        version, some changes were missed; keep_alive asks the tracker for
+        them, so a slow tracker never holds up the apply stage.
+
+        Args:
+            message (dict): PEER_DELTA message with "from_version" and "changes"
+        """
+        with self.peer_list_lock:
+            if message.get("from_version", 0) > self.peer_list_version:
+                self.peers_behind.set()
+                return
+
+            peers = list(self.peers)
+            for change in message.get("changes", []):
+                if change["version"] <= self.peer_list_version:
+                    continue
+                peer_id = (change["ip"], change["port"])
+                if change["change"] == "JOIN":
+                    if peer_id != (self.ip, self.port) and peer_id not in peers:
+                        peers.append(peer_id)
+                elif change["change"] == "LEAVE":
+                    if peer_id in peers:
+                        peers.remove(peer_id)
+                self.peer_list_version = change["version"]
+            joined = [peer_id for peer_id in peers if peer_id not in self.peers]
+            self.peers = peers
+        self.greet(joined)
+
+
+    def request_peer_changes(self):
+        """
+        Ask the tracker for every membership change after our version.
+
+        The tracker answers with a PEER_DELTA, or with a full PEER_LIST if it
+        no longer remembers that far back. Runs on the keep_alive thread.
+        """
+        self.peers_behind.clear()
+        message = {
+            "message_type": "GET_PEERS",
+            "ip": self.ip,
+            "port": self.port,
+            "since": self.peer_list_version
+        }
+        try:
+            with socket.create_connection((self.tracker_ip, self.tracker_port), timeout=3) as s:
+                s.sendall((json.dumps(message) + "\n").encode())
+                reply = json.loads(read_line(s))
+        except (OSError, ValueError):
+            SOCKET_ERRORS.inc(target="tracker")
+            self.peers_behind.set() # try again next round
+            return
+
+        if reply.get("message_type") == "PEER_LIST":
+            self.apply_peer_list(reply)
+        elif reply.get("message_type") == "PEER_DELTA":
+            self.apply_peer_delta(reply)
+
+
+    def merge_known_peers(self, entries):
+        """
+        Merge peer-exchange entries into known_peers, keeping the freshest
+        timestamp for each peer, and refresh self.peers.
+
+        A peer that left is only taken back if someone heard from it after
+        it left.
+
+        Args:
+            entries (list of dict): {"ip", "port", "seen"} entries
+        """
+        with self.lock:
+            for entry in entries:
+                try:
+                    peer_id = (entry["ip"], int(entry["port"]))
+                    seen = float(entry["seen"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if peer_id == (self.ip, self.port):
+                    continue
+                if seen <= self.departed.get(peer_id, 0):
+                    continue
+                if seen > self.known_peers.get(peer_id, 0):
+                    self.known_peers[peer_id] = seen
+            self.refresh_peer_view()
+
+
+    def forget_known_peer(self, peer_id, when=None):
+        """
+        Drop a peer that left or did not answer.
+
+        Args:
+            peer_id (tuple): (ip, port) of the peer
+            when (float): time it left; defaults to now
+        """
+        with self.lock:
+            self.known_peers.pop(peer_id, None)
+            self.departed[peer_id] = when if when is not None else time.time()
+            self.refresh_peer_view()
+
+
+    def refresh_peer_view(self):
+        """
+        Expire stale known peers and rebuild self.peers from the rest.
+
+        Must be called with self.lock held.
+        """
+        cutoff = time.time() - PEER_STALE_AFTER
+        for peer_id, seen in list(self.known_peers.items()):
+            if seen < cutoff:
+                del self.known_peers[peer_id]
+        for peer_id, left in list(self.departed.items()):
+            if left < cutoff:
+                del self.departed[peer_id]
+        current = set(self.peers)
+        joined = [peer_id for peer_id in self.known_peers if peer_id not in current]
+        self.peers = list(self.known_peers)
+        self.greet(joined)
+
+
+    def peer_sample(self):
+        """
+        Pick the freshest known peers, plus ourselves, to send in a PEX message.
+
+        Returns:
+            list of dict: {"ip", "port", "seen"} entries
+        """
+        with self.lock:
+            freshest = sorted(self.known_peers.items(), key=lambda item: item[1], reverse=True)
+        sample = [{"ip": self.ip, "port": self.port, "seen": time.time()}]
+        for ((ip, port), seen) in freshest[:PEX_SAMPLE_SIZE]:
+            sample.append({"ip": ip, "port": port, "seen": seen})
+        return sample
+
+
+    def send_to(self, peer_id, message, timeout=3):
+        """
+        Open a connection to a peer, send one message and close.
+
+        The peer closes the connection once the message is queued, or
+        first answers BUSY if its ingest queue is full; then we wait as
+        long as it asks and try again, a few times at most. The whole
+        exchange, retries included, has one deadline: each connect, send,
+        read and retry wait only gets the time that is left of it.
+
+        Args:
+            peer_id (tuple): (ip, port) of the peer
+            message (dict): message to send
+            timeout (float): seconds the peer has to take the message
+
+        Returns:
+            bool: True if the message was sent and accepted
+        """
+        data = (json.dumps(message) + "\n").encode()
+        deadline = time.time() + timeout
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                with socket.create_connection(peer_id, timeout=max(deadline - time.time(), 0.001)) as s:
+                    s.settimeout(max(deadline - time.time(), 0.001))
+                    s.sendall(data)
+                    s.settimeout(max(deadline - time.time(), 0.001))
+                    reply = read_line(s)
+            except OSError:
+                SOCKET_ERRORS.inc(target="peer")
+                return False
+            if not reply.startswith("{"):
+                return True
+            BUSY_REPLIES.inc()
+            try:
+                retry_after = float(json.loads(reply).get("retry_after", BUSY_RETRY_AFTER))
+            except (ValueError, AttributeError):
+                retry_after = BUSY_RETRY_AFTER
+            if attempt == BUSY_RETRIES or time.time() + retry_after >= deadline:
+                break # no time left for another try
+            time.sleep(retry_after)
+        return False
+
+
+    def exchange_peers(self, targets=None):
+        """
+        Send our peer sample to a few peers and ask for theirs back.
+
+        Args:
+            targets (list): peers to contact; defaults to PEX_FANOUT random live peers
+        """
+        if targets is None:
+            peers = list(self.peers)
+            targets = random.sample(peers, min(PEX_FANOUT, len(peers)))
+        message = {
+            "message_type": "PEX",
+            "ip": self.ip,
+            "port": self.port,
+            "reply": True,
+            "peers": self.peer_sample()
+        }
+        for peer_id in targets:
+            if not self.send_to(peer_id, message):
+                self.forget_known_peer(peer_id)
+
+
+    def handle_pex(self, message):
+        """
+        Merge a PEX sample from another peer and answer with ours if asked.
+
+        Args:
+            message (dict): PEX message
+        """
+        sender = (message.get("ip"), message.get("port"))
+        if message.get("leaving"):
+            self.forget_known_peer(sender, message.get("seen"))
+            return
+        self.merge_known_peers(message.get("peers", []))
+        if message.get("reply") and sender in self.known_peers:
+            reply = {
+                "message_type": "PEX",
+                "ip": self.ip,
+                "port": self.port,
+                "reply": False,
+                "peers": self.peer_sample()
+            }
+            self.send_to(sender, reply)
+
+
+    def hello(self, reply):
+        """
+        Build a HELLO message describing our chain tip, protocol version
+        and codecs.
+
+        Args:
+            reply (bool): ask the peer to answer with its own HELLO
+
+        Returns:
+            dict: the message
+        """
+        view = self.blockchain.snapshot()
+        return {
+            "message_type": "HELLO",
+            "ip": self.ip,
+            "port": self.port,
+            "reply": reply,
+            "protocol": PROTOCOL_VERSION,
+            "codecs": list(self.codecs),
+            "height": len(view.blocks) - 1,
+            "tip": view.blocks[-1].get_id(),
+            "work": view.work(),
+            "serves_from": view.pruned_height
+        }
+
+
+    def greet(self, peer_ids):
+        """
+        Start the handshake with peers we just connected to, without
+        waiting for the sends. Does nothing until we are listening.
+
+        Args:
+            peer_ids (list): (ip, port) of the new peers
+        """
+        targets = [peer_id for peer_id in peer_ids if peer_id != (self.ip, self.port)]
+        if self.handshakes and targets:
+            self.broadcaster.broadcast(targets, self.hello(reply=True), wait_for=False)
+
+
+    def handle_hello(self, message, tip):
+        """
+        Take in a peer's HELLO: answer it if asked, remember the peer's tip
+        and catch up if its chain is longer than ours.
+
+        Args:
+            message (dict): HELLO message
+            tip (dict): its fields, checked by prepare_message()
+        """
+        sender = self.sender_of(message)
+        if sender is None:
+            return
+        if message.get("reply"):
+            self.broadcaster.broadcast([sender], self.hello(reply=False), wait_for=False)
+        if tip["protocol"] < MIN_PROTOCOL_VERSION:
+            HANDSHAKES.inc(outcome="incompatible")
+            return
+        height = len(self.blockchain.snapshot().blocks) - 1
+        HANDSHAKES.inc(outcome="ahead" if tip["height"] > height else "behind" if tip["height"] < height else "even")
+        with self.sync_lock:
+            self.peer_tips[sender] = tip
+        self.catch_up()
+
+
+    def catch_up(self):
+        """
+        Ask the peer furthest ahead of us for the blocks we are missing.
+
+        Only peers whose HELLO showed a longer chain than ours (our fork
+        choice rule) and that still have full blocks where ours ends are
+        asked, the most work breaking ties; one at a time, moving on to
+        the next if it does not answer within SYNC_TIMEOUT.
+        """
+        view = self.blockchain.snapshot()
+        height = len(view.blocks) - 1
+        with self.sync_lock:
+            now = self.clock()
+            if self.sync_from is not None:
+                if now < self.sync_deadline:
+                    return
+                self.peer_tips.pop(self.sync_from, None) # it never answered
+                self.sync_from = None
+            ahead = [(tip["height"], tip["work"], peer_id) for (peer_id, tip) in self.peer_tips.items()
+                     if tip["height"] > height and tip["serves_from"] <= height + 1]
+            if not ahead:
+                self.sync_after = None
+                return
+            _, _, peer_id = max(ahead)
+            self.sync_from = peer_id
+            self.sync_deadline = now + SYNC_TIMEOUT
+            codecs = self.peer_tips[peer_id]["codecs"]
+            locator = block_locator(view.blocks)
+            if self.sync_after is not None:
+                locator.insert(0, self.sync_after)
+        message = {
+            "message_type": "GET_BLOCKS",
+            "ip": self.ip,
+            "port": self.port,
+            "locator": locator,
+            "codec": next((codec for codec in self.codecs if codec in codecs), "json")
+        }
+        self.broadcaster.broadcast([peer_id], message, wait_for=False)
+
+
+    def repair(self, sender, block):
+        """
+        Fetch what is missing below a block that is higher than our tip
+        but could not be connected to it.
+
+        Gossip reaches each peer through a few random others, so a peer
+        can miss a block, and every block after it would then fail the
+        previous-hash check. The sender evidently has a chain up to this
+        block, so it counts as a peer that is ahead of us and catch_up()
+        asks it for the gap. If it cannot serve it, the next such block
+        tries its sender.
+
+        Args:
+            sender (tuple): (ip, port) the block came from
+            block (Block): the block we could not connect
+        """
+        height = block.header.block_num
+        with self.sync_lock:
+            tip = self.peer_tips.get(sender)
+            if tip is None:
+                self.peer_tips[sender] = {"protocol": PROTOCOL_VERSION, "codecs": ["json"], "height": height,
+                                          "tip": block.get_id(), "work": 0, "serves_from": 0}
+            elif tip["height"] < height:
+                tip.update(height=height, tip=block.get_id())
+        self.catch_up()
+
+
+    def serve_blocks(self, message):
+        """
+        Answer GET_BLOCKS with the next batch of our main chain after the
+        newest locator entry we share. The batch is empty if we share none
+        or have pruned those blocks.
+
+        Args:
+            message (dict): GET_BLOCKS message
+        """
+        sender = self.sender_of(message)
+        if sender is None:
+            return
+        view = self.blockchain.snapshot()
+        start = None
+        for (height, block_id) in message.get("locator", []):
+            if 0 <= height < len(view.blocks) and view.blocks[height].get_id() == block_id:
+                start = height + 1
+                break
+        blocks = []
+        if start is not None and start >= self.blockchain.pruned_height:
+            blocks = [view.blocks[h] for h in range(start, min(len(view.blocks), start + self.sync_batch))]
+        codec = message.get("codec") if message.get("codec") in CODECS else "json"
+        reply = {
+            "message_type": "BLOCKS",
+            "ip": self.ip,
+            "port": self.port,
+            "height": len(view.blocks) - 1,
+            "codec": codec,
+            "data": encode_blocks(blocks, codec)
+        }
+        self.broadcaster.broadcast([sender], reply, wait_for=False)
+
+
+    def apply_blocks(self, message, blocks):
+        """
+        Take in a BLOCKS batch from the peer we are catching up from, then
+        ask for the next one. A batch that brings nothing new means the
+        peer cannot help us (no shared block, or pruned), so it is left out
+        until its next HELLO.
+
+        Args:
+            message (dict): BLOCKS message
+            blocks (list): its blocks, validated by prepare_message()
+        """
+        sender = self.sender_of(message)
+        with self.sync_lock:
+            if sender is None or sender != self.sync_from:
+                return # not asked for
+            self.sync_from = None
+            tip = self.peer_tips.get(sender)
+            if tip is not None:
+                tip["height"] = int(message.get("height", tip["height"]))
+
+        confirmed, firsts = self.accept_blocks(blocks)
+        if confirmed:
+            self.remove_pending(lambda tx: tx.hash() not in confirmed)
+        SYNC_BLOCKS.inc(len(blocks))
+        with self.sync_lock:
+            if any(firsts):
+                self.sync_after = [blocks[-1].header.block_num, blocks[-1].get_id()]
+            else:
+                self.peer_tips.pop(sender, None)
+                self.sync_after = None
+        print(f"[peer] synced {len(blocks)} blocks from {sender[0]}:{sender[1]}, "
+              f"height now {len(self.blockchain.snapshot().blocks) - 1}", flush=True)
+        self.catch_up()
+
+
     def add_block(self, block):
         """
-        Add a block to the blockchain.
+        Add a block we made to the tip of the blockchain and gossip it.
+
+        The tip check and the add happen together under chain_lock, so a
+        peer's block applied in between cannot slip under ours; a block
+        that no longer fits the tip is neither stored nor gossiped.
 
         Args:
             block (Block): The block to add to the blockchain.
+
+        Returns:
+            bool: True if the block was connected
         """
-        self.blockchain.add_to_chain(block)
+        with self.chain_lock:
+            if block.header.prev_block_hash != self.blockchain.blocks[-1].get_id():
+                return False # a peer's block landed while we were mining
+            if not self.blockchain.add_to_chain(block):
+                return False
+            self.all_blocks[block.get_id()] = block
+            self.first_sighting(self.seen_blocks, block.get_id())
 
         message = {
             "message_type": "NEW_BLOCK", 
+            "ip": self.ip,
+            "port": self.port,
             "data": block.to_dict()
         }
+        self.gossip(message)
+        return True
+
 
-        for (peer_ip, peer_port) in self.peers:
-            if peer_ip == self.ip and peer_port == self.port:
-                continue
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((peer_ip, peer_port))
-                sock.sendall((json.dumps(message) + "\n").encode())
-                sock.close()
-            except:
-                pass
-            
     def broadcast_transaction(self, tx):
         """
-        Send a NEW_TRANSACTION message to every peer in self.peers.
+        Gossip a NEW_TRANSACTION message to our peers.
 
         Args:
             tx (Transaction): The transaction to broadcast.
@@ -126,18 +868,90 @@ class Peer:
         
         message = {
             "message_type": "NEW_TRANSACTION",
+            "ip": self.ip,
+            "port": self.port,
             "data": tx.to_dict()
         }
-        
-        for (peer_ip, peer_port) in self.peers:
-            try:
-                with socket.create_connection((peer_ip, peer_port), timeout=3) as s:
-                    s.sendall((json.dumps(message) + "\n").encode())
-            except Exception:
-                # if send fails, remove stale peers
-                self.peers.remove((peer_ip, peer_port))
-                pass
-            
+        self.gossip(message)
+
+
+    def broadcast(self, message):
+        """
+        Send a message to every live peer at once and wait until each has
+        taken it or missed its deadline. Peers that keep failing are
+        skipped for a while by the broadcaster; membership itself is left
+        to the tracker and peer exchange.
+
+        Args:
+            message (dict): message to send
+
+        Returns:
+            tuple: (delivered, failed, skipped) lists of (ip, port)
+        """
+        targets = [peer_id for peer_id in self.peers if peer_id != (self.ip, self.port)]
+        return self.broadcaster.broadcast(targets, message)
+
+
+    def gossip(self, message, exclude=None, wait_for=True):
+        """
+        Send a block or transaction to gossip_fanout() of our peers, chosen
+        by PeerScores.choose(): the best scored plus a few at random. Every
+        peer forwards what it sees for the first time the same way, so it
+        reaches the whole network while each node sends about sqrt(N)
+        copies instead of N.
+
+        Args:
+            message (dict): message to send
+            exclude (tuple): peer not to send it to (whoever sent it to us)
+            wait_for (bool): wait for the sends (see Broadcaster.broadcast)
+
+        Returns:
+            tuple: (delivered, failed, skipped) lists of (ip, port)
+        """
+        peers = [peer_id for peer_id in self.peers if peer_id not in ((self.ip, self.port), exclude)]
+        targets = self.scores.choose(peers, gossip_fanout(len(peers), self.fanout))
+        return self.broadcaster.broadcast(targets, message, wait_for)
+
+
+    def relay_message(self, message):
+        """
+        Forward a block or transaction we just saw for the first time, as
+        coming from us, without waiting for the sends.
+        """
+        if self.relay:
+            self.gossip(dict(message, ip=self.ip, port=self.port), exclude=self.sender_of(message), wait_for=False)
+
+
+    def sender_of(self, message):
+        """
+        The (ip, port) a block or transaction message came from, or None
+        for a message that does not say.
+        """
+        if "ip" in message and "port" in message:
+            return (message["ip"], message["port"])
+        return None
+
+
+    def first_sighting(self, seen, key):
+        """
+        Remember a block id or transaction hash. Must be called with the
+        lock guarding seen held.
+
+        Args:
+            seen (OrderedDict): seen_blocks or seen_txs
+            key (str): the block id or transaction hash
+
+        Returns:
+            bool: True if we had not seen it before
+        """
+        if key in seen:
+            return False
+        seen[key] = True
+        if len(seen) > SEEN_LIMIT:
+            seen.popitem(last=False)
+        return True
+
+
     def submit_transaction(self, sender, recipient, artwork_id, sender_key):
         """
         Create, sign, store, and broadcast a new transaction.
@@ -149,139 +963,490 @@ class Peer:
         tx = Transaction(sender, recipient, artwork_id, signature="")
         # sign it in-place using the sender_key
         tx.sign(sender_key)
-        self.pending_transactions.append(tx)
-        # broadcast it to all peers
+        with self.pending_lock:
+            self.first_sighting(self.seen_txs, tx.hash())
+            self.add_pending(tx)
+        # gossip it to our peers
         self.broadcast_transaction(tx)
-        
-    
+
+
+    def mine_pending(self, max_txs=512):
+        """
+        Mine a block from pending_transactions and announce it.
+
+        The block template builder picks and orders the transactions so the
+        block is not rejected over a conflict; conflicting transactions are
+        dropped from the pending list, the rest stay for a later block. The
+        block's transactions only leave the pending list once it is
+        connected, so losing the race to a peer's block loses nothing.
+
+        Args:
+            max_txs (int): most transactions to put in the block
+
+        Returns:
+            Block or None: the mined block, or None if nothing could be mined
+        """
+        view = self.blockchain.snapshot()
+        txs, conflicts, deferred = build_block_template(view, self.pending_transactions[:], max_txs)
+        self.drop_pending({id(tx) for (tx, _) in conflicts})
+        if not txs:
+            return None
+
+        block = view.mine_next_block(txs)
+        if not self.add_block(block):
+            return None # the tip moved under us: the transactions stay pending for the next block
+        self.drop_pending({id(tx) for tx in txs})
+        return block
+
+
+    def add_pending(self, tx):
+        """
+        Append a transaction to pending_transactions and the journal. Must
+        be called with pending_lock held.
+        """
+        self.pending_transactions.append(tx)
+        if self.mempool is not None:
+            self.mempool.append(tx)
+
+
+    def remove_pending(self, keep):
+        """
+        Remove the transactions keep() rejects from pending_transactions
+        and the journal.
+
+        The list is replaced rather than edited, so readers holding a copy
+        of the old one are not disturbed.
+
+        Args:
+            keep (callable): keep(tx) -> bool
+        """
+        with self.pending_lock:
+            survivors, gone = [], []
+            for tx in self.pending_transactions:
+                (survivors if keep(tx) else gone).append(tx)
+            if not gone:
+                return
+            if self.mempool is not None:
+                self.mempool.drop([tx.hash() for tx in gone], survivors)
+            self.pending_transactions = survivors
+
+
+    def drop_pending(self, tx_ids):
+        """
+        Remove transactions from pending_transactions by id().
+        """
+        if tx_ids:
+            self.remove_pending(lambda tx: id(tx) not in tx_ids)
+
+
     def keep_alive(self):
         """
         Keep the peer alive by sending keep-alive messages to the tracker.
+
+        In PEX mode this thread runs the peer-exchange rounds instead, and
+        only pings the tracker while we know fewer than MIN_PEX_PEERS live
+        peers, so tracker load does not grow with the size of the network.
+        If we know nobody at all we ask the tracker for a new sample, and if
+        a PEER_DELTA showed we missed changes we ask for those.
         """
         while True:
             if self.stop_event.is_set():
                 break
 
-            message = {
-                "message_type": "KEEP_ALIVE",
-                "ip": self.ip,
-                "port": self.port
-            }
-            with socket.create_connection((self.tracker_ip, self.tracker_port), timeout=3) as s:
-                s.sendall((json.dumps(message) + "\n").encode())
+            if self.peers_behind.is_set():
+                self.request_peer_changes()
+
+            if self.pex:
+                with self.lock:
+                    self.refresh_peer_view()
+                if self.peers:
+                    self.exchange_peers()
+            self.catch_up() # moves on if the peer we are syncing from stopped answering
+
+            if not self.pex or len(self.peers) < MIN_PEX_PEERS:
+                message = {
+                    "message_type": "KEEP_ALIVE",
+                    "ip": self.ip,
+                    "port": self.port,
+                    "subscribe": not self.pex
+                }
+                try:
+                    if self.pex and not self.peers:
+                        self.bootstrap()
+                        self.exchange_peers(self.peers)
+                    else:
+                        with socket.create_connection((self.tracker_ip, self.tracker_port), timeout=3) as s:
+                            s.sendall((json.dumps(message) + "\n").encode())
+                except (OSError, ValueError):
+                    SOCKET_ERRORS.inc(target="tracker")
             
-            self.stop_event.wait(10)
+            self.stop_event.wait(PEX_INTERVAL)
 
 
     def receive_message(self):
         """
         Receive messages from other peers.
+
+        This thread only accepts connections and reads one line from each
+        into the ingest queue, so a burst of blocks never leaves senders
+        waiting in the kernel backlog behind validation. It reads every
+        open connection through one selector, so a sender that is slow to
+        deliver its line never holds up accept() or anyone else, and a
+        deadline heap closes the ones that take longer than READ_TIMEOUT.
+        Ingest workers decode and validate what it reads, and one apply
+        thread acts on the results in arrival order. When the ingest queue
+        is full the sender is told BUSY instead.
         """
         listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         listener.bind((self.ip, self.port))
         listener.listen()
-        listener.settimeout(1)
+        listener.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ, None)
 
-        self.pending_transactions = []
-        while True:
-            if self.stop_event.is_set():
-                break
+        stages = [threading.Thread(target=self.ingest_worker, daemon=True) for _ in range(INGEST_WORKERS)]
+        stages.append(threading.Thread(target=self.apply_stage, daemon=True))
+        for thread in stages:
+            thread.start()
+
+        sequence = 0
+        buffers = {} # open connection -> what it has sent so far
+        deadlines = [] # (deadline, n, connection), one per open connection
+        opened = 0
+        busy = (json.dumps({"message_type": "BUSY", "retry_after": BUSY_RETRY_AFTER}) + "\n").encode()
+        while not self.stop_event.is_set():
+            now = time.time()
+            while deadlines and deadlines[0][0] <= now:
+                _, _, connection = heapq.heappop(deadlines)
+                if connection in buffers: # still has not sent its line
+                    SOCKET_ERRORS.inc(target="peer")
+                    del buffers[connection]
+                    selector.unregister(connection)
+                    connection.close()
+            timeout = min(1, deadlines[0][0] - now) if deadlines else 1
+            for key, _ in selector.select(max(timeout, 0)):
+                if key.data is None:
+                    while True:
+                        try:
+                            connection, address = listener.accept()
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        except OSError:
+                            SOCKET_ERRORS.inc(target="peer")
+                            break
+                        connection.setblocking(False)
+                        buffers[connection] = bytearray()
+                        selector.register(connection, selectors.EVENT_READ, address[0])
+                        opened += 1
+                        heapq.heappush(deadlines, (now + READ_TIMEOUT, opened, connection))
+                    continue
+
+                connection = key.fileobj
+                try:
+                    chunk = connection.recv(65536)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    SOCKET_ERRORS.inc(target="peer")
+                    chunk = None
+                buffer = buffers[connection]
+                if chunk:
+                    buffer += chunk
+                    if b"\n" not in chunk:
+                        continue
+                # the line is complete (or the sender gave up): stop reading and queue it
+                del buffers[connection]
+                selector.unregister(connection)
+                try:
+                    response = bytes(buffer).split(b"\n", 1)[0].decode().strip() if chunk is not None else ""
+                    if response:
+                        try:
+                            self.ingest_queue.put_nowait((sequence, response, key.data))
+                            sequence += 1
+                        except queue.Full:
+                            INGEST_REJECTED.inc()
+                            connection.send(busy)
+                except (OSError, UnicodeDecodeError):
+                    SOCKET_ERRORS.inc(target="peer")
+                finally:
+                    connection.close()
+
+        for connection in buffers:
+            connection.close()
+        selector.close()
+        listener.close()
+        for thread in stages:
+            thread.join()
+
+
+    def ingest_worker(self):
+        """
+        Decode and validate received messages, then pass them on to the
+        apply stage with their sequence number. A message that is dropped,
+        whatever the reason, passes on as None so the sequence has no gaps
+        and the apply stage never waits for it.
+        """
+        while not self.stop_event.is_set():
             try:
-                connection, address = listener.accept()
-            except socket.timeout:
+                sequence, raw, origin = self.ingest_queue.get(timeout=1)
+            except queue.Empty:
                 continue
-            #connection, address = listener.accept()
-            response = connection.recv(4096).decode().strip()
-            connection.close()
+            message, payload = None, None
+            try:
+                message = json.loads(raw)
+                payload = self.prepare_message(message, origin)
+            except Exception as e:
+                print(f"[peer] ignoring malformed message: {e!r}", flush=True)
+                payload = None
+            if payload is None:
+                INGEST_INVALID.inc(type=message_label(message))
+            while True: # a stalled apply stage must not keep close() waiting on this thread
+                try:
+                    self.apply_queue.put((sequence, message, payload), timeout=1)
+                    break
+                except queue.Full:
+                    if self.stop_event.is_set():
+                        return
+
+
+    def apply_stage(self):
+        """
+        Apply validated messages to the chain, the mempool and the peer
+        list one at a time, in the order they were received, whatever
+        order the workers finish them in.
+        """
+        waiting = {} # sequence -> (message, payload) that finished ahead of their turn
+        next_sequence = 0
+        while not self.stop_event.is_set():
+            try:
+                sequence, message, payload = self.apply_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            waiting[sequence] = (message, payload)
+            while next_sequence in waiting:
+                message, payload = waiting.pop(next_sequence)
+                next_sequence += 1
+                if payload is None:
+                    continue
+                try:
+                    self.apply_message(message, payload)
+                except Exception as e:
+                    print(f"[peer] failed to apply {message.get('message_type')}: {e!r}", flush=True)
 
-            message = json.loads(response)
-            message_type = message["message_type"]
 
-            if message_type == "NEW_TRANSACTION":
-                data = message.get("data", [])
-                transaction = Transaction.from_dict(data)
-                if transaction.verify_signature():
-                    self.pending_transactions.append(transaction)
+    def handle_message(self, message):
+        """
+        Act on one message from another peer or the tracker: validate it,
+        then apply it if it passed.
 
-            if message_type == "NEW_BLOCK":
-                block_dict = message.get("data", [])
-                block = load_block(block_dict)
-                
+        Args:
+            message (dict): the decoded message
+        """
+        payload = self.prepare_message(message)
+        if payload is None:
+            INGEST_INVALID.inc(type=message_label(message))
+            return
+        self.apply_message(message, payload)
+
+
+    def prepare_message(self, message, origin=None):
+        """
+        The checks that need no chain state, run by the ingest workers:
+        build the transaction or block a message carries and verify it.
+        Invalid data counts against the peer that relayed it, and messages
+        from a peer dropped for that are ignored. A message whose claimed
+        ip is not the address its connection came from is dropped, so a
+        peer cannot get another one banned by signing its messages with
+        the victim's address.
+
+        Args:
+            message (dict): the decoded message
+            origin (str): remote address of the connection it came on
+                (None for messages handed over in-process, which are trusted)
+
+        Returns:
+            Transaction, Block, list of Blocks or dict: what apply_message()
+            needs (the message itself for the other types), or None if it
+            is invalid
+        """
+        message_type = message["message_type"]
+        MESSAGES_RECEIVED.inc(type=message_label(message))
+        sender = self.sender_of(message)
+        if sender is not None and origin is not None and not claims_origin(sender[0], origin):
+            SPOOFED.inc(type=message_label(message))
+            return None
+        if sender is not None and self.scores.banned(sender):
+            return None
+
+        payload = message
+        if message_type == "NEW_TRANSACTION":
+            payload = Transaction.from_dict(message.get("data", {}))
+            valid = payload.verify_signature()
+        elif message_type == "NEW_BLOCK":
+            payload = load_block(message.get("data", {}))
+            valid = payload.validate()
+        elif message_type == "BLOCKS":
+            payload = decode_blocks(message["data"], message.get("codec", "json"))
+            valid = all(blk.validate() for blk in payload)
+        elif message_type == "HELLO":
+            return {"protocol": int(message["protocol"]),
+                    "codecs": [codec for codec in message.get("codecs", []) if isinstance(codec, str)] or ["json"],
+                    "height": int(message["height"]),
+                    "tip": str(message["tip"]),
+                    "work": int(message["work"]),
+                    "serves_from": int(message.get("serves_from", 0))}
+        else:
+            return payload
+
+        if not valid:
+            if sender is not None:
+                self.scores.invalid(sender)
+            return None
+        return payload
+
+
+    def apply_message(self, message, payload):
+        """
+        Apply one validated message.
+
+        Args:
+            message (dict): the decoded message
+            payload: what prepare_message() returned for it
+        """
+        message_type = message["message_type"]
+
+        if message_type == "NEW_TRANSACTION":
+            with self.pending_lock:
+                first = self.first_sighting(self.seen_txs, payload.hash())
+                if first:
+                    self.add_pending(payload)
+            self.credit(message, first)
+            if first:
+                self.relay_message(message)
+
+        if message_type == "NEW_BLOCK":
+            confirmed, (first,) = self.accept_blocks([payload])
+            if first: # once per block, and only for one that passed validation
+                BLOCK_PROPAGATION.observe(max(0, time.time() - payload.header.timestamp_ms / 1000))
+            if confirmed:
+                # rebuilding pending_transactions to include only transactions not yet in the main chain
+                self.remove_pending(lambda tx: tx.hash() not in confirmed)
+            sender = self.sender_of(message)
+            if first and sender is not None and payload.header.block_num >= len(self.blockchain.blocks):
+                self.repair(sender, payload) # higher than our tip yet not connected: we missed a block
+            self.credit(message, first)
+            if first:
+                self.relay_message(message)
+        
+        if message_type == "PEER_LIST":
+            self.apply_peer_list(message)
+
+        if message_type == "PEER_DELTA":
+            self.apply_peer_delta(message)
+
+        if message_type == "PEX":
+            self.handle_pex(message)
+
+        if message_type == "HELLO":
+            self.handle_hello(message, payload)
+
+        if message_type == "GET_BLOCKS":
+            self.serve_blocks(message)
+
+        if message_type == "BLOCKS":
+            self.apply_blocks(message, payload)
+
+
+    def accept_blocks(self, blocks):
+        """
+        Store received blocks and move to the longest chain they make.
+
+        Blocks that extend our tip are connected directly, so a batch in
+        chain order needs one fork-choice pass at the end.
+
+        Args:
+            blocks (list): blocks prepare_message() just validated (they are not checked again), parents first
+
+        Returns:
+            tuple: (set of hashes of transactions now in the main chain,
+            list of whether each block was new to us)
+        """
+        # block acceptance is the only writer; readers use blockchain.snapshot()
+        with self.chain_lock:
+            confirmed = set() # hashes of transactions now in the main chain
+            firsts = []
+            for block in blocks:
                 ### for forking
                 block_id = block.get_id()
+                firsts.append(self.first_sighting(self.seen_blocks, block_id))
                 self.all_blocks[block_id] = block
-                
+
                 # trying to append it diretcly to current tip
                 tip_hash = self.blockchain.blocks[-1].get_id()
                 if block.header.prev_block_hash == tip_hash:
-                    if self.blockchain.add_to_chain(block):
-                        confirmed_transactions = []
-                        for transaction in block.transactions:
-                            confirmed_transactions.append(transaction)
-                            self.pending_transactions = []
-                            for pending_transaction in self.pending_transactions:
-                                if pending_transaction not in confirmed_transactions:
-                                    self.pending_transactions.append(pending_transaction)
-                
-                # recomputing the longest valid chain from all_blocks
-                best_chain = self.find_longest_chain()
-                if len(best_chain) > len(self.blockchain.blocks):
-                    #swap in longer chain
-                    self.blockchain.blocks = best_chain
-                    
-                    # buliding a set of all transactions in the chosen best_chain
-                    all_transactions = set()
-                    for b in best_chain:
-                        for tx in b.transactions:
-                            all_transactions.add(tx)
-                            
-                    # rebuilding pending_transactions list to include only transactions not yet included in any block of best_chain
-                    new_pending = []
-                    for tx in self.pending_transactions:
-                        if tx not in all_transactions:
-                            new_pending.append(tx)
-                    
-                    # replacing with the updatd list
-                    self.pending_transactions = new_pending
-            
-            if message_type == "PEER_UPDATE":
-                peers = message.get("peers", [])
-                self.peers = []
-                for peer in peers:
-                    if (peer["ip"], peer["port"]) != (self.ip, self.port):
-                        self.peers.append((peer["ip"], peer["port"]))
+                    # the ingest worker validated this object and nothing else holds it
+                    if self.blockchain.add_to_chain(block, validated=True):
+                        confirmed.update(tx.hash() for tx in block.transactions)
+
+            # recomputing the longest valid chain from all_blocks
+            best_chain = self.find_longest_chain()
+            if len(best_chain) > len(self.blockchain.blocks) and self.blockchain.switch_to(best_chain):
+                #swapped in longer chain: everything in it is confirmed
+                for b in best_chain:
+                    confirmed.update(tx.hash() for tx in b.transactions)
+
+            self.all_blocks.prune(self.blockchain.blocks)
+        return confirmed, firsts
+
+
+    def credit(self, message, first):
+        """
+        Score the sender of a block or transaction message for it.
+        """
+        sender = self.sender_of(message)
+        if sender is not None:
+            self.scores.delivered(sender, first)
+
 
-    
     def find_longest_chain(self):
         """
         Find the longest chain in the blockchain.
+
+        Each block we have seen is walked back only until it meets our main
+        chain, whose prefix is reused, so the cost depends on how long the
+        side branches are rather than on the whole chain.
         """
         zero_hash = "00" * 32
-        best = []
+        main = self.blockchain.blocks
+        best_len, best_base, best_branch = 0, 0, []
         
         for blk in self.all_blocks.values():
-            chain = []
+            branch = []
             current = blk
             
-            # walk backward until we hit genesis or a gap
+            # walk backward until we meet the main chain, hit genesis or a gap
             while True:
-                chain.append(current)
+                height = current.header.block_num
+                if height < len(main) and (main[height] is current or main[height].get_id() == current.get_id()):
+                    base = height + 1 # main[:base] is shared with this branch
+                    break
+                branch.append(current)
                 previous = current.header.prev_block_hash
                 if previous == zero_hash:
-                    break # reached genesis
+                    base = 0 # reached genesis
+                    break
                 if previous in self.all_blocks:
                     current = self.all_blocks[previous]
                 else:
-                    # discard this chain]
-                    chain = []
+                    # discard this chain
+                    branch = None
                     break
                 
-            if chain and len(chain) > len(best):
-                chain.reverse()
-                best = chain
+            if branch is not None and base + len(branch) > best_len:
+                best_len, best_base, best_branch = base + len(branch), base, branch
                 
-        return best
+        return main[:best_base] + best_branch[::-1]
     
     
     def close(self):
@@ -297,6 +1462,17 @@ class Peer:
             "port": self.port
         }
         
+        if self.pex:
+            # tell the peers we know so they drop us right away
+            goodbye = {
+                "message_type": "PEX",
+                "ip": self.ip,
+                "port": self.port,
+                "leaving": True,
+                "seen": time.time()
+            }
+            self.broadcast(goodbye)
+
         # sending LEAVE 
         try:
             with socket.create_connection((self.tracker_ip, self.tracker_port), timeout=3) as s:
@@ -305,15 +1481,58 @@ class Peer:
             self.alive_thread.join()
         except Exception:
             pass
-        
+        with self.pending_lock:
+            if self.mempool is not None:
+                self.mempool.close()
+                self.mempool = None # late messages are still applied, but only in memory
+        for gauge in PEER_GAUGES:
+            gauge.remove(peer=f"{self.ip}:{self.port}")
 
 
+def parse_address(address):
+    """
+    Split "http://host:port", "host:port" or a bare port into (host, port).
 
-        
+    Args:
+        address (str): the address as given on the command line
 
+    Returns:
+        tuple: (host, port), host defaulting to "localhost"
+    """
+    if "//" in address:
+        parts = urlsplit(address)
+        return (parts.hostname or "localhost", parts.port)
+    host, _, port = address.rpartition(":")
+    return (host or "localhost", int(port))
 
 
+if __name__ == "__main__":
+    import signal
+    ap = argparse.ArgumentParser(description="Run a peer.")
+    ap.add_argument("--port", type=int, required=True, help="port to listen on for other peers")
+    ap.add_argument("--tracker", required=True, help="tracker address, e.g. http://localhost:8000")
+    ap.add_argument("--ip", default="localhost", help="address we listen on and advertise")
+    ap.add_argument("--no-pex", action="store_true", help="stay subscribed to the tracker instead of using peer exchange")
+    ap.add_argument("--keep-blocks", type=int, help="pruned mode: keep only the last N blocks in full")
+    ap.add_argument("--fanout", type=int, help="peers each block or transaction is gossiped to (default about sqrt of the peer count)")
+    ap.add_argument("--mempool", help="journal that keeps pending transactions across restarts (default mempool-PORT.journal)")
+    ap.add_argument("--metrics-port", type=int, help="serve GET /metrics in the Prometheus text format on this port")
+    args = ap.parse_args()
 
+    tracker_ip, tracker_port = parse_address(args.tracker)
+    node = Peer(args.ip, args.port, tracker_ip, tracker_port, pex=not args.no_pex, keep_blocks=args.keep_blocks,
+                fanout=args.fanout, mempool_path=args.mempool or f"mempool-{args.port}.journal")
+    node.connect_to_tracker()
+    print(f"[peer] listening on {args.ip}:{args.port}, {len(node.peers)} peers known", flush=True)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+        print(f"[peer] metrics on port {args.metrics_port}", flush=True)
 
-        
-        
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    node.close()
@@ -0,0 +1,108 @@
+import argparse, json, os, tempfile, tracemalloc
+
+from blockchain import BlockChain
+from block import mine_block
+from transactions import Transaction
+
+
+def synthetic_chain(path, blocks, txs_per_block):
+    """
+    Write a full chain of minted and transferred artworks to path.
+
+    Blocks are mined at difficulty 1 so a large chain builds in seconds.
+
+    Args:
+        path (str): chain file to write
+        blocks (int): number of blocks after genesis
+        txs_per_block (int): transactions in each block
+
+    Returns:
+        BlockChain: the chain that was written
+    """
+    chain = BlockChain()
+    chain.make_first_block("MINT", "GALLERY", "GENESIS_ART")
+    for height in range(1, blocks + 1):
+        txs = []
+        for i in range(txs_per_block):
+            if height % 2:
+                tx = Transaction("MINT", f"artist{i}", f"ART{height}-{i}", "")
+            else:
+                tx = Transaction(f"artist{i}", f"collector{i}", f"ART{height - 1}-{i}", "")
+            tx.sign(tx.sender)
+            txs.append(tx)
+        block = mine_block(height, chain.blocks[-1].get_id(), txs, 1, None, 0, 0)
+        chain.blocks.append(block)
+        chain.apply_state(block)
+    chain.save(path)
+    return chain
+
+
+def measure(path, keep_blocks):
+    """
+    Load a chain file in full or pruned mode and measure it.
+
+    Args:
+        path (str): chain file to load
+        keep_blocks (int): pruned mode's K, or None for a full chain
+
+    Returns:
+        tuple: (BlockChain, bytes of memory held after loading)
+    """
+    tracemalloc.start()
+    chain = BlockChain(keep_blocks)
+    chain.load(path)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return chain, memory
+
+
+def main():
+    """
+    Compare disk and memory use of a full and a pruned chain.
+    """
+    ap = argparse.ArgumentParser(description="Report what pruned chain mode saves.")
+    ap.add_argument("--chain", help="existing chain file (default: build a synthetic one)")
+    ap.add_argument("--blocks", type=int, default=2000, help="blocks in the synthetic chain")
+    ap.add_argument("--txs", type=int, default=20, help="transactions per synthetic block")
+    ap.add_argument("--keep", type=int, default=100, help="full blocks kept in pruned mode")
+    ap.add_argument("--json", help="also write the results to this file")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    full_path = args.chain
+    if full_path is None:
+        full_path = os.path.join(workdir, "full.json")
+        synthetic_chain(full_path, args.blocks, args.txs)
+
+    full, full_memory = measure(full_path, None)
+    pruned, pruned_memory = measure(full_path, args.keep)
+    pruned_path = os.path.join(workdir, "pruned.json")
+    pruned.save(pruned_path)
+
+    # the pruned node must still answer the same ownership questions
+    assert pruned.owners == full.owners and pruned.minted_artworks == full.minted_artworks
+    reloaded = BlockChain(args.keep)
+    reloaded.load(pruned_path)
+    assert reloaded.owners == full.owners and len(reloaded.blocks) == len(full.blocks)
+
+    full_disk, pruned_disk = os.path.getsize(full_path), os.path.getsize(pruned_path)
+    report = {
+        "blocks": len(full.blocks),
+        "keep_blocks": args.keep,
+        "full_disk_bytes": full_disk,
+        "pruned_disk_bytes": pruned_disk,
+        "disk_saved_pct": round(100 * (1 - pruned_disk / full_disk), 1),
+        "full_memory_bytes": full_memory,
+        "pruned_memory_bytes": pruned_memory,
+        "memory_saved_pct": round(100 * (1 - pruned_memory / full_memory), 1),
+    }
+    print(f"{report['blocks']} blocks, keeping the last {args.keep} in full")
+    print(f"disk:   {full_disk:>12} -> {pruned_disk:>12} bytes  ({report['disk_saved_pct']}% saved)")
+    print(f"memory: {full_memory:>12} -> {pruned_memory:>12} bytes  ({report['memory_saved_pct']}% saved)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
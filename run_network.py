@@ -1,75 +1,237 @@
-import argparse, subprocess, sys, time, signal
+import argparse, os, selectors, shutil, signal, socket, subprocess, sys, time
 
-def pop(cmd):
+HERE = os.path.dirname(os.path.abspath(__file__))
+READY_TIMEOUT = 60 # seconds a node may take before its port answers
+PROBE_INTERVAL = 0.05 # seconds between readiness probes (and the longest a log line waits)
+
+
+def seed_chain(workdir):
+    """
+    Give a node directory the repository's chain.json unless it already
+    has a chain, so every node starts from the same genesis block (a node
+    without one mines its own, with its own timestamp, and then rejects
+    every block from the others).
+
+    Args:
+        workdir (str): the node's working directory
+    """
+    os.makedirs(workdir, exist_ok=True)
+    target = os.path.join(workdir, "chain.json")
+    if not os.path.exists(target):
+        shutil.copyfile(os.path.join(HERE, "chain.json"), target)
+
+
+class Node:
+    """
+    One child process of the cluster: the tracker, a peer or a UI.
+    """
+    def __init__(self, name, script, port, args, workdir):
+        """
+        Initialize the node (it is not started yet).
+
+        Args:
+            name (str): prefix for its log lines, e.g. "peer3"
+            script (str): script to run, e.g. "peer.py"
+            port (int): the port that answers once the node is ready
+            args (list): command-line arguments for the script
+            workdir (str): its working directory, where its chain.json lives
+        """
+        self.name = name
+        self.cmd = [sys.executable, "-u", os.path.join(HERE, script), *args]
+        self.port = port
+        self.workdir = workdir
+        self.proc = None
+        self.started = None
+        self.ready_after = None # seconds from start until the port answered
+        self.partial = b"" # output read so far that does not end in a newline yet
+
+
+    def start(self):
+        """
+        Start the process with stdout and stderr on one pipe.
+        """
+        os.makedirs(self.workdir, exist_ok=True)
+        self.started = time.time()
+        self.proc = subprocess.Popen(self.cmd, cwd=self.workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+    def probe(self):
+        """
+        Check whether the node's port accepts connections yet.
+
+        Returns:
+            bool: True once the node is ready
+        """
+        if self.ready_after is None:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.settimeout(PROBE_INTERVAL)
+                if s.connect_ex(("127.0.0.1", self.port)) == 0:
+                    self.ready_after = time.time() - self.started
+        return self.ready_after is not None
+
+
+class LogMux:
+    """
+    Copies the output of every child to our stdout, one whole line at a
+    time with the child's name in front, without ever blocking on a child
+    that has nothing to say.
     """
-    Run a command and return the process.
+    def __init__(self):
+        """
+        Initialize the multiplexer.
+        """
+        self.selector = selectors.DefaultSelector()
+        self.width = 0
+
+
+    def add(self, node):
+        """
+        Start following a node's output.
+        """
+        self.selector.register(node.proc.stdout, selectors.EVENT_READ, node)
+        self.width = max(self.width, len(node.name))
+
+
+    def pump(self, timeout):
+        """
+        Print whatever output is available, waiting at most timeout seconds.
+
+        Returns:
+            list: nodes whose output ended (the process exited) in this call
+        """
+        ended = []
+        for key, _ in self.selector.select(timeout):
+            node = key.data
+            chunk = os.read(key.fd, 65536)
+            if not chunk:
+                self.selector.unregister(key.fileobj)
+                if node.partial:
+                    self.write(node, node.partial)
+                ended.append(node)
+                continue
+            *lines, node.partial = (node.partial + chunk).split(b"\n")
+            for line in lines:
+                self.write(node, line)
+        return ended
+
+
+    def write(self, node, line):
+        """
+        Print one line of a node's output with its prefix.
+        """
+        sys.stdout.buffer.write(f"[{node.name:<{self.width}}] ".encode() + line + b"\n")
+        sys.stdout.flush()
+
+
+    def busy(self):
+        """
+        Whether any child is still writing.
+        """
+        return bool(self.selector.get_map())
+
+
+def wait_ready(nodes, mux, timeout):
+    """
+    Multiplex logs while probing until every node's port answers.
 
     Args:
-        cmd (list): The command to run.
+        nodes (list): nodes to wait for
+        mux (LogMux): the log multiplexer
+        timeout (float): seconds before giving up
 
     Returns:
-        subprocess.Popen: The process.
+        list: nodes that did not become ready (exited or timed out)
     """
-    return subprocess.Popen(
-        ["python", "-u", *cmd[1:]],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
+    deadline = time.time() + timeout
+    waiting = list(nodes)
+    while waiting and time.time() < deadline:
+        mux.pump(PROBE_INTERVAL)
+        waiting = [n for n in waiting if not n.probe() and n.proc.poll() is None]
+    return [n for n in nodes if n.ready_after is None]
+
+
+def stop(nodes):
+    """
+    Interrupt every child and wait for them to exit.
+    """
+    for node in nodes:
+        if node.proc is not None and node.proc.poll() is None:
+            try: node.proc.send_signal(signal.SIGINT)
+            except OSError: pass
+    for node in nodes:
+        if node.proc is None:
+            continue
+        try:
+            node.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            node.proc.kill()
 
 
 def main():
     """
-    Run the network.
+    Run the network: a tracker, then every peer and UI at once.
     """
-    ap = argparse.ArgumentParser()
+    ap = argparse.ArgumentParser(description="Start a tracker plus N peers with their UIs.")
     ap.add_argument("-n", "--num-peers", type=int, default=3)
     ap.add_argument("-b", "--base-port", type=int, default=7000)
+    ap.add_argument("--data-dir", default="network", help="each node keeps its chain.json in a subdirectory of this")
+    ap.add_argument("--pex", action="store_true", help="let peers use peer exchange instead of staying subscribed to the tracker")
+    ap.add_argument("--check", action="store_true", help="stop as soon as every node is ready (to time startup)")
     args = ap.parse_args()
 
     BASE, N = args.base_port, args.num_peers
-    procs = []
+    tracker_url = f"http://localhost:{BASE}"
+    data_dir = os.path.abspath(args.data_dir)
+    tracker = Node("tracker", "tracker.py", BASE, ["--port", str(BASE)], data_dir)
+    nodes = []
+    for i in range(N):
+        peer_port, ui_port = BASE + 101 + i, BASE + 201 + i
+        workdir = os.path.join(data_dir, f"node{i + 1}")
+        seed_chain(workdir)
+        nodes.append(Node(f"peer{i + 1}", "peer.py", peer_port,
+                          ["--port", str(peer_port), "--tracker", tracker_url] + ([] if args.pex else ["--no-pex"]), workdir))
+        nodes.append(Node(f"ui{i + 1}", "ui.py", ui_port,
+                          ["--peer-port", str(peer_port), "--ui-port", str(ui_port), "--tracker", tracker_url], workdir))
 
+    mux = LogMux()
+    started = time.time()
     try:
-        tracker_port = BASE
-        procs.append(pop(["python", "tracker.py", "--port", str(tracker_port)]))
-        print(f"Tracker      → http://localhost:{tracker_port}")
-        time.sleep(1)
+        # peers JOIN the tracker as they start, so it has to be up first
+        tracker.start()
+        mux.add(tracker)
+        if wait_ready([tracker], mux, READY_TIMEOUT):
+            sys.exit("tracker did not start")
+
+        for node in nodes:
+            node.start()
+            mux.add(node)
+        failed = wait_ready(nodes, mux, READY_TIMEOUT)
+        startup = time.time() - started
 
+        print(f"\nTracker      → {tracker_url}  (ready after {tracker.ready_after:.2f}s)")
         for i in range(N):
-            peer_port = BASE + 101 + i
-            ui_port   = BASE + 201 + i
-            tracker   = f"http://localhost:{tracker_port}"
-
-            procs.append(pop([
-                "python", "peer.py",
-                "--port", str(peer_port),
-                "--tracker", tracker
-            ]))
-            procs.append(pop([
-                "python", "ui.py",
-                "--peer-port", str(peer_port),
-                "--ui-port",   str(ui_port),
-                "--tracker",   tracker
-            ]))
-
-            print(f"Peer {i+1:>2} UI  → http://localhost:{ui_port}  (peer :{peer_port})")
-
-        print("\nNetwork up. Ctrl‑C to stop.\n")
-
-        while True:
-            for p in procs:
-                line = p.stdout.readline()
-                if line:
-                    sys.stdout.buffer.write(line)
-            time.sleep(0.1)
+            peer_node, ui_node = nodes[2 * i], nodes[2 * i + 1]
+            status = "ready" if not {peer_node, ui_node} & set(failed) else "NOT READY"
+            print(f"Peer {i+1:>2} UI  → http://localhost:{ui_node.port}  (peer :{peer_node.port})  {status}")
+        slowest = max(nodes, key=lambda n: n.ready_after or READY_TIMEOUT, default=tracker)
+        print(f"\n{len(nodes) + 1 - len(failed)}/{len(nodes) + 1} nodes ready in {startup:.2f}s "
+              f"(slowest: {slowest.name})")
+        if failed:
+            print("not ready: " + ", ".join(n.name for n in failed))
+        if args.check:
+            return
+
+        print("Network up. Ctrl‑C to stop.\n")
+        while mux.busy():
+            mux.pump(1)
 
     except KeyboardInterrupt:
         print("\nStopping...")
-        for p in procs:
-            try: p.send_signal(signal.SIGINT)
-            except Exception: pass
-        for p in procs: p.wait()
+    finally:
+        stop([tracker] + nodes)
+        while mux.busy():
+            mux.pump(0.1)
+
 
 if __name__ == "__main__":
-    signal.signal(signal.SIGINT, signal.SIG_DFL)
     main()
@@ -0,0 +1,429 @@
+import argparse, contextlib, heapq, json, math, os, random, statistics, time
+from collections import Counter
+
+from block import Block, BlockHeader, calculate_merkle_root, load_block
+from blockchain import BlockChain
+from broadcast import Broadcaster
+from gossip import PeerScores
+from peer import Peer
+from tracker_loadtest import percentile
+from transactions import Transaction
+
+SIM_EPOCH_MS = 1_700_000_000_000 # virtual time 0, as a block timestamp
+SIM_PORT = 8000 # every simulated peer "listens" here; peers differ by ip
+
+
+class SimPeer(Peer):
+    """
+    A real Peer whose sockets are replaced by the simulator's virtual
+    transport. Everything else (chain, fork choice, pending transactions)
+    is the unmodified Peer code.
+    """
+    def __init__(self, sim, index, genesis):
+        """
+        Initialize the peer.
+
+        Args:
+            sim (Simulator): the simulation it runs in
+            index (int): its number, which also picks its ip
+            genesis (Block): genesis block shared by every peer
+        """
+        self.sim = sim
+        self.genesis = genesis
+        super().__init__(f"10.{index // 65536}.{index // 256 % 256}.{index % 256}", SIM_PORT, "sim-tracker", 0, pex=False)
+        self.scores = PeerScores(sim.rng) # seeded, and without send timings, so runs repeat exactly
+        self.clock = lambda: sim.now # catch-up timeouts in virtual time
+        self.broadcaster = Broadcaster(self.send_to, workers=0) # sends in order on the simulation thread
+
+
+    def register_metrics(self):
+        """
+        Simulated peers are never scraped, and thousands of them would
+        each add a series to every peer gauge.
+        """
+
+
+    def load_create_chain(self):
+        """
+        Start from the shared genesis block instead of chain.json.
+        """
+        self.blockchain.switch_to([self.genesis])
+        self.all_blocks[self.genesis.get_id()] = self.genesis
+
+
+    def send_to(self, peer_id, message, timeout=3):
+        """
+        Hand the message to the virtual network. Loss is silent, like a
+        dropped packet, so sending always "succeeds".
+        """
+        self.sim.send((self.ip, self.port), peer_id, message)
+        return True
+
+
+    def handle_message(self, message):
+        """
+        Record when the message arrived and let the Peer handle (and
+        relay) it.
+        """
+        self.sim.seen(self, message)
+        super().handle_message(message)
+
+
+class Simulator:
+    """
+    Deterministic discrete-event simulation of many peers on one thread.
+
+    Time is virtual: events sit in a heap ordered by (time, sequence) and
+    all randomness comes from one seeded random.Random, so a seed always
+    reproduces the same run. Each message takes
+      queueing on the sender's uplink (one message at a time, size / bandwidth)
+      + latency + uniform(0, jitter)
+    and is dropped with probability loss. Blocks are found as a Poisson
+    process with mean block_interval by a miner picked uniformly at random,
+    who builds on its own tip and broadcasts through Peer.add_block.
+
+    Peers spread blocks with the Peer's own gossip (mode "gossip"), or
+    the miner sends to every peer and nobody forwards (mode "flood", how
+    peers worked before gossip), or everyone forwards to every peer
+    (mode "relay").
+    """
+    def __init__(self, peers=100, degree=0, block_interval=15.0, duration=1200.0, latency=0.1, jitter=0.05,
+                 bandwidth=1_000_000, loss=0.0, miners=0, mode="gossip", fanout=None, seed=1):
+        """
+        Initialize the simulation and its peers.
+
+        Args:
+            peers (int): number of peers
+            degree (int): links per peer (a ring plus random links), or 0 for a full mesh
+            block_interval (float): mean virtual seconds between blocks
+            duration (float): virtual seconds during which blocks are mined
+            latency (float): one-way delay in seconds
+            jitter (float): extra random delay, uniform between 0 and jitter
+            bandwidth (float): uplink bytes per second of every peer
+            loss (float): probability that a message is dropped
+            miners (int): how many peers mine (the first ones), 0 for all
+            mode (str): "gossip", "flood" or "relay" (see the class docstring)
+            fanout (int): gossip fanout, None for the Peer's default (about sqrt(peers))
+            seed (int): random seed
+        """
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.events = [] # (time, sequence, function, argument)
+        self.sequence = 0
+        self.block_interval = block_interval
+        self.duration = duration
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.mode = mode
+
+        self.uplink_free = {} # sender id -> virtual time its uplink is idle again
+        self.messages = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.block_ids = {} # id(block dict) -> (block dict, block id); the dict is kept so its id is not reused
+        self.mined = [] # (block id, time, height, miner index)
+        self.first_seen = {} # block id -> {peer id: virtual time}
+        self.block_uplink = Counter() # (block id, sender id) -> bytes that sender sent of that block
+        self.last_tip_change = {} # peer id -> virtual time its tip last moved
+        self.reorgs = 0
+        self.reorged_blocks = 0
+
+        genesis = BlockChain()
+        genesis.make_first_block("MINT", "GALLERY", "GENESIS_ART")
+        self.peers = [SimPeer(self, i, genesis.blocks[0]) for i in range(peers)]
+        self.by_id = {(p.ip, p.port): p for p in self.peers}
+        self.miners = self.peers[:miners] if miners else self.peers
+        for p in self.peers:
+            p.fanout = fanout if mode == "gossip" else peers
+            p.relay = mode != "flood"
+        self.connect(degree)
+        for p in self.peers:
+            p.blockchain.add_listener(self.chain_listener(p))
+
+
+    def connect(self, degree):
+        """
+        Fill in every peer's peer list.
+
+        Args:
+            degree (int): 0 for a full mesh; otherwise each peer is linked to
+                its two ring neighbours (so the graph is connected) and to
+                random peers until it has about degree links
+        """
+        ids = [(p.ip, p.port) for p in self.peers]
+        n = len(ids)
+        if degree <= 0 or degree >= n - 1:
+            for p in self.peers:
+                p.peers = [peer_id for peer_id in ids if peer_id != (p.ip, p.port)]
+            return
+
+        links = [set() for _ in range(n)]
+        for i in range(n):
+            links[i].add((i + 1) % n)
+            links[(i + 1) % n].add(i)
+        for i in range(n):
+            while len(links[i]) < degree:
+                j = self.rng.randrange(n)
+                if j != i:
+                    links[i].add(j)
+                    links[j].add(i)
+        for i, p in enumerate(self.peers):
+            p.peers = [ids[j] for j in sorted(links[i])]
+
+
+    def chain_listener(self, p):
+        """
+        Make a chain listener that records tip changes and reorgs of peer p.
+        """
+        peer_id = (p.ip, p.port)
+        state = {"last": None}
+
+        def on_event(event, block, height):
+            self.last_tip_change[peer_id] = self.now
+            if event == "disconnected":
+                self.reorged_blocks += 1
+                if state["last"] != "disconnected":
+                    self.reorgs += 1
+            state["last"] = event
+        return on_event
+
+
+    def schedule(self, at, function, argument=None):
+        """
+        Run function(argument) at virtual time at.
+        """
+        heapq.heappush(self.events, (at, self.sequence, function, argument))
+        self.sequence += 1
+
+
+    def send(self, src, dst, message):
+        """
+        Put a message on the virtual network.
+
+        Args:
+            src (tuple): sender (ip, port)
+            dst (tuple): receiver (ip, port)
+            message (dict): the message, delivered as the same object
+        """
+        target = self.by_id.get(dst)
+        if target is None:
+            return
+        size = len(json.dumps(message)) + 1
+        self.messages += 1
+        self.bytes_sent += size
+        if message["message_type"] == "NEW_BLOCK":
+            self.block_uplink[(self.block_id_of(message["data"]), src)] += size
+        start = max(self.now, self.uplink_free.get(src, 0.0))
+        self.uplink_free[src] = start + size / self.bandwidth
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        arrival = self.uplink_free[src] + self.latency + self.rng.uniform(0, self.jitter)
+        self.schedule(arrival, target.handle_message, message)
+
+
+    def seen(self, p, message):
+        """
+        Note that peer p received a message.
+
+        Returns:
+            bool: True if it is a block p had not seen before
+        """
+        if message["message_type"] != "NEW_BLOCK":
+            return False
+        arrivals = self.first_seen.setdefault(self.block_id_of(message["data"]), {})
+        peer_id = (p.ip, p.port)
+        if peer_id in arrivals:
+            return False
+        arrivals[peer_id] = self.now
+        return True
+
+
+    def block_id_of(self, data):
+        """
+        The id of a block dict, hashed once per dict (relays pass the same
+        dict on).
+        """
+        known = self.block_ids.get(id(data))
+        if known is None:
+            known = self.block_ids[id(data)] = (data, load_block(data).get_id())
+        return known[1]
+
+
+    def mine(self, _=None):
+        """
+        One block is found: a random miner builds it on its tip and
+        broadcasts it, and the next discovery is scheduled.
+        """
+        miner = self.rng.choice(self.miners)
+        parent = miner.blockchain.blocks[-1]
+        tx = Transaction("MINT", miner.ip, f"SIM{len(self.mined)}", "") # keeps every block distinct
+        tx.sign("MINT")
+        header = BlockHeader(parent.header.block_num + 1, parent.get_id(), calculate_merkle_root([tx]),
+                             SIM_EPOCH_MS + int(self.now * 1000), 1, 0)
+        while int(header.hash_header(), 16) > (1 << 255) - 1:
+            header.nonce += 1
+        block = Block(header, [tx])
+        block_id = block.get_id()
+        self.mined.append((block_id, self.now, header.block_num, self.peers.index(miner)))
+        self.first_seen[block_id] = {(miner.ip, miner.port): self.now}
+        miner.add_block(block)
+
+        following = self.now + self.rng.expovariate(1 / self.block_interval)
+        if following < self.duration:
+            self.schedule(following, self.mine)
+
+
+    def run(self):
+        """
+        Mine for the configured duration, then let the network drain.
+
+        Returns:
+            dict: the report (see report())
+        """
+        started = time.perf_counter()
+        self.schedule(self.rng.expovariate(1 / self.block_interval), self.mine)
+        with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+            while self.events:
+                (self.now, _, function, argument) = heapq.heappop(self.events)
+                function(argument)
+        return self.report(time.perf_counter() - started)
+
+
+    def report(self, wall_seconds):
+        """
+        Summarize the run.
+
+        Args:
+            wall_seconds (float): real time the run took
+
+        Returns:
+            dict: propagation percentiles, stale and fork rates, reorgs,
+            convergence and traffic
+        """
+        n = len(self.peers)
+        tips = Counter(p.blockchain.blocks[-1].get_id() for p in self.peers)
+        (majority_tip, on_majority) = tips.most_common(1)[0]
+        reference = next(p for p in self.peers if p.blockchain.blocks[-1].get_id() == majority_tip)
+        main_ids = {blk.get_id() for blk in reference.blockchain.blocks}
+
+        delays, reach_50, reach_90, received = [], [], [], 0
+        for (block_id, mined_at, _, _) in self.mined:
+            arrivals = sorted(at - mined_at for at in self.first_seen[block_id].values())
+            delays.extend(arrivals[1:]) # the first is the miner itself
+            received += len(arrivals) - 1
+            for (fraction, reach) in ((0.5, reach_50), (0.9, reach_90)):
+                needed = max(1, math.ceil(fraction * n))
+                if len(arrivals) >= needed:
+                    reach.append(arrivals[needed - 1])
+
+        busiest = {} # block id -> most bytes one peer sent of it
+        for ((block_id, _), sent) in self.block_uplink.items():
+            busiest[block_id] = max(busiest.get(block_id, 0), sent)
+
+        per_height = Counter(height for (_, _, height, _) in self.mined)
+        stale = sum(1 for (block_id, _, _, _) in self.mined if block_id not in main_ids)
+        last_mined = self.mined[-1][1] if self.mined else 0.0
+        converged = len(tips) == 1
+
+        return {
+            "peers": n,
+            "mode": self.mode,
+            "blocks_mined": len(self.mined),
+            "final_height": len(reference.blockchain.blocks) - 1,
+            "propagation_p50_s": percentile(delays, 50),
+            "propagation_p90_s": percentile(delays, 90),
+            "propagation_p99_s": percentile(delays, 99),
+            "propagation_max_s": max(delays, default=0),
+            "reach_50pct_median_s": percentile(reach_50, 50),
+            "reach_90pct_median_s": percentile(reach_90, 50),
+            "coverage_pct": round(100 * received / max(1, len(self.mined) * (n - 1)), 2),
+            "stale_rate_pct": round(100 * stale / max(1, len(self.mined)), 2),
+            "fork_rate_pct": round(100 * sum(1 for c in per_height.values() if c > 1) / max(1, len(per_height)), 2),
+            "reorgs": self.reorgs,
+            "reorged_blocks": self.reorged_blocks,
+            "converged": converged,
+            "convergence_s": max(self.last_tip_change.values()) - last_mined if converged else None,
+            "peers_on_majority_tip_pct": round(100 * on_majority / n, 2),
+            "messages": self.messages,
+            "bytes": self.bytes_sent,
+            "bytes_per_peer_per_block": round(self.bytes_sent / n / max(1, len(self.mined))),
+            "peak_uplink_per_block": round(statistics.mean(busiest.values())) if busiest else 0,
+            "dropped": self.dropped,
+            "wall_seconds": round(wall_seconds, 2),
+        }
+
+
+def sweep(sizes, modes, **options):
+    """
+    Run the same network at several sizes and spreading modes and print
+    one line per run, to see how coverage and traffic scale with N.
+
+    Args:
+        sizes (list): peer counts
+        modes (list): modes to compare at each size
+        options: the other Simulator arguments
+
+    Returns:
+        list: the reports
+    """
+    reports = []
+    print(f"{'peers':>6} {'mode':<7} {'coverage%':>9} {'reach90% s':>10} {'p90 s':>7} "
+          f"{'KB/peer/block':>13} {'peak KB/block':>13} {'wall s':>7}")
+    for n in sizes:
+        for mode in modes:
+            report = Simulator(peers=n, mode=mode, **options).run()
+            reports.append(report)
+            print(f"{n:>6} {mode:<7} {report['coverage_pct']:>9} {report['reach_90pct_median_s']:>10.3f} "
+                  f"{report['propagation_p90_s']:>7.3f} {report['bytes_per_peer_per_block'] / 1000:>13.1f} "
+                  f"{report['peak_uplink_per_block'] / 1000:>13.1f} {report['wall_seconds']:>7}", flush=True)
+    return reports
+
+
+def main():
+    """
+    Run one simulation and print its report.
+    """
+    ap = argparse.ArgumentParser(description="Simulate block propagation across many in-process peers.")
+    ap.add_argument("-n", "--peers", type=int, default=100)
+    ap.add_argument("--degree", type=int, default=0, help="links per peer, 0 for a full mesh")
+    ap.add_argument("--block-interval", type=float, default=15.0, help="mean virtual seconds between blocks")
+    ap.add_argument("--duration", type=float, default=1200.0, help="virtual seconds of mining")
+    ap.add_argument("--latency", type=float, default=0.1, help="one-way delay in seconds")
+    ap.add_argument("--jitter", type=float, default=0.05, help="extra uniform delay in seconds")
+    ap.add_argument("--bandwidth", type=float, default=1_000_000, help="uplink bytes per second per peer")
+    ap.add_argument("--loss", type=float, default=0.0, help="message loss probability")
+    ap.add_argument("--miners", type=int, default=0, help="number of mining peers, 0 for all")
+    ap.add_argument("--mode", choices=("gossip", "flood", "relay"), default="gossip",
+                    help="gossip to about sqrt(N) peers, flood from the miner only, or relay to every peer")
+    ap.add_argument("--relay", action="store_const", dest="mode", const="relay", help="same as --mode relay")
+    ap.add_argument("--fanout", type=int, help="gossip fanout (default about sqrt of the peer count)")
+    ap.add_argument("--sweep", help="comma-separated peer counts: compare flood and gossip at each")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="also write the report to this file")
+    args = ap.parse_args()
+
+    if args.sweep:
+        reports = sweep([int(n) for n in args.sweep.split(",")], ["flood", "gossip"], degree=args.degree,
+                        block_interval=args.block_interval, duration=args.duration, latency=args.latency,
+                        jitter=args.jitter, bandwidth=args.bandwidth, loss=args.loss, miners=args.miners,
+                        fanout=args.fanout, seed=args.seed)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(reports, f, indent=2)
+        return
+
+    sim = Simulator(args.peers, args.degree, args.block_interval, args.duration, args.latency, args.jitter,
+                    args.bandwidth, args.loss, args.miners, args.mode, args.fanout, args.seed)
+    report = sim.run()
+    for key, value in report.items():
+        print(f"{key:<26} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -58,9 +58,33 @@ async function fetchBlockchain() {
 }
 
 
+const pendingJobs = new Set();
+
+function showError(error) {
+    /**
+     * Show a rejection message and shake the form panel.
+     *
+     * @param {string} error - Why the block was rejected.
+     */
+    messageBox.textContent = `Cannot add this block — ${error}.`;
+    messageBox.classList.remove("d-none");
+    messageBox.classList.add("msg-animate");
+  
+    const panel = document.querySelector(".live-card");
+    panel.classList.add("card-reject");
+    setTimeout(() => panel.classList.remove("card-reject"), 650);
+  
+    setTimeout(()=>{
+        messageBox.classList.add("d-none");
+        messageBox.classList.remove("msg-animate");
+    }, 3000);
+}
+
+
 blockForm.addEventListener("submit", async event => {
     /**
-     * Submit the block form.
+     * Submit the block form. The server queues the transfer and reports the
+     * outcome later as a JOB_UPDATE on the event stream.
      */
     event.preventDefault();
     messageBox.classList.add("d-none");
@@ -73,48 +97,57 @@ blockForm.addEventListener("submit", async event => {
     });
 
     if (response.ok) {
+        const { job_id } = await response.json();
+        pendingJobs.add(job_id);
         blockForm.reset();
-        fetchBlockchain();
     } else {
         const { error } = await response.json();
-      
-        messageBox.textContent = `Cannot add this block — ${error}.`;
-        messageBox.classList.remove("d-none");
-        messageBox.classList.add("msg-animate");
-      
-        const panel = document.querySelector(".live-card");
-        panel.classList.add("card-reject");
-        setTimeout(() => panel.classList.remove("card-reject"), 650);
-      
-        setTimeout(()=>{
-            messageBox.classList.add("d-none");
-            messageBox.classList.remove("msg-animate");
-        }, 3000);
+        showError(error);
     }
 });
 
 let eventSource;
 let retryCount = 0;
+let lastEventId = "";
 
 function openEventStream() {
     /**
-     * Open the event stream.
+     * Open the event stream, resuming after the last event we saw.
      */
-    eventSource = new EventSource("/stream");
+    const query = lastEventId ? `?last_event_id=${encodeURIComponent(lastEventId)}` : "";
+    eventSource = new EventSource("/stream" + query);
 
     eventSource.onmessage = event => {
     retryCount = 0;
+    if (event.lastEventId) lastEventId = event.lastEventId;
     const payload = JSON.parse(event.data);
 
     if (payload.type === "INIT") {
         blockchain = payload.chain;
         renderBlockchain();
     } else if (payload.type === "BLOCK_ADDED") {
+        // a snapshot taken mid-update may already hold this block
+        if (payload.block.header.block_num < blockchain.length) return;
         blockchain.push(payload.block);
         const newCard = createBlockCard(payload.block);
         newCard.classList.add("block-pulse");
         blockchainView.appendChild(newCard);
         newCard.scrollIntoView({ behavior: "smooth" });
+    } else if (payload.type === "JOB_UPDATE") {
+        const job = payload.job;
+        if (!pendingJobs.has(job.id)) return;
+        if (job.status === "failed") {
+            pendingJobs.delete(job.id);
+            showError(job.error);
+        } else if (job.status === "done") {
+            pendingJobs.delete(job.id);
+        }
+    } else if (payload.type === "BLOCK_REMOVED") {
+        // a reorg took this block (the current tip) off the chain
+        while (blockchain.length > payload.block_num) {
+            blockchain.pop();
+            blockchainView.lastElementChild?.remove();
+        }
     }
     };
 
@@ -1,12 +1,20 @@
 
+import os
+import queue
+import socket
+import tempfile
 import threading
 import time
 
-from tracker import start_tracker
+from tracker import Tracker, start_tracker
 from peer import Peer
-from blockchain import BlockChain
+from blockchain import BlockChain, last_ndjson_height, read_ndjson
 from transactions import Transaction
 from block import calculate_merkle_root, adjust_difficulty, mine_block, BlockHeader
+from block_template import build_block_template
+from broadcast import Broadcaster
+from gossip import PeerScores, gossip_fanout
+from simulator import Simulator
 
 def start_tracker_thread(port=8000):
     """
@@ -137,7 +145,9 @@ def test_fork_resolution():
     peer_temp = Peer("127.0.0.1", 6001, "127.0.0.1", 8000)
     peer_temp.blockchain = BlockChain()
     peer_temp.blockchain.make_first_block("MINT", peer_temp.ip, "GEN")
-    peer_temp.all_blocks = {b.get_id(): b for b in peer_temp.blockchain.blocks}
+    peer_temp.all_blocks.clear()
+    for b in peer_temp.blockchain.blocks:
+        peer_temp.all_blocks[b.get_id()] = b
 
     txa = Transaction("MINT", "A", "AID", "")
     txa.sign("MINT")
@@ -157,6 +167,374 @@ def test_fork_resolution():
     print("[Test12] Longest chain length (expected 3):", len(best_chain), "\n")
 
 
+def test_chain_events():
+    """
+    Test the connected/disconnected events sent to chain listeners on a reorg.
+    """
+    print("Testing Chain Events")
+    bc5 = BlockChain()
+    bc5.make_first_block("MINT", "U", "ART5")
+    events = []
+    bc5.add_listener(lambda event, blk, height: events.append((event, height)))
+
+    txa = Transaction("MINT", "A", "ART6", "")
+    txa.sign("MINT")
+    bc5.add_to_chain(bc5.mine_next_block([txa]))
+
+    hdrs = [bc5.blocks[0].header]
+    txb = Transaction("MINT", "B", "ART7", "")
+    txb.sign("MINT")
+    blockB = mine_block(1, bc5.blocks[0].get_id(), [txb], 1, hdrs, 1, 1)
+    blockB2 = mine_block(2, blockB.get_id(), [], 1, hdrs + [blockB.header], 1, 1)
+    bc5.switch_to([bc5.blocks[0], blockB, blockB2])
+    print("[Test16] Events (expected connected 1, disconnected 1, connected 1, connected 2):", events)
+    print("ART6 still minted (expected False):", "ART6" in bc5.minted_artworks)
+    print("Owner of ART7 (expected B):", bc5.owner_of("ART7"))
+    print("Holdings of A and B (expected [] ['ART7']):", bc5.holdings_of("A"), bc5.holdings_of("B"))
+    print("Where is the ART7 mint (expected (1, 0)):", bc5.find_transaction(txb.hash()), "\n")
+
+
+def test_block_template():
+    """
+    Test transaction selection for a new block.
+    """
+    print("Testing Block Template")
+    bc6 = BlockChain()
+    bc6.make_first_block("MINT", "U", "ART5")
+    pending = []
+    for (sender, recipient, art) in [("B", "C", "ART9"), ("MINT", "B", "ART9"), ("MINT", "D", "ART9"),
+                                     ("U", "X", "ART5"), ("U", "Y", "ART5"), ("Q", "R", "ART8")]:
+        tx = Transaction(sender, recipient, art, "")
+        tx.sign(sender)
+        pending.append(tx)
+
+    txs, conflicts, deferred = build_block_template(bc6, pending, max_txs=2)
+    print("[Test17] Template (expected MINT->B, B->C):", [f"{tx.sender}->{tx.recipient}" for tx in txs])
+    print("Conflicts (expected 2):", len(conflicts), " Deferred (expected 2):", len(deferred))
+    txs, conflicts, deferred = build_block_template(bc6, pending)
+    print("Add block from full template (expected True):", bc6.add_to_chain(bc6.mine_next_block(txs)))
+    print("Owners (expected C X):", bc6.owner_of("ART9"), bc6.owner_of("ART5"), "\n")
+
+
+def test_ndjson_export_import():
+    """
+    Test exporting the chain as NDJSON and importing it on another chain,
+    resuming both halfway.
+    """
+    print("Testing NDJSON Export and Import")
+    bc7 = BlockChain()
+    bc7.make_first_block("MINT", "U", "ART10")
+    for art in ["ART11", "ART12"]:
+        tx = Transaction("MINT", "A", art, "")
+        tx.sign("MINT")
+        bc7.add_to_chain(bc7.mine_next_block([tx]))
+
+    path = os.path.join(tempfile.mkdtemp(), "chain.ndjson")
+    first = bc7.export_ndjson(path)
+    tx = Transaction("A", "B", "ART11", "")
+    tx.sign("A")
+    bc7.add_to_chain(bc7.mine_next_block([tx]))
+    print("[Test18] Blocks exported then resumed (expected 3 1):", first, bc7.export_ndjson(path))
+
+    copy = BlockChain()
+    imported = copy.import_ndjson(path)
+    print("Blocks imported (expected 4):", imported, " again (expected 0):", copy.import_ndjson(path))
+    print("Owner of ART11 on the copy (expected B):", copy.owner_of("ART11"))
+
+    with open(path, "a") as f:
+        f.write('{"header": {"block_nu') # a write cut short by a crash
+    print("Height of the file with a torn last line (expected 3):", last_ndjson_height(path))
+    fork = BlockChain() # shares the first three blocks, then takes another branch
+    for blk in bc7.blocks[:3]:
+        fork.blocks.append(blk)
+        fork.apply_state(blk)
+    fork.publish(rebuild=True)
+    for art in ["ART13", "ART14"]:
+        tx = Transaction("MINT", "A", art, "")
+        tx.sign("MINT")
+        fork.add_to_chain(fork.mine_next_block([tx]))
+    print("Blocks written after cutting back to the fork point (expected 2):", fork.export_ndjson(path))
+    print("File now matches the fork (expected True):",
+          [blk.get_id() for blk in read_ndjson(path)] == [blk.get_id() for blk in fork.blocks], "\n")
+
+
+def test_pruned_chain():
+    """
+    Test pruned chain mode: old transaction bodies go, state and headers stay.
+    """
+    print("Testing Pruned Chain")
+    bc8 = BlockChain(keep_blocks=2)
+    bc8.make_first_block("MINT", "U", "ART20")
+    for (sender, recipient) in [("MINT", "A"), ("A", "B"), ("B", "C")]:
+        tx = Transaction(sender, recipient, "ART21", "")
+        tx.sign(sender)
+        bc8.add_to_chain(bc8.mine_next_block([tx]))
+    print("[Test19] Pruned height (expected 2):", bc8.pruned_height,
+          " Genesis transactions (expected 0):", len(bc8.blocks[0].transactions))
+    print("Owners (expected U C):", bc8.owner_of("ART20"), bc8.owner_of("ART21"))
+
+    path = os.path.join(tempfile.mkdtemp(), "chain.json")
+    bc8.save(path)
+    copy = BlockChain(keep_blocks=2)
+    copy.load(path)
+    tx = Transaction("C", "D", "ART21", "")
+    tx.sign("C")
+    print("Reloaded copy accepts a new block (expected True):", copy.add_to_chain(copy.mine_next_block([tx])))
+    print("Reorg below the pruned height (expected False):", copy.switch_to(copy.blocks[:1]), "\n")
+
+
+def test_chain_snapshots():
+    """
+    Test that a chain snapshot keeps showing its own tip while the chain
+    grows and reorganizes.
+    """
+    print("Testing Chain Snapshots")
+    bc9 = BlockChain()
+    bc9.make_first_block("MINT", "U", "ART30")
+    before = bc9.snapshot()
+
+    tx = Transaction("U", "A", "ART30", "")
+    tx.sign("U")
+    bc9.add_to_chain(bc9.mine_next_block([tx]))
+    after = bc9.snapshot()
+    print("[Test20] Owner of ART30 before and after (expected U A):", before.owner_of("ART30"), after.owner_of("ART30"))
+
+    txb = Transaction("MINT", "B", "ART31", "")
+    txb.sign("MINT")
+    blockB = mine_block(1, bc9.blocks[0].get_id(), [txb], 1, [bc9.blocks[0].header], 1, 1)
+    blockB2 = mine_block(2, blockB.get_id(), [], 1, [bc9.blocks[0].header, blockB.header], 1, 1)
+    bc9.switch_to([bc9.blocks[0], blockB, blockB2])
+    print("Heights of the two snapshots after a reorg (expected 1 2):", len(before.blocks), len(after.blocks))
+    print("Holdings of A in the old snapshot (expected ['ART30']):", after.holdings_of("A"),
+          " Owner of ART30 now (expected U):", bc9.snapshot().owner_of("ART30"), "\n")
+
+
+def test_ingest_backpressure():
+    """
+    Test the peer's ingest pipeline: messages are applied in the order they
+    arrived, invalid ones are dropped, and a full queue answers BUSY.
+    """
+    print("Testing Ingest Backpressure")
+    peer = Peer("127.0.0.1", 5010, "127.0.0.1", 8000)
+    peer.ingest_queue = queue.Queue(2) # tiny queues so the test fills them quickly
+    peer.apply_queue = queue.Queue(1)
+    listener = threading.Thread(target=peer.receive_message, daemon=True)
+    listener.start()
+    time.sleep(0.5)
+
+    txs = []
+    for i in range(13):
+        tx = Transaction("A", f"B{i}", "ART40", "")
+        tx.sign("A")
+        txs.append(tx)
+    bad = Transaction("A", "X", "ART40", "BADSIG")
+    for tx in [txs[0], bad] + txs[1:5]:
+        peer.send_to(("127.0.0.1", 5010), {"message_type": "NEW_TRANSACTION", "data": tx.to_dict()})
+    time.sleep(0.5)
+    print("[Test21] Pending in arrival order, bad signature dropped (expected B0 B1 B2 B3 B4):",
+          " ".join(tx.recipient for tx in peer.pending_transactions))
+
+    slow = socket.create_connection(("127.0.0.1", 5010)) # connects but never sends its line
+    started = time.time()
+    peer.send_to(("127.0.0.1", 5010), {"message_type": "NEW_TRANSACTION", "data": bad.to_dict()})
+    print("A silent sender does not hold up the next one (expected True):", time.time() - started < 1)
+    slow.close()
+
+    for ip in ["10.1.2.3", "localhost"]: # a bad transaction signed with someone else's address, then our own
+        peer.send_to(("127.0.0.1", 5010), {"message_type": "NEW_TRANSACTION", "data": bad.to_dict(), "ip": ip, "port": 5011})
+    time.sleep(0.5)
+    print("Invalid counts of the spoofed and the real sender (expected 0 1):",
+          peer.scores.invalid_count.get(("10.1.2.3", 5011), 0), peer.scores.invalid_count.get(("localhost", 5011), 0))
+
+    with peer.pending_lock: # stalls the apply stage, so the queues behind it fill up
+        sent = [peer.send_to(("127.0.0.1", 5010), {"message_type": "NEW_TRANSACTION", "data": tx.to_dict()}, timeout=1)
+                for tx in txs[5:]]
+    print("Some senders refused with BUSY (expected True):", not all(sent))
+    time.sleep(0.5)
+    print("Everything accepted was applied (expected True):", len(peer.pending_transactions) == 5 + sum(sent), "\n")
+    peer.stop_event.set()
+    listener.join()
+
+
+def test_concurrent_broadcast():
+    """
+    Test that a broadcast waits for the slowest peer rather than for all
+    of them in turn, and that a peer that keeps failing gets skipped.
+    """
+    print("Testing Concurrent Broadcast")
+    def send(target, message, timeout):
+        time.sleep(0.2) # every peer takes 0.2s
+        return target != "down"
+
+    broadcaster = Broadcaster(send, max_failures=2)
+    targets = ["p1", "p2", "p3", "p4", "down"]
+    started = time.time()
+    delivered, failed, skipped = broadcaster.broadcast(targets, "block")
+    print("[Test22] Five 0.2s peers take under 0.5s (expected True):", time.time() - started < 0.5,
+          " Failed (expected ['down']):", failed)
+    broadcaster.broadcast(targets, "block")
+    delivered, failed, skipped = broadcaster.broadcast(targets, "block")
+    print("After two failures the peer is skipped (expected 4 [] ['down']):", len(delivered), failed, skipped)
+
+    given = []
+    def timed_send(target, message, timeout):
+        given.append(round(timeout, 1))
+        time.sleep(0.2)
+        return True
+
+    one_worker = Broadcaster(timed_send, workers=1, timeout=0.3)
+    delivered, failed, skipped = one_worker.broadcast(["q1", "q2", "q3"], "block")
+    print("Each send gets what is left of one deadline (expected [0.3, 0.1]):", given,
+          " Past the deadline, not counted against the peer (expected ['q3'] {}):", failed, one_worker.failures, "\n")
+
+
+def test_gossip_scoring():
+    """
+    Test the gossip fanout and peer scoring: a peer that keeps relaying
+    invalid blocks is dropped, and peers that deliver first are preferred.
+    """
+    print("Testing Gossip Scoring")
+    print("[Test23] Fanout for 3, 100 and 10000 peers (expected 3 10 100):",
+          gossip_fanout(3), gossip_fanout(100), gossip_fanout(10000))
+    scores = PeerScores()
+    peers = [("10.0.0.1", 1), ("10.0.0.2", 1), ("10.0.0.3", 1), ("10.0.0.4", 1), ("10.0.0.5", 1)]
+    for _ in range(5):
+        scores.delivered(peers[0], first=True)
+        scores.delivered(peers[1], first=False)
+    for _ in range(3):
+        scores.invalid(peers[2])
+    print("Spammer dropped (expected True):", scores.banned(peers[2]),
+          " never chosen (expected True):", all(peers[2] not in scores.choose(peers, 2) for _ in range(20)))
+    print("First deliverer always among the best (expected True):",
+          all(scores.choose(peers, 2)[0] == peers[0] for _ in range(20)), "\n")
+
+
+def test_mempool_recovery():
+    """
+    Test that pending transactions survive a restart through the mempool
+    journal, and that what can no longer be mined is dropped on the way.
+    """
+    print("Testing Mempool Recovery")
+    path = os.path.join(tempfile.mkdtemp(), "mempool.journal")
+    peer = Peer("127.0.0.1", 5011, "127.0.0.1", 8000, mempool_path=path)
+    txs = []
+    for (sender, recipient, artwork_id) in [("MINT", "A", "ART50"), ("A", "B", "ART50"), ("A", "C", "ART50"),
+                                            ("MINT", "A", "ART51")]:
+        tx = Transaction(sender, recipient, artwork_id, "")
+        tx.sign(sender)
+        txs.append(tx)
+    confirmed = peer.blockchain.blocks[0].transactions[0]
+    with peer.pending_lock:
+        for tx in txs + [confirmed, Transaction("A", "X", "ART50", "BADSIG")]:
+            peer.add_pending(tx)
+    peer.remove_pending(lambda tx: tx.artwork_id != "ART51") # as if ART51 had just been mined
+    peer.mempool.close()
+    with open(path, "a") as f:
+        f.write('{"add": {"sender": "A"') # the peer died halfway through a write
+
+    restarted = Peer("127.0.0.1", 5011, "127.0.0.1", 8000, mempool_path=path)
+    print("[Test24] Recovered in order, double spend, confirmed and bad transactions dropped (expected MINT->A A->B):",
+          " ".join(f"{tx.sender}->{tx.recipient}" for tx in restarted.pending_transactions))
+    with open(path) as f:
+        lines = f.readlines()
+    print("Half-written record skipped (expected 1):", restarted.mempool.skipped,
+          " Journal compacted to the survivors (expected 2):", len(lines))
+
+    add_block = restarted.add_block
+    def beaten(block): # a peer's block is applied just before ours, once
+        restarted.add_block = add_block
+        tx = Transaction("MINT", "P", "ART52", "")
+        tx.sign("MINT")
+        restarted.accept_blocks([restarted.blockchain.mine_next_block([tx])])
+        return add_block(block)
+    restarted.add_block = beaten
+    print("Block that lost the race (expected None 2):", restarted.mine_pending(), len(restarted.pending_transactions),
+          " then mined on the new tip (expected 3 0):", restarted.mine_pending() is not None and len(restarted.blockchain.blocks),
+          len(restarted.pending_transactions), "\n")
+    restarted.mempool.close()
+
+
+def test_handshake_sync():
+    """
+    Test the HELLO handshake: a peer that fell behind catches up from one
+    that is ahead as soon as they connect, and the one ahead does not try
+    to sync from it.
+    """
+    print("Testing Handshake Sync")
+    ahead = Peer("127.0.0.1", 5020, "127.0.0.1", 8000)
+    behind = Peer("127.0.0.1", 5021, "127.0.0.1", 8000)
+    for i in range(5):
+        tx = Transaction("MINT", "A", f"ART6{i}", "")
+        tx.sign("MINT")
+        ahead.add_block(ahead.blockchain.mine_next_block([tx]))
+    ahead.sync_batch = 2 # so the catch-up takes several batches
+    listeners = []
+    for peer in (ahead, behind):
+        peer.handshakes = True
+        listeners.append(threading.Thread(target=peer.receive_message, daemon=True))
+        listeners[-1].start()
+    time.sleep(0.5)
+    ahead.peers = [("127.0.0.1", 5021)]
+    behind.peers = [("127.0.0.1", 5020)]
+
+    behind.greet(behind.peers)
+    started = time.time()
+    while len(behind.blockchain.blocks) < len(ahead.blockchain.blocks) and time.time() - started < 5:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    print("[Test25] Heights after the handshake (expected 5 5):",
+          len(ahead.blockchain.blocks) - 1, len(behind.blockchain.blocks) - 1)
+    print("Caught up within a second (expected True):", time.time() - started < 1,
+          " same work (expected True):", behind.blockchain.snapshot().work() == ahead.blockchain.snapshot().work())
+    print("Tip the peer ahead was told (expected 0 1):", ahead.peer_tips[("127.0.0.1", 5021)]["height"],
+          ahead.peer_tips[("127.0.0.1", 5021)]["protocol"], " it did not sync (expected None):", ahead.sync_from, "\n")
+    for peer in (ahead, behind):
+        peer.stop_event.set()
+    for listener in listeners:
+        listener.join()
+
+
+def test_gossip_convergence():
+    """
+    Test that gossip alone brings every peer to the same tip: a peer that
+    misses a block fetches the gap from whoever sends it the next one.
+    """
+    print("Testing Gossip Convergence")
+    reports = [Simulator(peers=30, duration=1200, seed=seed).run() for seed in (1, 2, 3)]
+    print("[Test26] Every peer on one tip for seeds 1-3 (expected True True True):",
+          *(report["converged"] for report in reports), "\n")
+
+
+def test_tracker_churn():
+    """
+    Test that a peer joining and leaving over and over does not pile up
+    entries in the tracker's expiry heap.
+    """
+    print("Testing Tracker Churn")
+    tracker = Tracker(0) # any free port; the selector loop is never run
+    now = time.time()
+    for i in range(50):
+        tracker.touch_peer(("10.0.0.1", 1), now + i)
+        tracker.forget_peer(("10.0.0.1", 1))
+    tracker.touch_peer(("10.0.0.1", 1), now + 50)
+    tracker.expire_peers(now + 50 + 39) # every stale entry is due, the live one is not
+    print("[Test27] Heap entries after 50 join/leave cycles (expected 1):", len(tracker.expiry_heap),
+          " Peer still live (expected True):", ("10.0.0.1", 1) in tracker.peers_last_seen)
+    tracker.expire_peers(now + 50 + 41)
+    print("Expired after 40 quiet seconds (expected 0 False):", len(tracker.expiry_heap),
+          ("10.0.0.1", 1) in tracker.peers_last_seen)
+    tracker.server.close()
+
+    silent = socket.create_server(("127.0.0.1", 0)) # takes connections but never answers
+    p = Peer("127.0.0.1", 0, "127.0.0.1", silent.getsockname()[1], pex=False)
+    started = time.time()
+    p.apply_peer_delta({"message_type": "PEER_DELTA", "from_version": 5, "changes": [
+        {"version": 5, "change": "JOIN", "ip": "127.0.0.1", "port": 9}]})
+    print("Gap in the deltas applied without waiting on the tracker (expected True True):",
+          time.time() - started < 1, p.peers_behind.is_set(), "\n")
+    silent.close()
+
+
 def test_dynamic_difficulty():
     """
     Test the dynamic difficulty adjustment.
@@ -182,7 +560,14 @@ def test_resilience_to_tampering():
     tampered = block_orig
     tampered.header.prev_block_hash = "ff"*32
     
-    print("[Test15] Add tampered block (expected False):", bc4.add_to_chain(tampered), "\n")
+    print("[Test15] Add tampered block (expected False):", bc4.add_to_chain(tampered))
+
+    txd = Transaction("MINT", "U", "ARTY", "")
+    txd.sign("MINT")
+    checked = bc4.mine_next_block([txd])
+    checked.validate()
+    checked.transactions[0].recipient = "Mallory" # changed after it passed a check
+    print("Block changed after validating it (expected False):", bc4.add_to_chain(checked), "\n")
 
 
 
@@ -193,5 +578,17 @@ if __name__ == "__main__":
     test_block_broadcast()
     test_merkle_and_multiple_txs()
     test_fork_resolution()
+    test_chain_events()
+    test_block_template()
+    test_ndjson_export_import()
+    test_pruned_chain()
+    test_chain_snapshots()
+    test_ingest_backpressure()
+    test_concurrent_broadcast()
+    test_gossip_scoring()
+    test_mempool_recovery()
+    test_handshake_sync()
+    test_gossip_convergence()
+    test_tracker_churn()
     test_dynamic_difficulty()
     test_resilience_to_tampering()
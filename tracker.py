@@ -1,130 +1,758 @@
+import argparse
 import socket
-import threading
+import selectors
+import heapq
+import errno
 import json
 import time
-import sys
-
-PEER_INACTIVITY_LIMIT = 40
-CLEANUP_INTERVAL = 10
-peers_last_seen = {} 
-peers_lock = threading.RLock()
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
 
+from metrics import Counter, Gauge, render
 
-def get_peer_overview():
+PEER_INACTIVITY_LIMIT = 40
+BROADCAST_COALESCE_DELAY = 0.05 # seconds to wait so close-together changes go out as one update
+MEMBERSHIP_LOG_SIZE = 1024 # how many JOIN/LEAVE deltas we remember for GET_PEERS
+JOIN_ANNOUNCE_TIMEOUT = 1 # longest a JOIN reply waits for the newcomer to be announced
+CONNECTION_TIMEOUT = 3 # drop connections that have not finished after this many seconds
+MAX_MESSAGE_SIZE = 65536 # a single request line may not be bigger than this
+MAX_OUTBOUND = 512 # broadcast connections open at the same time
+LONG_POLL_MAX = 60 # longest a GET /peers?wait=... request is held open
+BOOTSTRAP_SAMPLE = 32 # peers handed to a peer that joins for bootstrap only
+MESSAGE_TYPES = ("JOIN", "LEAVE", "KEEP_ALIVE", "GET_PEERS") # request lines we handle; others are counted as "other"
+
+TRACKER_PEERS = Gauge("tracker_peers", "Live peers registered with the tracker")
+TRACKER_MESSAGES = Counter("tracker_messages_total", "Requests handled by the tracker", labels=("type",))
+TRACKER_SOCKET_ERRORS = Counter("tracker_socket_errors_total", "Broadcast connections that could not be opened")
+
+
+class Connection:
     """
-    Gather the current live peers.
-
-    Returns:
-        list of dict: each dict has keys "ip" (str) and "port" (int)
+    State for one socket registered with the tracker's selector.
     """
-    result = []
-    with peers_lock:
-        for (ip, port) in peers_last_seen:
-            result.append({"ip": ip, "port": port})
-        return result
-
-
-def send_full_list_to(peer_socket):
+    def __init__(self, sock, outbound=False, broadcast=None):
+        """
+        Initialize the connection.
+
+        Args:
+            sock (socket.socket): non-blocking socket
+            outbound (bool): True for connections the tracker opened to push an update
+            broadcast (Broadcast): the broadcast an outbound connection belongs to
+        """
+        self.sock = sock
+        self.outbound = outbound
+        self.broadcast = broadcast
+        self.inbuf = bytearray()
+        self.outbuf = b""
+        self.closed = False
+        self.head_only = False
+        self.deadline = time.time() + CONNECTION_TIMEOUT
+
+
+class Broadcast:
     """
-    After a new peer JOINs, reply with the complete, up-to-date peer list.
-
-    Args:
-        peer_socket (socket.socket): open connection to the joining peer
+    One membership update being pushed to every known peer.
     """
-    message = {
-        "message_type": "PEER_LIST",
-        "peers": get_peer_overview()
-    }
-    peer_socket.sendall((json.dumps(message) + "\n").encode())
+    def __init__(self, version, packet, targets):
+        """
+        Initialize the broadcast.
 
+        Args:
+            version (int): membership version the update brings peers up to
+            packet (bytes): encoded PEER_DELTA or PEER_LIST line
+            targets (list): (ip, port) of every peer to send it to
+        """
+        self.version = version
+        self.packet = packet
+        self.pending = len(targets)
 
 
-def broadcast_list_update():
-    """
-    Tell every known peer about the latest peer list.
+class Tracker:
     """
-    update = {
-        "message_type": "PEER_UPDATE",
-        "peers": get_peer_overview()
-    }
-    packet = (json.dumps(update) + "\n").encode()
-
-    for (ip, port) in list(peers_last_seen):
-        try:
-            s = socket.create_connection((ip, port), timeout=3)
-            s.sendall(packet)
-            s.close()
-        except:
-            pass
+    Single-threaded tracker: one selector loop serves every connection.
 
+    Peer expiry uses a deadline heap with one entry per peer, so a cleanup
+    pass only looks at peers whose deadline has actually passed.
+    """
+    def __init__(self, port=8000):
+        """
+        Initialize the tracker and bind its listening socket.
+
+        Args:
+            port (int): TCP port number to bind to
+        """
+        self.peers_last_seen = {} # (ip, port) -> last time the peer pinged
+        self.expiry_heap = [] # (deadline, generation, (ip, port)), one live entry per peer
+        self.generations = {} # (ip, port) -> generation of its current heap entry, new on every join
+        self.generation = 0
+        self.subscribers = set() # peers that want PEER_DELTA pushes (the rest use peer exchange)
+
+        self.membership_version = 0 # bumped on every JOIN or LEAVE
+        self.membership_log = deque(maxlen=MEMBERSHIP_LOG_SIZE) # (version, change, (ip, port)), oldest first
+        self.announced_version = 0 # last membership version fully pushed to the peers
+        self.broadcast_due = None # when the next coalesced broadcast should go out
+        self.last_broadcast = 0
+
+        self.parked_joins = [] # (version, deadline, Connection) waiting for their announcement
+        self.parked_polls = [] # (version, deadline, Connection) HTTP long-polls waiting for a change
+        self.outbox = deque() # ((ip, port), Broadcast) not yet connected because of MAX_OUTBOUND
+        self.outbound_open = 0
+        self.connection_heap = [] # (deadline, seq, Connection)
+        self.connection_seq = 0
+
+        self.selector = selectors.DefaultSelector()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("0.0.0.0", port))
+        self.server.listen(1024)
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, None)
+        TRACKER_PEERS.set_function(lambda: len(self.peers_last_seen))
+
+
+    def get_peer_overview(self):
+        """
+        Gather the current live peers.
+
+        Returns:
+            list of dict: each dict has keys "ip" (str) and "port" (int)
+        """
+        result = []
+        for (ip, port) in self.peers_last_seen:
+            result.append({"ip": ip, "port": port})
+        return result
 
 
-def process_one_peer(peer_socket, address):
-    """
-    Handle exactly one message from a peer, then close.
+    def record_change(self, change, peer_id):
+        """
+        Bump the membership version, remember the change as a delta and
+        schedule a broadcast.
+
+        The first change after a quiet period goes out on the next loop pass;
+        changes that land within BROADCAST_COALESCE_DELAY of the previous
+        broadcast are held back and sent together.
+
+        Args:
+            change (str): "JOIN" or "LEAVE"
+            peer_id (tuple): (ip, port) of the peer that joined or left
+        """
+        self.membership_version += 1
+        self.membership_log.append((self.membership_version, change, peer_id))
+        if self.broadcast_due is None:
+            self.broadcast_due = max(time.time(), self.last_broadcast + BROADCAST_COALESCE_DELAY)
+
+
+    def touch_peer(self, peer_id, now, subscribe=True):
+        """
+        Mark a peer as seen, adding it (and a JOIN delta) if it is new.
+
+        Args:
+            peer_id (tuple): (ip, port) of the peer
+            now (float): current time
+            subscribe (bool): whether the peer wants membership updates pushed to it
+        """
+        if peer_id not in self.peers_last_seen:
+            self.record_change("JOIN", peer_id)
+            self.generation += 1
+            self.generations[peer_id] = self.generation
+            heapq.heappush(self.expiry_heap, (now + PEER_INACTIVITY_LIMIT, self.generation, peer_id))
+        self.peers_last_seen[peer_id] = now
+        if subscribe:
+            self.subscribers.add(peer_id)
+        else:
+            self.subscribers.discard(peer_id)
+
+
+    def forget_peer(self, peer_id):
+        """
+        Remove a peer from the table, recording a LEAVE delta if it was there.
+
+        Args:
+            peer_id (tuple): (ip, port) of the peer
+        """
+        if self.peers_last_seen.pop(peer_id, None) is not None:
+            self.generations.pop(peer_id, None) # its heap entry is dropped when popped
+            self.subscribers.discard(peer_id)
+            self.record_change("LEAVE", peer_id)
+
+
+    def get_changes_since(self, version):
+        """
+        Collect the deltas that happened after the given membership version.
+
+        Args:
+            version (int): last version the caller has applied
+
+        Returns:
+            list of dict or None: ordered deltas, or None if the log no longer
+            reaches back that far and the caller needs the full list instead
+        """
+        if version > self.membership_version:
+            return None
+        if self.membership_log and self.membership_log[0][0] > version + 1:
+            return None
+        if not self.membership_log and version != self.membership_version:
+            return None
+        changes = []
+        for (change_version, change, (ip, port)) in self.membership_log:
+            if change_version > version:
+                changes.append({"version": change_version, "change": change, "ip": ip, "port": port})
+        return changes
+
+
+    def full_list_message(self):
+        """
+        Build a PEER_LIST message with the complete peer list and its version.
+
+        Returns:
+            dict: PEER_LIST message
+        """
+        return {
+            "message_type": "PEER_LIST",
+            "version": self.membership_version,
+            "peers": self.get_peer_overview()
+        }
+
+
+    def bootstrap_message(self, peer_id):
+        """
+        Build a PEER_LIST with only the most recently seen peers, for a peer
+        that finds the rest of the network through peer exchange.
+
+        Args:
+            peer_id (tuple): (ip, port) of the asking peer, left out of the sample
+
+        Returns:
+            dict: PEER_LIST message with "sample" set
+        """
+        recent = heapq.nlargest(BOOTSTRAP_SAMPLE + 1, self.peers_last_seen.items(), key=lambda item: item[1])
+        peers = []
+        for ((ip, port), _) in recent:
+            if (ip, port) != peer_id and len(peers) < BOOTSTRAP_SAMPLE:
+                peers.append({"ip": ip, "port": port})
+        return {
+            "message_type": "PEER_LIST",
+            "version": self.membership_version,
+            "sample": True,
+            "peers": peers
+        }
+
+
+    def changes_message(self, since):
+        """
+        Build the deltas after `since` if we still have them, otherwise the
+        full list.
+
+        Args:
+            since (int): last membership version the receiver has applied
+
+        Returns:
+            dict: PEER_DELTA or PEER_LIST message
+        """
+        changes = self.get_changes_since(since)
+        if changes is None:
+            return self.full_list_message()
+        if changes:
+            version = changes[-1]["version"]
+        else:
+            version = since
+        return {
+            "message_type": "PEER_DELTA",
+            "from_version": since,
+            "version": version,
+            "changes": changes
+        }
+
+
+    def process_message(self, conn, raw):
+        """
+        Handle exactly one message from a peer.
+
+        The line must include:
+          - "message_type": one of "JOIN", "LEAVE", "KEEP_ALIVE" or "GET_PEERS"
+          - "ip" and "port" of that peer ("since" version for GET_PEERS)
+          - optionally "subscribe": false on JOIN/KEEP_ALIVE, for peers that
+            use peer exchange and only need the tracker to bootstrap
+
+        KEEP_ALIVE from a known peer changes nothing, so it costs no broadcast.
+        A subscribed JOIN's reply is parked until the other peers have been
+        told about the newcomer; a bootstrap JOIN gets a bounded sample of the
+        most recently seen peers right away.
+
+        Args:
+            conn (Connection): inbound connection the line arrived on
+            raw (bytes): the request line
+        """
+        try:
+            info = json.loads(raw.decode())
+            msg_type = info.get("message_type")
+            peer_id = (info.get("ip"), info.get("port"))
+        except (ValueError, AttributeError):
+            self.close(conn)
+            return
+        if msg_type != "GET_PEERS" and not (isinstance(peer_id[0], str) and isinstance(peer_id[1], int)):
+            self.close(conn)
+            return
+        TRACKER_MESSAGES.inc(type=msg_type if msg_type in MESSAGE_TYPES else "other")
+        now = time.time()
+        subscribe = info.get("subscribe", True) is not False
+
+        if msg_type == "JOIN":
+            self.touch_peer(peer_id, now, subscribe)
+            if not subscribe:
+                self.reply(conn, self.bootstrap_message(peer_id))
+                return
+            self.parked_joins.append((self.membership_version, now + JOIN_ANNOUNCE_TIMEOUT, conn))
+            return
+        elif msg_type == "LEAVE":
+            self.forget_peer(peer_id)
+        elif msg_type == "KEEP_ALIVE":
+            # a ping from a peer we already expired brings it back
+            self.touch_peer(peer_id, now, subscribe)
+        elif msg_type == "GET_PEERS":
+            try:
+                since = int(info.get("since", 0))
+            except (TypeError, ValueError):
+                since = 0
+            self.reply(conn, self.changes_message(since))
+            return
+        self.close(conn)
+
+
+    def reply(self, conn, message):
+        """
+        Queue a one-line JSON reply; the connection closes once it is sent.
+
+        Args:
+            conn (Connection): inbound connection to answer on
+            message (dict): message to send
+        """
+        conn.outbuf = (json.dumps(message) + "\n").encode()
+        self.selector.register(conn.sock, selectors.EVENT_WRITE, conn)
+
+
+    def peers_etag(self):
+        """
+        ETag for the current peer directory: the quoted membership version.
+
+        Returns:
+            str: ETag header value
+        """
+        return f'"{self.membership_version}"'
+
+
+    def process_http(self, conn, head):
+        """
+        Serve one HTTP request for the peer directory.
+
+        GET /peers returns the live peers as a JSON list of "http://ip:port"
+        strings, with the membership version as ETag. A matching If-None-Match
+        gets a 304; with ?wait=<seconds> the request is held open until
+        membership changes (then 200) or the wait runs out (then 304).
+        GET /metrics returns the tracker's metrics in the Prometheus text format.
+
+        Args:
+            conn (Connection): inbound connection the request arrived on
+            head (bytes): request line and headers, without the blank line
+        """
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        if len(parts) < 2 or parts[0] not in ("GET", "HEAD"):
+            self.http_reply(conn, 405, b"")
+            return
+        url = urlsplit(parts[1])
+        if url.path.rstrip("/") == "/metrics":
+            TRACKER_MESSAGES.inc(type="HTTP_METRICS")
+            self.http_reply(conn, 200, render().encode(), "text/plain; version=0.0.4", parts[0] == "HEAD")
+            return
+        if url.path.rstrip("/") != "/peers":
+            self.http_reply(conn, 404, b"")
+            return
+        TRACKER_MESSAGES.inc(type="HTTP_PEERS")
+
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
 
-    Reads a single JSON line, which must include:
-      - "message_type": one of "JOIN", "LEAVE", or "KEEP_ALIVE"
-      - "ip" and "port" of that peer
+        try:
+            wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+        except ValueError:
+            wait = 0
+        wait = max(0, min(wait, LONG_POLL_MAX))
+
+        if headers.get("if-none-match") == self.peers_etag():
+            if wait > 0:
+                conn.head_only = parts[0] == "HEAD"
+                conn.deadline = time.time() + wait + CONNECTION_TIMEOUT
+                self.parked_polls.append((self.membership_version, time.time() + wait, conn))
+            else:
+                self.http_reply(conn, 304, b"")
+            return
+        self.send_peer_directory(conn, parts[0] == "HEAD")
+
+
+    def send_peer_directory(self, conn, head_only=False):
+        """
+        Answer an HTTP request with the current peer directory.
+
+        Args:
+            conn (Connection): connection to answer on
+            head_only (bool): leave out the body (HEAD request)
+        """
+        peers = [f"http://{p['ip']}:{p['port']}" for p in self.get_peer_overview()]
+        body = json.dumps(peers).encode()
+        self.http_reply(conn, 200, body, "application/json", head_only)
+
+
+    def http_reply(self, conn, status, body, content_type="text/plain", head_only=False):
+        """
+        Queue an HTTP/1.1 response; the connection closes once it is sent.
+
+        Args:
+            conn (Connection): connection to answer on
+            status (int): HTTP status code
+            body (bytes): response body
+            content_type (str): Content-Type header value
+            head_only (bool): send the headers only
+        """
+        reasons = {200: "OK", 304: "Not Modified", 404: "Not Found", 405: "Method Not Allowed"}
+        head = (f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                f"ETag: {self.peers_etag()}\r\n"
+                f"Cache-Control: no-cache\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body) if status != 304 else 0}\r\n"
+                f"Connection: close\r\n\r\n").encode()
+        if status == 304 or head_only:
+            body = b""
+        conn.outbuf = head + body
+        self.selector.register(conn.sock, selectors.EVENT_WRITE, conn)
+
+
+    def release_polls(self, now):
+        """
+        Answer parked long-polls once membership has changed or their wait ran out.
+
+        Args:
+            now (float): current time
+        """
+        if not self.parked_polls:
+            return
+        still_parked = []
+        for (version, deadline, conn) in self.parked_polls:
+            if conn.closed:
+                continue
+            if version != self.membership_version:
+                self.send_peer_directory(conn, conn.head_only)
+            elif now >= deadline:
+                self.http_reply(conn, 304, b"")
+            else:
+                still_parked.append((version, deadline, conn))
+        self.parked_polls = still_parked
+
+
+    def release_joins(self, now):
+        """
+        Answer parked JOINs whose membership version has been announced, or
+        that have waited long enough.
+
+        Args:
+            now (float): current time
+        """
+        if not self.parked_joins:
+            return
+        still_parked = []
+        message = None
+        for (version, deadline, conn) in self.parked_joins:
+            if conn.closed:
+                continue
+            if version <= self.announced_version or now >= deadline:
+                if message is None:
+                    message = self.full_list_message()
+                self.reply(conn, message)
+            else:
+                still_parked.append((version, deadline, conn))
+        self.parked_joins = still_parked
+
+
+    def expire_peers(self, now):
+        """
+        Remove peers that haven’t sent a KEEP_ALIVE ping recently.
+
+        Only heap entries whose deadline has passed are looked at; a peer that
+        pinged since its entry was pushed gets a fresh entry instead. Entries
+        left behind by a peer that left (or left and joined again, which
+        gives it a new generation) are dropped, so the heap never holds
+        more than one live entry per peer.
+
+        Args:
+            now (float): current time
+        """
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            deadline, generation, peer_id = heapq.heappop(self.expiry_heap)
+            if self.generations.get(peer_id) != generation:
+                continue # a stale entry from before the peer left
+            last_seen = self.peers_last_seen[peer_id]
+            if last_seen + PEER_INACTIVITY_LIMIT > now:
+                heapq.heappush(self.expiry_heap, (last_seen + PEER_INACTIVITY_LIMIT, generation, peer_id))
+            else:
+                self.forget_peer(peer_id)
+
+
+    def flush_broadcast(self, now):
+        """
+        Start pushing the pending membership changes to every subscribed peer.
+
+        Args:
+            now (float): current time
+        """
+        if self.broadcast_due is None or now < self.broadcast_due:
+            return
+        update = self.changes_message(self.announced_version)
+        version = update["version"]
+        packet = (json.dumps(update) + "\n").encode()
+        targets = list(self.subscribers)
+        broadcast = Broadcast(version, packet, targets)
+        self.broadcast_due = None
+        self.last_broadcast = now
+
+        if not targets:
+            self.finish_broadcast(broadcast)
+            return
+        for peer_id in targets:
+            self.outbox.append((peer_id, broadcast))
+        self.open_outbound()
+
+
+    def open_outbound(self):
+        """
+        Open queued broadcast connections, up to MAX_OUTBOUND at a time.
+        """
+        while self.outbox and self.outbound_open < MAX_OUTBOUND:
+            (ip, port), broadcast = self.outbox.popleft()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                err = sock.connect_ex((ip, port))
+            except (OSError, TypeError, OverflowError):
+                err = errno.EINVAL
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                TRACKER_SOCKET_ERRORS.inc()
+                sock.close()
+                self.broadcast_target_done(broadcast)
+                continue
+            conn = Connection(sock, outbound=True, broadcast=broadcast)
+            conn.outbuf = broadcast.packet
+            self.selector.register(sock, selectors.EVENT_WRITE, conn)
+            self.watch(conn)
+            self.outbound_open += 1
+
+
+    def broadcast_target_done(self, broadcast):
+        """
+        Count one peer of a broadcast as handled (sent or failed).
+
+        Args:
+            broadcast (Broadcast): the broadcast the peer belonged to
+        """
+        broadcast.pending -= 1
+        if broadcast.pending == 0:
+            self.finish_broadcast(broadcast)
+
+
+    def finish_broadcast(self, broadcast):
+        """
+        Mark a broadcast's version as announced.
+
+        Args:
+            broadcast (Broadcast): the completed broadcast
+        """
+        self.announced_version = max(self.announced_version, broadcast.version)
+
+
+    def watch(self, conn):
+        """
+        Track a connection's deadline so stale sockets get closed.
+
+        Args:
+            conn (Connection): connection to watch
+        """
+        self.connection_seq += 1
+        heapq.heappush(self.connection_heap, (conn.deadline, self.connection_seq, conn))
+
+
+    def close_stale(self, now):
+        """
+        Close connections that are past their deadline.
+
+        Args:
+            now (float): current time
+        """
+        while self.connection_heap and self.connection_heap[0][0] <= now:
+            _, _, conn = heapq.heappop(self.connection_heap)
+            if conn.closed:
+                continue
+            if conn.deadline > now:
+                # a long-poll pushed its deadline out; check again later
+                self.watch(conn)
+            else:
+                self.close(conn)
+
+
+    def close(self, conn):
+        """
+        Unregister and close a connection.
+
+        Args:
+            conn (Connection): connection to close
+        """
+        if conn.closed:
+            return
+        conn.closed = True
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        if conn.outbound:
+            self.outbound_open -= 1
+            self.broadcast_target_done(conn.broadcast)
 
-    Updates the peer table and notifies everyone if anything changed.
 
-    Args:
-        peer_socket (socket.socket): socket connected to the peer
-        address (tuple): (ip, port) tuple assigned by accept()
+    def accept(self):
+        """
+        Accept every pending inbound connection.
+        """
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            sock.setblocking(False)
+            conn = Connection(sock)
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+            self.watch(conn)
+
+
+    def handle_read(self, conn):
+        """
+        Read from an inbound connection and process the line once complete.
+
+        Args:
+            conn (Connection): inbound connection that is readable
+        """
+        try:
+            chunk = conn.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close(conn)
+            return
+
+        if chunk:
+            conn.inbuf += chunk
+        if conn.inbuf[:1] not in (b"", b"{"):
+            # anything that is not a JSON line is treated as an HTTP request
+            end = conn.inbuf.find(b"\r\n\r\n")
+            if end >= 0:
+                self.selector.unregister(conn.sock)
+                self.process_http(conn, bytes(conn.inbuf[:end]))
+            elif not chunk or len(conn.inbuf) > MAX_MESSAGE_SIZE:
+                self.close(conn)
+            return
+
+        newline = conn.inbuf.find(b"\n")
+        if newline >= 0 or (not chunk and conn.inbuf):
+            if newline < 0:
+                newline = len(conn.inbuf)
+            # one message per connection: stop reading and handle it
+            self.selector.unregister(conn.sock)
+            self.process_message(conn, bytes(conn.inbuf[:newline]))
+        elif not chunk or len(conn.inbuf) > MAX_MESSAGE_SIZE:
+            self.close(conn)
+
+
+    def handle_write(self, conn):
+        """
+        Send queued bytes; close the connection once everything is out.
+
+        Args:
+            conn (Connection): connection that is writable
+        """
+        if conn.outbound:
+            err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self.close(conn)
+                return
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close(conn)
+            return
+        conn.outbuf = conn.outbuf[sent:]
+        if not conn.outbuf:
+            self.close(conn)
+
+
+    def next_timeout(self, now):
+        """
+        How long the selector may sleep before a timer needs attention.
+
+        Args:
+            now (float): current time
+
+        Returns:
+            float: seconds to wait
+        """
+        deadlines = []
+        if self.expiry_heap:
+            deadlines.append(self.expiry_heap[0][0])
+        if self.connection_heap:
+            deadlines.append(self.connection_heap[0][0])
+        if self.broadcast_due is not None:
+            deadlines.append(self.broadcast_due)
+        for (_, deadline, _) in self.parked_joins:
+            deadlines.append(deadline)
+            break
+        for (_, deadline, _) in self.parked_polls:
+            deadlines.append(deadline)
+        if not deadlines:
+            return 1
+        return min(1, max(0, min(deadlines) - now))
+
+
+    def serve_forever(self):
+        """
+        Run the selector loop: handle ready sockets, then the timers.
+        """
+        while True:
+            for key, mask in self.selector.select(self.next_timeout(time.time())):
+                conn = key.data
+                if conn is None:
+                    self.accept()
+                elif mask & selectors.EVENT_READ:
+                    self.handle_read(conn)
+                elif mask & selectors.EVENT_WRITE:
+                    self.handle_write(conn)
 
-    Returns:
-        None
-    """
-    try:
-        raw = peer_socket.recv(4096).decode().strip()
-        info = json.loads(raw)
-    except:
-        peer_socket.close() 
-        return 
-
-    msg_type = info.get("message_type")
-    peer_id  = (info.get("ip"), info.get("port"))
-    now = time.time()
-
-    #with peers_lock:
-    if msg_type == "JOIN":
-        peers_last_seen[peer_id] = now
-        send_full_list_to(peer_socket)
-        #print("[TRACKER] sent PEER_LIST", flush=True)
-        time.sleep(0.1) 
-    elif msg_type == "LEAVE":
-        peers_last_seen.pop(peer_id, None)
-    elif msg_type == "KEEP_ALIVE":
-        peers_last_seen[peer_id] = now
-
-    # Broadcast the new list to everyone if JOIN or LEAVE happened
-    broadcast_list_update()
-    peer_socket.close()
-
-
-
-def remove_inactive_peers():
-    """
-    Periodically remove peers that haven’t sent a KEEP_ALIVE ping recently.
-    """
-    while True:
-        time.sleep(CLEANUP_INTERVAL)
-        now = time.time()
-        removed = []
-        with peers_lock:
-            for peer, last_seen in list(peers_last_seen.items()):
-                if now - last_seen > PEER_INACTIVITY_LIMIT:
-                    removed.append(peer)
-                    del peers_last_seen[peer]
-        if removed:
-            broadcast_list_update()
+            now = time.time()
+            self.expire_peers(now)
+            self.flush_broadcast(now)
+            self.open_outbound()
+            self.release_joins(now)
+            self.release_polls(now)
+            self.close_stale(now)
 
 
 
 def start_tracker(port=8000):
     """
-    Start listening for JOIN/LEAVE/KEEP_ALIVE messages on the given port.
+    Start listening for JOIN/LEAVE/KEEP_ALIVE/GET_PEERS messages and HTTP
+    GET /peers requests on the given port.
 
     Args:
         port (int): TCP port number to bind to (default: 8000)
@@ -132,27 +760,20 @@ def start_tracker(port=8000):
     Returns:
         None
     """
-    # Launch the background janitor thread
-    threading.Thread(target=remove_inactive_peers, daemon=True).start()
-
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(("0.0.0.0", port))
-    server.listen()
+    tracker = Tracker(port)
     #print(f"[Tracker] Now listening on 0.0.0.0:{port}")
 
     try:
-        while True:
-            client_sock, client_addr = server.accept()
-            threading.Thread(target=process_one_peer, args=(client_sock, client_addr), daemon=True).start()
+        tracker.serve_forever()
     except KeyboardInterrupt:
         print("\n[Tracker] Shutting down.")
 
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        chosen_port = int(sys.argv[1])
-    else:
-        chosen_port = 8000
+    ap = argparse.ArgumentParser(description="Run the peer tracker.")
+    ap.add_argument("port", type=int, nargs="?", help="same as --port")
+    ap.add_argument("--port", type=int, dest="port_option", help="TCP port to listen on (default 8000)")
+    args = ap.parse_args()
 
-    start_tracker(chosen_port)
+    start_tracker(args.port_option or args.port or 8000)
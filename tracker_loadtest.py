@@ -0,0 +1,169 @@
+import argparse, json, socket, subprocess, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(samples, pct):
+    """
+    Return the pct-th percentile of a list of numbers.
+
+    Args:
+        samples (list): numbers to look at
+        pct (float): percentile between 0 and 100
+
+    Returns:
+        float: the percentile, or 0 if there are no samples
+    """
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def fake_peer(i, port):
+    """
+    Address the i-th simulated peer advertises to the tracker.
+
+    Every peer gets its own 127.x.y.z loopback address on the same closed
+    port, so tracker broadcasts to them fail fast instead of piling up.
+
+    Args:
+        i (int): peer number
+        port (int): port nobody listens on
+
+    Returns:
+        tuple: (ip, port)
+    """
+    n = i + 1
+    return (f"127.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}", port)
+
+
+def send_one(tracker, message, want_reply):
+    """
+    Send one message to the tracker and time it until the reply (or close).
+
+    Args:
+        tracker (tuple): (host, port) of the tracker
+        message (dict): message to send
+        want_reply (bool): wait for a reply line instead of the close
+
+    Returns:
+        float: latency in seconds, or None if the request failed
+    """
+    start = time.perf_counter()
+    try:
+        with socket.create_connection(tracker, timeout=30) as s:
+            s.sendall((json.dumps(message) + "\n").encode())
+            while True:
+                chunk = s.recv(65536)
+                if not chunk or (want_reply and chunk.endswith(b"\n")):
+                    break
+    except OSError:
+        return None
+    return time.perf_counter() - start
+
+
+def run_phase(name, tracker, messages, want_reply, concurrency):
+    """
+    Send a batch of messages with a fixed number of workers and report
+    latency percentiles.
+
+    Args:
+        name (str): phase label for the report
+        tracker (tuple): (host, port) of the tracker
+        messages (list): messages to send
+        want_reply (bool): whether each message expects a reply line
+        concurrency (int): number of requests in flight
+
+    Returns:
+        dict: phase results
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda m: send_one(tracker, m, want_reply), messages))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r for r in results if r is not None]
+    report = {
+        "phase": name,
+        "requests": len(messages),
+        "errors": len(messages) - len(latencies),
+        "seconds": round(elapsed, 3),
+        "per_second": round(len(latencies) / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+    }
+    print(f"{name:<11} n={report['requests']:<6} errors={report['errors']:<4} "
+          f"{report['per_second']:>9}/s  p50={report['p50_ms']}ms  p90={report['p90_ms']}ms  "
+          f"p99={report['p99_ms']}ms  max={report['max_ms']}ms", flush=True)
+    return report
+
+
+def wait_for_port(host, port, timeout=10):
+    """
+    Wait until something accepts connections on host:port.
+
+    Returns:
+        bool: True once the port answers, False on timeout
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def main():
+    """
+    Load-test a tracker with many simulated peers.
+    """
+    ap = argparse.ArgumentParser(description="Measure tracker JOIN and KEEP_ALIVE latency at scale.")
+    ap.add_argument("-n", "--peers", type=int, default=10000)
+    ap.add_argument("-c", "--concurrency", type=int, default=64)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=7999)
+    ap.add_argument("--rounds", type=int, default=2, help="KEEP_ALIVE rounds after everyone joined")
+    ap.add_argument("--dead-port", type=int, default=9, help="closed port the fake peers advertise")
+    ap.add_argument("--no-spawn", action="store_true", help="use a tracker that is already running")
+    ap.add_argument("--json", help="also write the results to this file")
+    args = ap.parse_args()
+
+    tracker = (args.host, args.port)
+    proc = None
+    if not args.no_spawn:
+        proc = subprocess.Popen([sys.executable, "tracker.py", str(args.port)])
+        if not wait_for_port(args.host, args.port):
+            proc.kill()
+            sys.exit("tracker did not start")
+
+    try:
+        print(f"Tracker load test: {args.peers} peers, concurrency {args.concurrency}\n")
+        peers = [fake_peer(i, args.dead_port) for i in range(args.peers)]
+        results = []
+
+        joins = [{"message_type": "JOIN", "ip": ip, "port": port} for (ip, port) in peers]
+        results.append(run_phase("JOIN", tracker, joins, True, args.concurrency))
+
+        pings = [{"message_type": "KEEP_ALIVE", "ip": ip, "port": port} for (ip, port) in peers]
+        for r in range(args.rounds):
+            results.append(run_phase(f"KEEP_ALIVE{r + 1}", tracker, pings, False, args.concurrency))
+
+        leaves = [{"message_type": "LEAVE", "ip": ip, "port": port} for (ip, port) in peers]
+        results.append(run_phase("LEAVE", tracker, leaves, False, args.concurrency))
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"peers": args.peers, "concurrency": args.concurrency, "phases": results}, f, indent=2)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
-import argparse, json, os, queue, threading, time, requests
-from flask import Flask, request, jsonify, Response, render_template
-from blockchain   import Block
+import argparse, json, queue, threading, time, uuid, requests
+from collections import OrderedDict
+from flask import Flask, request, Response, render_template
+from block        import load_block
 from transactions import Transaction
+from event_hub    import EventHub
+from block_template import build_block_template
+from broadcast    import Broadcaster
+from gossip       import PeerScores, gossip_fanout
+from metrics      import Gauge, render
 
 import peer
 try:
@@ -18,81 +24,145 @@ except AttributeError:
 
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
-subscribers: set[queue.Queue] = set()
+hub = EventHub(capacity=1024)
+
+STREAM_KEEPALIVE = 15 # seconds between SSE comments that keep idle streams open
+STREAM_MAX_CATCHUP = 256 # a client further behind than this gets a snapshot instead
 
 TRACKER_URL = ""
 PEER_PORT   = 0
 PEER_ADDR   = ""
 UI_PORT     = 0
 peer_list   = []
+PEER_POLL_WAIT = 30 # seconds the tracker may hold a /peers long-poll
+PEER_POLL_BACKOFF = 5 # seconds to wait before asking again after the tracker failed us
 
 CHAIN_FILE  = "chain.json"
-_chain_mtime = os.path.getmtime(CHAIN_FILE) if os.path.exists(CHAIN_FILE) else 0
-
-def sync_chain():
+MAX_PAGE    = 5000 # largest ?limit= accepted by /api/blocks
+EXPORT_CHUNK = 256 # blocks per write when streaming /api/export
+MAX_BLOCK_TXS = 4096 # transfers the mining worker packs into one block (--max-block-txs)
+MAX_BULK_LINES = 100000 # lines accepted by one POST /api/transfers
+MAX_JOBS    = 10000 # finished jobs remembered for GET /api/jobs/<id>
+MINE_ATTEMPTS = 3 # re-mine on the new tip this many times if a peer's block lands first
+BLOCK_CACHE_SIZE = 8192 # serialized blocks kept for /api/blocks, least recently used dropped first
+
+chain_lock  = threading.Lock() # serializes add_to_chain + save between the miner and /receive_block; readers use blockchain.snapshot()
+mining_queue = queue.Queue() # (job id, transfer) waiting for the mining worker
+jobs        = OrderedDict() # job id -> job dict, oldest first
+jobs_lock   = threading.Lock()
+
+block_cache = OrderedDict() # height -> (block_id, JSON bytes), least recently used first
+block_cache_lock = threading.Lock()
+
+def cached_blocks(lo, hi, blocks, fill=True):
     """
-    Reload chain.json into memory and return True if it changed.
+    Serialized main-chain blocks for heights lo..hi-1.
 
-    Return: True if the chain was reloaded, False otherwise.
-    """
-    global _chain_mtime
-    try:
-        mtime = os.path.getmtime(CHAIN_FILE)
-    except FileNotFoundError:
-        return False
-    if mtime != _chain_mtime:
-        blockchain.load(CHAIN_FILE)
-        _chain_mtime = mtime
-        return True
-    return False
+    Blocks never change once connected, so each one is encoded once and
+    kept until a reorg disconnects it, pruning strips its transactions or
+    it is among the least recently used once BLOCK_CACHE_SIZE are cached.
+    The cached ids are checked against the caller's snapshot, so a reader
+    holding a view from before a reorg never gets blocks from after it (or
+    the other way round).
 
-def push_full_chain():
-    """
-    Send the whole chain to every connected browser tab.
-    """
-    payload = {"type": "INIT",
-               "chain": [b.to_dict() for b in blockchain.blocks]}
-    for q in subscribers:
-        try: q.put_nowait(payload)
-        except queue.Full: pass
+    Args:
+        blocks: the main chain of the snapshot being served
+        fill: False to use what is cached without adding to it, for reads
+            of the whole chain that would otherwise push out every page
 
-def file_watcher():
+    Return: list of (block_id, JSON bytes).
     """
-    Background thread: poll the file every second; push if changed.
+    with block_cache_lock:
+        pruned_height = blockchain.pruned_height # pruned blocks are small and change once, so never cached
+        page = []
+        for height in range(lo, min(hi, len(blocks))):
+            blk = blocks[height]
+            entry = block_cache.get(height)
+            if entry is not None and entry[0] == blk.get_id() and height >= pruned_height:
+                block_cache.move_to_end(height)
+            else:
+                entry = (blk.get_id(), json.dumps(blk.to_dict()).encode())
+                if fill and height >= pruned_height:
+                    block_cache[height] = entry
+            page.append(entry)
+        while len(block_cache) > BLOCK_CACHE_SIZE:
+            block_cache.popitem(last=False)
+        return page
+
+def on_chain_event(event, blk, height):
     """
-    while True:
-        if sync_chain():
-            push_full_chain()
-        time.sleep(1)
+    Chain listener: forward each connected or disconnected block to every
+    connected browser tab, so a refresh costs one block, not the whole chain.
+    """
+    with block_cache_lock:
+        # blocks from here up changed, and pruning may just have stripped the oldest ones
+        for stale in [h for h in block_cache if h >= height or h < blockchain.pruned_height]:
+            del block_cache[stale]
+    if event == "connected":
+        payload = {"type": "BLOCK_ADDED", "block": blk.to_dict()}
+    else:
+        payload = {"type": "BLOCK_REMOVED", "block_num": height, "hash": blk.get_id()}
+    hub.publish(payload)
+
+blockchain.add_listener(on_chain_event)
+
+CHAIN_HEIGHT = Gauge("chain_height", "Blocks in the main chain, genesis included")
+CHAIN_HEIGHT.set_function(lambda: len(blockchain.snapshot().blocks))
+MINING_JOBS = Gauge("mining_jobs", "Mining jobs remembered, by status", labels=("status",))
 
 def refresh_peers():
     """
-    Background thread: poll the tracker every 5 seconds; update peer list.
+    Background thread: long-poll the tracker's peer directory; update peer list.
+
+    Each request sends the last ETag and asks the tracker to hold it open
+    until membership changes, so updates arrive right away without polling.
     """
     global peer_list
+    etag = None
     while True:
+        headers = {"If-None-Match": etag} if etag else {}
         try:
-            r = requests.get(f"{TRACKER_URL}/peers", timeout=2)
-            peer_list = [p for p in r.json() if p != PEER_ADDR]
-        except requests.exceptions.RequestException:
-            pass
-        time.sleep(5)
-
-def broadcast_block(bdict):
-    """
-    Broadcast a block to all connected peers.
-    """
-    for p in peer_list:
-        host, port = p.rsplit(":", 1)
-        ui_port    = str(int(port) + 100)
-        for tgt in (f"{host}:{ui_port}", p):
-            try:
-                resp = requests.post(f"{tgt}/receive_block",
-                                     json=bdict, timeout=1)
-                if resp.ok:
-                    break
-            except requests.exceptions.RequestException:
-                continue
+            r = requests.get(f"{TRACKER_URL}/peers", params={"wait": PEER_POLL_WAIT},
+                             headers=headers, timeout=PEER_POLL_WAIT + 5)
+            if r.status_code == 200:
+                peer_list = [p for p in r.json() if p != PEER_ADDR]
+                etag = r.headers.get("ETag")
+            elif r.status_code != 304:
+                time.sleep(PEER_POLL_BACKOFF) # a failing tracker answers at once; don't spin on it
+        except (requests.exceptions.RequestException, ValueError):
+            time.sleep(PEER_POLL_BACKOFF)
+
+def post_block(peer_url, bdict, timeout):
+    """
+    POST a block to the UI of the peer at peer_url (its port + 100; the
+    peer's own port does not speak HTTP).
+
+    Return: True if the UI took it.
+    """
+    host, port = peer_url.rsplit(":", 1)
+    try:
+        resp = requests.post(f"{host}:{int(port) + 100}/receive_block", json=bdict, timeout=timeout)
+        return resp.ok
+    except requests.exceptions.RequestException:
+        peer.SOCKET_ERRORS.inc(target="peer_http")
+        return False
+
+ui_scores   = PeerScores() # how fast each UI takes our blocks
+broadcaster = Broadcaster(post_block, timeout=1, observer=ui_scores.sent) # sends to many UIs at once, skipping ones that keep failing
+
+def broadcast_block(bdict, relay=False):
+    """
+    Broadcast a block to the other peers' UIs.
+
+    A block we mined goes to every UI: a UI cannot fetch a block it
+    missed, so the first hop stays a flood. A block we only pass on goes
+    to gossip_fanout() UIs picked by score, which keeps the redundancy
+    without every UI sending every block to every other UI.
+    """
+    targets = list(peer_list)
+    if relay:
+        targets = ui_scores.choose(targets, gossip_fanout(len(targets)))
+    broadcaster.broadcast(targets, bdict)
 
 @app.route("/")
 def index():
@@ -106,42 +176,397 @@ def index():
 @app.route("/api/blocks")
 def api_blocks():
     """
-    Return the blockchain as a JSON object.
+    Return a range of the blockchain as a JSON array.
+
+    Query parameters:
+        from_height: first height to return (default 0, or the tip with order=tip)
+        limit: number of blocks to return (default all, at most MAX_PAGE)
+        order: "asc" (default) or "tip" for newest first
+        cursor: value of a previous X-Next-Cursor header, replaces from_height
+
+    The body is assembled from cached per-block JSON. The ETag names the
+    newest block in the page, which pins every block below it, so an
+    unchanged page answers If-None-Match with a 304.
+
+    Return: The blocks as a JSON array.
+    """
+    view = blockchain.snapshot()
+    height = len(view.blocks)
+    tip_first = request.args.get("order", "asc") == "tip"
+    try:
+        start = request.args.get("cursor", request.args.get("from_height"))
+        start = int(start) if start is not None else (height - 1 if tip_first else 0)
+        limit = min(int(request.args["limit"]), MAX_PAGE) if "limit" in request.args else height
+    except ValueError:
+        return {"error": "from_height, limit and cursor must be integers"}, 400
+    limit = max(0, limit)
+
+    if tip_first:
+        hi = min(start, height - 1) + 1
+        lo = max(0, hi - limit)
+        next_cursor = lo - 1 if lo > 0 else None
+    else:
+        lo = max(0, start)
+        hi = min(height, lo + limit)
+        next_cursor = hi if hi < height else None
+
+    page = cached_blocks(lo, hi, view.blocks) if hi > lo else []
+    if tip_first:
+        page = page[::-1]
+    newest_id = "empty"
+    if page:
+        newest_id = page[0][0] if tip_first else page[-1][0]
+    etag = f'"{newest_id[:32]}-{lo}-{len(page)}-{"tip" if tip_first else "asc"}"'
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Chain-Height": str(height)}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+
+    body = b"[" + b",".join(data for (_, data) in page) + b"]"
+    return Response(body, mimetype="application/json", headers=headers)
+
+@app.route("/api/export")
+def api_export():
+    """
+    Stream the main chain as NDJSON, one block per line.
+
+    Query parameters:
+        from_height: first height to send (default 0), to resume a transfer
+
+    Blocks are serialized and sent EXPORT_CHUNK at a time, so the response
+    is never built in memory as a whole. They bypass the per-block JSON
+    cache, which would otherwise end up holding the whole chain after one
+    export. The body can be fed to BlockChain.import_ndjson on another node.
+
+    Return: The blocks as NDJSON.
+    """
+    try:
+        start = max(0, int(request.args.get("from_height", 0)))
+    except ValueError:
+        return {"error": "from_height must be an integer"}, 400
+
+    view = blockchain.snapshot()
+
+    def generate():
+        for lo in range(start, len(view.blocks), EXPORT_CHUNK):
+            chunk = [view.blocks[height] for height in range(lo, min(lo + EXPORT_CHUNK, len(view.blocks)))]
+            yield b"".join(json.dumps(blk.to_dict()).encode() + b"\n" for blk in chunk)
+
+    return Response(generate(), mimetype="application/x-ndjson",
+                    headers={"X-Chain-Height": str(len(view.blocks))})
+
+def update_job(job_id, **fields):
+    """
+    Change a job's fields and tell the browsers about it.
+    """
+    with jobs_lock:
+        job = jobs[job_id]
+        job.update(fields)
+        snapshot = dict(job)
+    hub.publish({"type": "JOB_UPDATE", "job": snapshot})
+
+def record_results(items, block=None, error=None):
+    """
+    Count transfers of a mined batch as mined (into block) or failed (with
+    error), one JOB_UPDATE per job.
+
+    Args:
+        items: list of (job_id, transfer) pairs
+        block: the block they were mined into, if they succeeded
+        error: why they failed, otherwise
+    """
+    per_job = OrderedDict()
+    for (job_id, _) in items:
+        per_job[job_id] = per_job.get(job_id, 0) + 1
+
+    for job_id, n in per_job.items():
+        with jobs_lock:
+            job = dict(jobs[job_id])
+        fields = {}
+        if block is not None:
+            fields["mined"] = job["mined"] + n
+            fields["blocks"] = job["blocks"] + [block.header.block_num]
+            if job["count"] == 1:
+                fields.update(block_num=block.header.block_num, block_hash=block.get_id())
+        else:
+            fields["failed"] = job["failed"] + n
+            if len(job["errors"]) < 100:
+                fields["errors"] = job["errors"] + [error]
+            if job["count"] == 1:
+                fields["error"] = error
+        mined, failed = fields.get("mined", job["mined"]), fields.get("failed", job["failed"])
+        if mined + failed == job["count"]:
+            fields["status"] = "done" if mined else "failed"
+        update_job(job_id, **fields)
+
+def check_transfer(transfer, pending_owners, view):
+    """
+    Check a transfer against current ownership.
 
-    Return: The blockchain as a JSON object.
+    Args:
+        transfer: dict with sender, recipient and artwork_id
+        pending_owners: artwork_id -> owner after transfers accepted earlier
+            in the same batch, which are not on the chain yet
+        view: the chain snapshot the whole batch is checked against
+
+    Return: None if the transfer is allowed, otherwise the reason it is not.
+    """
+    art = transfer["artwork_id"]
+    owner = pending_owners[art] if art in pending_owners else view.owner_of(art)
+    if transfer["sender"] == "MINT":
+        if owner is not None or art in view.minted_artworks:
+            return f'artwork "{art}" already exists'
+    elif owner != transfer["sender"]:
+        return "sender doesn't own the artwork"
+    return None
+
+def mine_batch(batch):
+    """
+    Mine one block holding as many of the batch's transfers as are valid.
+
+    The block template builder orders the batch by dependency (so A→B and
+    B→C of one artwork both go in, whichever arrived first) and drops
+    conflicting transfers, which then fail. If a block from a peer lands
+    while we are mining, the template is rebuilt and mined again on the new
+    tip; if that keeps happening for MINE_ATTEMPTS tries, the transfers fail
+    rather than staying "mining".
+
+    Args:
+        batch: list of (job_id, transfer) pairs
+    """
+    for job_id in OrderedDict.fromkeys(job_id for (job_id, _) in batch):
+        update_job(job_id, status="mining")
+
+    item_of = {} # id(tx) -> (job_id, transfer)
+    signed = []
+    for item in batch:
+        t = item[1]
+        tx = Transaction(t["sender"], t["recipient"], t["artwork_id"], ""); tx.sign(t["sender"])
+        item_of[id(tx)] = item
+        signed.append(tx)
+
+    for _ in range(MINE_ATTEMPTS):
+        view = blockchain.snapshot()
+        txs, conflicts, deferred = build_block_template(view, signed, len(signed))
+        included = [item_of[id(tx)] for tx in txs]
+        rejected = [(item_of[id(tx)], error) for (tx, error) in conflicts]
+        rejected += [(item_of[id(tx)], "sender doesn't own the artwork") for tx in deferred]
+        if not txs:
+            break
+
+        blk = view.mine_next_block(txs)
+        with chain_lock:
+            added = blockchain.add_to_chain(blk)
+            if added:
+                blockchain.save(CHAIN_FILE)
+        if added:
+            broadcast_block(blk.to_dict())
+            record_results(included, block=blk)
+            record_failures(rejected)
+            return
+        if blk.header.prev_block_hash == blockchain.snapshot().blocks[-1].get_id():
+            # rejected on its own merits, not because the tip moved
+            rejected += [(item, "block was rejected") for item in included]
+            break
+    else:
+        # every attempt lost the race to a block from elsewhere
+        rejected += [(item, "chain tip kept moving") for item in included]
+
+    record_failures(rejected)
+
+def record_failures(rejected):
+    """
+    Record failed transfers, one update per job and reason.
+
+    Args:
+        rejected: list of ((job_id, transfer), error) pairs
+    """
+    by_error = OrderedDict()
+    for (item, error) in rejected:
+        by_error.setdefault(error, []).append(item)
+    for error, items in by_error.items():
+        record_results(items, error=error)
+
+def mining_worker():
+    """
+    Background thread: the only miner. Waits for queued transfers, takes
+    up to MAX_BLOCK_TXS of them at a time and mines them into one block.
     """
-    return jsonify([b.to_dict() for b in blockchain.blocks])
+    while True:
+        batch = [mining_queue.get()]
+        while len(batch) < MAX_BLOCK_TXS:
+            try: batch.append(mining_queue.get_nowait())
+            except queue.Empty: break
+        try:
+            mine_batch(batch)
+        except Exception as e:
+            with jobs_lock:
+                unfinished = [item for item in batch if jobs[item[0]]["status"] in ("queued", "mining")]
+            record_results(unfinished, error=str(e))
+
+def new_job(transfers):
+    """
+    Create a job for a list of transfers and hand them to the mining worker.
+
+    Return: the new job dict.
+    """
+    job = {"id": uuid.uuid4().hex, "status": "queued", "count": len(transfers),
+           "mined": 0, "failed": 0, "errors": [], "blocks": [],
+           "submitted_ms": int(time.time() * 1000)}
+    if len(transfers) == 1:
+        job["transfer"] = transfers[0]
+    with jobs_lock:
+        jobs[job["id"]] = job
+        while len(jobs) > MAX_JOBS:
+            oldest = next(iter(jobs))
+            if jobs[oldest]["status"] in ("queued", "mining"):
+                break
+            jobs.popitem(last=False)
+    for transfer in transfers:
+        mining_queue.put((job["id"], transfer))
+    return dict(job)
 
 @app.route("/api/block", methods=["POST"])
 def api_mine():
     """
-    Mine a new block.
+    Queue a transfer to be mined.
 
-    Return: The new block as a JSON object.
+    The proof-of-work runs on the mining worker, so this returns right away
+    with a job id; completion is reported on /stream (JOB_UPDATE) and by
+    GET /api/jobs/<id>.
+
+    Return: The queued job as a JSON object (202).
     """
-    sync_chain()
     data = request.json or {}
     s, r_, art = data.get("sender"), data.get("recipient"), data.get("artwork_id")
     if not all([s, r_, art]):
         return {"error": "missing field"}, 400
 
-    for b in blockchain.blocks:
-        for t in b.transactions:
-            if (t.sender == s and t.recipient == r_ and t.artwork_id == art):
-                return {"error": f"Block #{b.header.block_num} already exists"}, 400
+    job = new_job([{"sender": s, "recipient": r_, "artwork_id": art}])
+    return {"status": "queued", "job_id": job["id"], "job": job}, 202
+
+@app.route("/api/transfers", methods=["POST"])
+def api_bulk_transfers():
+    """
+    Bulk ingest: queue many transfers sent as NDJSON, one
+    {"sender", "recipient", "artwork_id"} object per line.
+
+    Lines are checked in order against current ownership, counting the
+    lines before them, so a catalogue can mint an artwork and move it in the
+    same request. Valid lines become one job; the mining worker packs them
+    into blocks of up to MAX_BLOCK_TXS transfers.
+
+    Return: The job id with accepted/rejected counts (202), or 400 if no
+    line was accepted.
+    """
+    accepted, errors, rejected = [], [], 0
+    pending_owners = {}
+    view = blockchain.snapshot()
+    for number, line in enumerate(request.stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if number > MAX_BULK_LINES:
+            return {"error": f"at most {MAX_BULK_LINES} lines per request"}, 413
+        try:
+            data = json.loads(line)
+            transfer = {k: str(data[k]) for k in ("sender", "recipient", "artwork_id") if data.get(k)}
+        except (ValueError, TypeError, AttributeError):
+            transfer = {}
+        error = "missing field" if len(transfer) < 3 else check_transfer(transfer, pending_owners, view)
+        if error:
+            rejected += 1
+            if len(errors) < 100:
+                errors.append({"line": number, "error": error})
+            continue
+        pending_owners[transfer["artwork_id"]] = transfer["recipient"]
+        accepted.append(transfer)
+
+    if not accepted:
+        return {"error": "no valid transfers", "rejected": rejected, "errors": errors}, 400
+    job = new_job(accepted)
+    return {"status": "queued", "job_id": job["id"], "accepted": len(accepted),
+            "rejected": rejected, "errors": errors}, 202
+
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    """
+    Report the state of a mining job.
+
+    Return: The job as a JSON object, or 404.
+    """
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return {"error": "unknown job"}, 404
+        return dict(job)
+
+@app.route("/api/artwork/<artwork_id>/history")
+def api_artwork_history(artwork_id):
+    """
+    List every main-chain transaction of an artwork, oldest first.
+
+    Return: The artwork's current owner and its history, or 404.
+    """
+    view = blockchain.snapshot()
+    history = [(height, view.blocks[height].get_id(), tx) for (height, tx) in view.history_of(artwork_id)]
+    owner = view.owner_of(artwork_id)
+    if not history:
+        return {"error": "unknown artwork"}, 404
+    return {"artwork_id": artwork_id, "owner": owner,
+            "history": [{"height": height, "block_hash": block_hash, "tx_hash": tx.hash(),
+                         "sender": tx.sender, "recipient": tx.recipient}
+                        for (height, block_hash, tx) in history]}
+
+@app.route("/api/owner/<owner>/holdings")
+def api_owner_holdings(owner):
+    """
+    List the artworks someone currently owns.
+
+    Return: The owner and their artwork ids (empty if they hold nothing).
+    """
+    holdings = blockchain.snapshot().holdings_of(owner)
+    return {"owner": owner, "artworks": holdings}
 
-    tx  = Transaction(s, r_, art, ""); tx.sign(s)
-    blk = blockchain.mine_next_block([tx])
+@app.route("/api/tx/<tx_hash>")
+def api_tx(tx_hash):
+    """
+    Look up a transaction in the main chain by its hash.
+
+    Return: The transaction with its block and position, or 404.
+    """
+    view = blockchain.snapshot()
+    location = view.find_transaction(tx_hash)
+    if location is None:
+        return {"error": "unknown transaction"}, 404
+    height, position = location
+    blk = view.blocks[height]
+    tip = len(view.blocks) - 1
+    return {"tx_hash": tx_hash, "height": height, "position": position,
+            "block_hash": blk.get_id(), "confirmations": tip - height + 1,
+            "transaction": blk.transactions[position].to_dict()}
+
+@app.route("/metrics")
+def metrics():
+    """
+    Report the node's metrics in the Prometheus text format.
 
-    if blockchain.add_to_chain(blk):
-        blockchain.save(CHAIN_FILE)
-        bd = blk.to_dict()
-        push_event = {"type": "BLOCK_ADDED", "block": bd}
-        for q in subscribers: q.put_nowait(push_event)
-        broadcast_block(bd)
-        return {"status": "ok"}
+    Covers mining (hashes, hashrate), Block.validate time per stage, the
+    mining queue, block propagation delay, reorg depth, known peers and
+    connection errors. Updates are a lock and a dict lookup each, so they
+    stay on all the time.
 
-    return {"error": "sender doesn't own the artwork"}, 400
+    Return: The metrics as text/plain.
+    """
+    counts = dict.fromkeys(("queued", "mining", "done", "failed"), 0)
+    with jobs_lock:
+        for job in jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+    for status, n in counts.items():
+        MINING_JOBS.set(n, status=status)
+    return Response(render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/receive_block", methods=["POST"])
 def api_recv():
@@ -151,35 +576,62 @@ def api_recv():
     Return: The status of the block.
     """
     bd  = request.json
-    blk = Block.from_dict(bd)
-
-    sync_chain()
-    if blockchain.add_to_chain(blk):
-        blockchain.save(CHAIN_FILE)
-        push_event = {"type": "BLOCK_ADDED", "block": bd}
-        for q in subscribers: q.put_nowait(push_event)
-        broadcast_block(bd)
+    blk = load_block(bd)
+
+    with chain_lock:
+        added = blockchain.add_to_chain(blk)
+        if added:
+            blockchain.save(CHAIN_FILE)
+    if added:
+        # only blocks we connected count, so duplicates and rejects do not skew it
+        peer.BLOCK_PROPAGATION.observe(max(0, time.time() - blk.header.timestamp_ms / 1000))
+        broadcast_block(bd, relay=True)
         return {"status": "accepted"}, 200
 
-    push_full_chain()
     return {"status": "duplicate"}, 200
 
 @app.route("/stream")
 def stream():
     """
-    Stream the blockchain to the browser.
+    Stream block events to the browser.
+
+    A client that sends Last-Event-ID (or ?last_event_id=) gets only the
+    events it missed. New clients, and clients too far behind to catch up
+    from the hub's ring buffer, get one INIT snapshot and continue from there.
 
-    Return: The stream of the blockchain.
+    Return: The stream of block events.
     """
-    def gen(q):
-        q.put({"type": "INIT",
-               "chain": [b.to_dict() for b in blockchain.blocks]})
-        try:
-            while True: yield f"data:{json.dumps(q.get())}\n\n"
-        finally: subscribers.discard(q)
+    def snapshot():
+        last = hub.last_id
+        view = blockchain.snapshot()
+        chain = b",".join(data for (_, data) in cached_blocks(0, len(view.blocks), view.blocks, fill=False)).decode()
+        return last, f'id:{last}\ndata:{{"type": "INIT", "chain": [{chain}]}}\n\n'
+
+    def gen(last_seen):
+        if last_seen is None or not hub.can_resume(last_seen) or hub.last_id - last_seen > STREAM_MAX_CATCHUP:
+            last_seen, frame = snapshot()
+            yield frame
+        while True:
+            events, lost = hub.read_after(last_seen, timeout=STREAM_KEEPALIVE)
+            if lost:
+                # this tab fell behind the ring buffer: downgrade it to a fresh snapshot
+                last_seen, frame = snapshot()
+                yield frame
+                continue
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, data in events:
+                yield f"id:{event_id}\ndata:{data}\n\n"
+                last_seen = event_id
 
-    q = queue.Queue(maxsize=10); subscribers.add(q)
-    return Response(gen(q), mimetype="text/event-stream")
+    resume = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_seen = int(resume) if resume else None
+    except ValueError:
+        last_seen = None
+    return Response(gen(last_seen), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
 
 if __name__ == "__main__":
     import signal
@@ -187,15 +639,25 @@ if __name__ == "__main__":
     ap.add_argument("--peer-port", type=int, required=True)
     ap.add_argument("--ui-port",   type=int, default=7201)
     ap.add_argument("--tracker",   required=True)
+    ap.add_argument("--max-block-txs", type=int, default=MAX_BLOCK_TXS)
+    ap.add_argument("--keep-blocks", type=int, help="pruned mode: keep only the last N blocks in full")
     args = ap.parse_args()
 
     PEER_PORT   = args.peer_port
     UI_PORT     = args.ui_port
     TRACKER_URL = args.tracker.rstrip("/")
     PEER_ADDR   = f"http://localhost:{PEER_PORT}"
+    MAX_BLOCK_TXS = max(1, args.max_block_txs)
+    if args.keep_blocks:
+        blockchain.keep_blocks = args.keep_blocks
+        blockchain.prune_old_blocks()
+        blockchain.publish()
+
+    peer.MEMPOOL_SIZE.set_function(mining_queue.qsize, peer=f"ui:{UI_PORT}")
+    peer.PEERS_KNOWN.set_function(lambda: len(peer_list), peer=f"ui:{UI_PORT}")
 
-    threading.Thread(target=file_watcher,  daemon=True).start()
     threading.Thread(target=refresh_peers, daemon=True).start()
+    threading.Thread(target=mining_worker, daemon=True).start()
 
     signal.signal(signal.SIGINT, signal.SIG_DFL)
     app.run(port=UI_PORT, threaded=True, debug=False)